@@ -0,0 +1,309 @@
+"""
+Sales analytics kept in small summary tables, so the admin dashboard never
+scans orders/order_items:
+
+    sales_daily        day, kind, item_id -> orders, units, revenue (line totals, before order discounts)
+    sales_daily_totals day -> orders, units, subtotal, discount, revenue (what was actually paid)
+    discount_daily     day, code -> orders, discount, revenue
+    checkout_daily     day -> checkouts created, captured (create-order -> capture conversion,
+                       counted on the day the checkout was created)
+
+A sale is a captured checkout (guests included, not only customers with
+an orders row), on the day it was captured, priced as it was at checkout.
+The server updates the tables in the same transaction that stores or
+captures the checkout (record_checkout, record_capture, record_sale), so
+they can't drift. rebuild() recomputes everything from `checkouts`:
+
+    python analytics.py rebuild [--db shop.db]
+
+Days are UTC dates (SQLite's CURRENT_TIMESTAMP).
+"""
+import argparse
+import sqlite3
+import time
+
+DATABASE = 'shop.db'
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS sales_daily (
+           day      TEXT NOT NULL,
+           kind     TEXT NOT NULL,
+           item_id  INTEGER NOT NULL,
+           name     TEXT,
+           orders   INTEGER NOT NULL DEFAULT 0,
+           units    INTEGER NOT NULL DEFAULT 0,
+           revenue  REAL NOT NULL DEFAULT 0,
+           PRIMARY KEY (day, kind, item_id)
+       ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS sales_daily_totals (
+           day      TEXT PRIMARY KEY,
+           orders   INTEGER NOT NULL DEFAULT 0,
+           units    INTEGER NOT NULL DEFAULT 0,
+           subtotal REAL NOT NULL DEFAULT 0,
+           discount REAL NOT NULL DEFAULT 0,
+           revenue  REAL NOT NULL DEFAULT 0
+       ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS discount_daily (
+           day      TEXT NOT NULL,
+           code     TEXT NOT NULL,
+           orders   INTEGER NOT NULL DEFAULT 0,
+           discount REAL NOT NULL DEFAULT 0,
+           revenue  REAL NOT NULL DEFAULT 0,
+           PRIMARY KEY (day, code)
+       ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS checkout_daily (
+           day      TEXT PRIMARY KEY,
+           created  INTEGER NOT NULL DEFAULT 0,
+           captured INTEGER NOT NULL DEFAULT 0
+       ) WITHOUT ROWID''',
+)
+TABLES = ("sales_daily", "sales_daily_totals", "discount_daily", "checkout_daily")
+
+
+def create_tables(conn):
+    for sql in SCHEMA:
+        conn.execute(sql)
+
+
+def _code(code) -> str | None:
+    return code.strip().upper() if code and code.strip() else None
+
+
+# ----------------------------
+# Incremental updates (caller's transaction)
+# ----------------------------
+
+def record_checkout(conn, day: str):
+    conn.execute("""
+        INSERT INTO checkout_daily (day, created) VALUES (?, 1)
+        ON CONFLICT(day) DO UPDATE SET created = created + 1
+    """, (day,))
+
+
+def record_capture(conn, checkout_day: str):
+    conn.execute("""
+        INSERT INTO checkout_daily (day, captured) VALUES (?, 1)
+        ON CONFLICT(day) DO UPDATE SET captured = captured + 1
+    """, (checkout_day,))
+
+
+def record_sale(conn, day: str, lines: list, subtotal: float, discount: float, total: float, discount_code=None):
+    """lines: [{kind, id, name, unit_price, qty}] as stored in checkouts.lines."""
+    per_item = {}
+    for line in lines:
+        key = (line["kind"], line["id"])
+        units, revenue, _ = per_item.get(key, (0, 0.0, None))
+        per_item[key] = (units + line["qty"], revenue + line["qty"] * line["unit_price"], line["name"])
+    # one row per item, so an item on two lines of the same order still counts as one order
+    conn.executemany("""
+        INSERT INTO sales_daily (day, kind, item_id, name, orders, units, revenue) VALUES (?, ?, ?, ?, 1, ?, ?)
+        ON CONFLICT(day, kind, item_id) DO UPDATE SET
+            name = excluded.name, orders = orders + 1,
+            units = units + excluded.units, revenue = revenue + excluded.revenue
+    """, [(day, kind, iid, name, units, revenue) for (kind, iid), (units, revenue, name) in per_item.items()])
+    conn.execute("""
+        INSERT INTO sales_daily_totals (day, orders, units, subtotal, discount, revenue) VALUES (?, 1, ?, ?, ?, ?)
+        ON CONFLICT(day) DO UPDATE SET
+            orders = orders + 1, units = units + excluded.units, subtotal = subtotal + excluded.subtotal,
+            discount = discount + excluded.discount, revenue = revenue + excluded.revenue
+    """, (day, sum(u for u, _, _ in per_item.values()), subtotal or 0, discount or 0, total or 0))
+    code = _code(discount_code)
+    if code and discount:
+        conn.execute("""
+            INSERT INTO discount_daily (day, code, orders, discount, revenue) VALUES (?, ?, 1, ?, ?)
+            ON CONFLICT(day, code) DO UPDATE SET
+                orders = orders + 1, discount = discount + excluded.discount, revenue = revenue + excluded.revenue
+        """, (day, code, discount, total or 0))
+
+
+# ----------------------------
+# Full rebuild
+# ----------------------------
+
+REBUILD_SQL = (
+    "DELETE FROM sales_daily",
+    """INSERT INTO sales_daily (day, kind, item_id, name, orders, units, revenue)
+       SELECT date(c.captured_at), l.value ->> 'kind', l.value ->> 'id', MAX(l.value ->> 'name'),
+              COUNT(DISTINCT c.paypal_order_id), SUM(l.value ->> 'qty'), SUM((l.value ->> 'qty') * (l.value ->> 'unit_price'))
+         FROM checkouts c, json_each(c.lines) l
+        WHERE c.captured_at IS NOT NULL
+        GROUP BY 1, 2, 3""",
+    "DELETE FROM sales_daily_totals",
+    """INSERT INTO sales_daily_totals (day, orders, units, subtotal, discount, revenue)
+       SELECT date(captured_at), COUNT(*),
+              SUM((SELECT COALESCE(SUM(value ->> 'qty'), 0) FROM json_each(lines))),
+              SUM(COALESCE(subtotal, 0)), SUM(COALESCE(discount, 0)), SUM(COALESCE(total, 0))
+         FROM checkouts
+        WHERE captured_at IS NOT NULL
+        GROUP BY 1""",
+    "DELETE FROM discount_daily",
+    """INSERT INTO discount_daily (day, code, orders, discount, revenue)
+       SELECT date(captured_at), UPPER(TRIM(discount_code)), COUNT(*), SUM(discount), SUM(COALESCE(total, 0))
+         FROM checkouts
+        WHERE captured_at IS NOT NULL AND TRIM(COALESCE(discount_code, '')) != '' AND discount > 0
+        GROUP BY 1, 2""",
+    "DELETE FROM checkout_daily",
+    """INSERT INTO checkout_daily (day, created, captured)
+       SELECT date(created_at), COUNT(*), COUNT(captured_at)
+         FROM checkouts
+        GROUP BY 1""",
+)
+
+
+def rebuild(conn) -> dict:
+    """Recompute every summary table from checkouts. Caller commits (one transaction)."""
+    t0 = time.perf_counter()
+    for sql in REBUILD_SQL:
+        conn.execute(sql)
+    info = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in TABLES}
+    info["seconds"] = round(time.perf_counter() - t0, 3)
+    return info
+
+
+# Same sums for one slice of checkouts (paypal_order_id order), added onto what
+# the tables already hold: init_db's migration 12 builds them chunk by chunk
+# instead of holding the write lock for a whole rebuild.
+CHUNK_CTE = "WITH chunk AS (SELECT * FROM checkouts WHERE paypal_order_id > ?1 ORDER BY paypal_order_id LIMIT ?2)"
+ADD_CHUNK_SQL = (
+    f"""{CHUNK_CTE}
+       INSERT INTO sales_daily (day, kind, item_id, name, orders, units, revenue)
+       SELECT date(c.captured_at), l.value ->> 'kind', l.value ->> 'id', MAX(l.value ->> 'name'),
+              COUNT(DISTINCT c.paypal_order_id), SUM(l.value ->> 'qty'), SUM((l.value ->> 'qty') * (l.value ->> 'unit_price'))
+         FROM chunk c, json_each(c.lines) l
+        WHERE c.captured_at IS NOT NULL
+        GROUP BY 1, 2, 3
+       ON CONFLICT(day, kind, item_id) DO UPDATE SET
+           name = MAX(name, excluded.name), orders = orders + excluded.orders,
+           units = units + excluded.units, revenue = revenue + excluded.revenue""",
+    f"""{CHUNK_CTE}
+       INSERT INTO sales_daily_totals (day, orders, units, subtotal, discount, revenue)
+       SELECT date(captured_at), COUNT(*),
+              SUM((SELECT COALESCE(SUM(value ->> 'qty'), 0) FROM json_each(lines))),
+              SUM(COALESCE(subtotal, 0)), SUM(COALESCE(discount, 0)), SUM(COALESCE(total, 0))
+         FROM chunk
+        WHERE captured_at IS NOT NULL
+        GROUP BY 1
+       ON CONFLICT(day) DO UPDATE SET
+           orders = orders + excluded.orders, units = units + excluded.units, subtotal = subtotal + excluded.subtotal,
+           discount = discount + excluded.discount, revenue = revenue + excluded.revenue""",
+    f"""{CHUNK_CTE}
+       INSERT INTO discount_daily (day, code, orders, discount, revenue)
+       SELECT date(captured_at), UPPER(TRIM(discount_code)), COUNT(*), SUM(discount), SUM(COALESCE(total, 0))
+         FROM chunk
+        WHERE captured_at IS NOT NULL AND TRIM(COALESCE(discount_code, '')) != '' AND discount > 0
+        GROUP BY 1, 2
+       ON CONFLICT(day, code) DO UPDATE SET
+           orders = orders + excluded.orders, discount = discount + excluded.discount, revenue = revenue + excluded.revenue""",
+    f"""{CHUNK_CTE}
+       INSERT INTO checkout_daily (day, created, captured)
+       SELECT date(created_at), COUNT(*), COUNT(captured_at)
+         FROM chunk
+        WHERE true
+        GROUP BY 1
+       ON CONFLICT(day) DO UPDATE SET created = created + excluded.created, captured = captured + excluded.captured""",
+)
+
+
+def add_chunk(conn, after_key: str, limit: int) -> tuple[int, str | None]:
+    """Add the next `limit` checkouts after paypal_order_id `after_key` to the summaries. Returns (count, last key)."""
+    count, last = conn.execute(f"{CHUNK_CTE} SELECT COUNT(*), MAX(paypal_order_id) FROM chunk", (after_key, limit)).fetchone()
+    if count:
+        for sql in ADD_CHUNK_SQL:
+            conn.execute(sql, (after_key, limit))
+    return count, last
+
+
+# ----------------------------
+# Queries (all on the summary tables, by day range)
+# ----------------------------
+
+def _rows(cur) -> list:
+    cols = [d[0] for d in cur.description]
+    return [dict(zip(cols, r)) for r in cur]
+
+
+def daily(conn, start: str, end: str) -> list:
+    """One row per day with sales and checkout conversion (days without either are left out)."""
+    return _rows(conn.execute("""
+        SELECT d.day,
+               COALESCE(t.orders, 0) AS orders, COALESCE(t.units, 0) AS units,
+               ROUND(COALESCE(t.subtotal, 0), 2) AS subtotal, ROUND(COALESCE(t.discount, 0), 2) AS discount,
+               ROUND(COALESCE(t.revenue, 0), 2) AS revenue,
+               COALESCE(c.created, 0) AS checkouts, COALESCE(c.captured, 0) AS captured,
+               ROUND(CAST(c.captured AS REAL) / NULLIF(c.created, 0), 4) AS conversion
+          FROM (SELECT day FROM sales_daily_totals WHERE day BETWEEN ?1 AND ?2
+                UNION SELECT day FROM checkout_daily WHERE day BETWEEN ?1 AND ?2) d
+          LEFT JOIN sales_daily_totals t ON t.day = d.day
+          LEFT JOIN checkout_daily c ON c.day = d.day
+         ORDER BY d.day
+    """, (start, end)))
+
+
+def totals(conn, start: str, end: str) -> dict:
+    row = conn.execute("""
+        SELECT COALESCE(SUM(orders), 0), COALESCE(SUM(units), 0), ROUND(COALESCE(SUM(subtotal), 0), 2),
+               ROUND(COALESCE(SUM(discount), 0), 2), ROUND(COALESCE(SUM(revenue), 0), 2)
+          FROM sales_daily_totals WHERE day BETWEEN ? AND ?
+    """, (start, end)).fetchone()
+    created, captured = conn.execute("""
+        SELECT COALESCE(SUM(created), 0), COALESCE(SUM(captured), 0) FROM checkout_daily WHERE day BETWEEN ? AND ?
+    """, (start, end)).fetchone()
+    return {"orders": row[0], "units": row[1], "subtotal": row[2], "discount": row[3], "revenue": row[4],
+            "checkouts": created, "captured": captured,
+            "conversion": round(captured / created, 4) if created else None}
+
+
+def items(conn, start: str, end: str, kind: str | None = None, limit: int = 50, by_day: bool = False) -> list:
+    """Best sellers by revenue over the range, or (by_day) revenue per item per day."""
+    where, params = "day BETWEEN ? AND ?", [start, end]
+    if kind:
+        where += " AND kind = ?"
+        params.append(kind)
+    if by_day:
+        return _rows(conn.execute(f"""
+            SELECT day, kind, item_id, name, orders, units, ROUND(revenue, 2) AS revenue
+              FROM sales_daily WHERE {where}
+             ORDER BY day, kind, item_id
+             LIMIT ?
+        """, (*params, limit)))
+    # With a single MAX() SQLite takes the bare column (name) from that row: the name on the last day sold
+    return _rows(conn.execute(f"""
+        SELECT kind, item_id, name, MAX(day) AS last_sold,
+               SUM(orders) AS orders, SUM(units) AS units, ROUND(SUM(revenue), 2) AS revenue
+          FROM sales_daily WHERE {where}
+         GROUP BY kind, item_id
+         ORDER BY SUM(revenue) DESC
+         LIMIT ?
+    """, (*params, limit)))
+
+
+def discounts(conn, start: str, end: str) -> list:
+    return _rows(conn.execute("""
+        SELECT code, SUM(orders) AS orders, ROUND(SUM(discount), 2) AS discount, ROUND(SUM(revenue), 2) AS revenue
+          FROM discount_daily WHERE day BETWEEN ? AND ?
+         GROUP BY code
+         ORDER BY SUM(orders) DESC
+    """, (start, end)))
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Sales summary tables of shop.db")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("rebuild", help="recompute all summary tables from checkouts")
+    r.add_argument("--db", default=DATABASE)
+    args = ap.parse_args()
+
+    if args.cmd == "rebuild":
+        conn = sqlite3.connect(args.db, isolation_level=None, timeout=30)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            create_tables(conn)
+            info = rebuild(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        print(f"✔ Rebuilt {', '.join(f'{t}: {info[t]} rows' for t in TABLES)} in {info['seconds']}s")
@@ -0,0 +1,210 @@
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+
+DATABASE = 'shop.db'
+BACKUP_DIR = 'backups'
+SNAPSHOT_PREFIX = 'shop-'
+
+
+def _integrity_check(path: str) -> str:
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        conn.close()
+    return "ok" if rows == [("ok",)] else "; ".join(r[0] for r in rows[:10])
+
+
+def list_snapshots(dest_dir: str = BACKUP_DIR) -> list[str]:
+    """Snapshot paths, newest first (names sort by timestamp)."""
+    if not os.path.isdir(dest_dir):
+        return []
+    names = [n for n in os.listdir(dest_dir)
+             if n.startswith(SNAPSHOT_PREFIX) and (n.endswith(".db") or n.endswith(".db.gz"))]
+    return [os.path.join(dest_dir, n) for n in sorted(names, reverse=True)]
+
+
+def rotate(dest_dir: str, keep: int) -> list[str]:
+    removed = []
+    for path in list_snapshots(dest_dir)[max(keep, 1):]:
+        os.remove(path)
+        removed.append(path)
+    return removed
+
+
+def backup(src_path: str = DATABASE, dest_dir: str = BACKUP_DIR, pages: int = 256, pause: float = 0.02,
+           compress: bool = False, keep: int = 7) -> dict:
+    """
+    Hot backup of src_path using the SQLite online backup API.
+
+    Copies `pages` pages per step and sleeps `pause` seconds between steps,
+    so the live server keeps getting disk time. In WAL mode the source
+    connection pins one read snapshot for the whole copy: writers carry on
+    and the backup doesn't restart every time someone commits. The snapshot
+    is written to a temp file, integrity-checked, optionally gzipped, then
+    renamed into place and old snapshots beyond `keep` are rotated out.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    final = os.path.join(dest_dir, f"{SNAPSHOT_PREFIX}{stamp}.db")
+    tmp = final + ".tmp"
+    t0 = time.perf_counter()
+    steps = 0
+
+    def paced(status, remaining, total):
+        nonlocal steps
+        steps += 1
+        if remaining and pause > 0:
+            time.sleep(pause)
+
+    src = sqlite3.connect(src_path, timeout=30, isolation_level=None)
+    dst = sqlite3.connect(tmp)
+    try:
+        if src.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+            # Open a read transaction so every step sees the same snapshot
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        src.backup(dst, pages=pages, progress=paced)
+        page_count = dst.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+
+    integrity = _integrity_check(tmp)
+    if integrity != "ok":
+        os.remove(tmp)
+        raise RuntimeError(f"backup failed integrity check: {integrity}")
+
+    if compress:
+        final += ".gz"
+        with open(tmp, "rb") as raw, gzip.open(final + ".tmp", "wb", compresslevel=6) as gz:
+            shutil.copyfileobj(raw, gz, 1024 * 1024)
+        os.remove(tmp)
+        tmp = final + ".tmp"
+    os.replace(tmp, final)
+
+    removed = rotate(dest_dir, keep)
+    return {
+        "path": final,
+        "bytes": os.path.getsize(final),
+        "pages": page_count,
+        "steps": steps,
+        "seconds": round(time.perf_counter() - t0, 3),
+        "integrity": integrity,
+        "rotated_out": removed,
+    }
+
+
+def _materialize(snapshot: str) -> tuple[str, bool]:
+    """Plain .db path for a snapshot (decompressing .gz to a temp file). Returns (path, is_temp)."""
+    if not snapshot.endswith(".gz"):
+        return snapshot, False
+    fd, path = tempfile.mkstemp(suffix=".db")
+    with os.fdopen(fd, "wb") as out, gzip.open(snapshot, "rb") as gz:
+        shutil.copyfileobj(gz, out, 1024 * 1024)
+    return path, True
+
+
+def verify(snapshot: str) -> str:
+    path, is_temp = _materialize(snapshot)
+    try:
+        return _integrity_check(path)
+    finally:
+        if is_temp:
+            os.remove(path)
+
+
+def restore(snapshot: str, target_path: str = DATABASE, dest_dir: str = BACKUP_DIR, safety_copy: bool = True) -> dict:
+    """
+    Restore a snapshot into target_path through the backup API, so processes
+    that still have the database open see the restored content instead of a
+    swapped-out file. The current database is snapshotted first (safety_copy).
+    """
+    path, is_temp = _materialize(snapshot)
+    try:
+        integrity = _integrity_check(path)
+        if integrity != "ok":
+            raise RuntimeError(f"snapshot failed integrity check: {integrity}")
+        safety = None
+        if safety_copy and os.path.exists(target_path):
+            safety = backup(target_path, dest_dir, pages=-1, pause=0, keep=10_000)["path"]
+        src = sqlite3.connect(path)
+        dst = sqlite3.connect(target_path, timeout=30)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+    finally:
+        if is_temp:
+            os.remove(path)
+    return {"restored": snapshot, "into": target_path, "safety_copy": safety}
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Online backups of shop.db")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    b = sub.add_parser("backup", help="take a snapshot now")
+    b.add_argument("--db", default=DATABASE)
+    b.add_argument("--dest", default=BACKUP_DIR)
+    b.add_argument("--pages", type=int, default=256, help="pages copied per step (-1 = all at once)")
+    b.add_argument("--pause-ms", type=float, default=20, help="sleep between steps")
+    b.add_argument("--compress", action="store_true", help="gzip the snapshot")
+    b.add_argument("--keep", type=int, default=7, help="snapshots to keep")
+
+    l = sub.add_parser("list", help="list snapshots, newest first")
+    l.add_argument("--dest", default=BACKUP_DIR)
+
+    v = sub.add_parser("verify", help="integrity-check a snapshot")
+    v.add_argument("snapshot")
+
+    r = sub.add_parser("restore", help="restore a snapshot into the database")
+    r.add_argument("snapshot", help="snapshot path, or 'latest'")
+    r.add_argument("--db", default=DATABASE)
+    r.add_argument("--dest", default=BACKUP_DIR, help="where snapshots (and the safety copy) live")
+    r.add_argument("--no-safety-copy", action="store_true")
+    r.add_argument("--yes", action="store_true", help="don't ask for confirmation")
+
+    args = ap.parse_args()
+    try:
+        if args.cmd == "backup":
+            info = backup(args.db, args.dest, pages=args.pages, pause=args.pause_ms / 1000.0,
+                          compress=args.compress, keep=args.keep)
+            print(f"✔ Snapshot {info['path']} ({info['bytes']} bytes, {info['pages']} pages, {info['seconds']}s)")
+            for path in info["rotated_out"]:
+                print(f"  rotated out {path}")
+        elif args.cmd == "list":
+            for path in list_snapshots(args.dest):
+                print(f"{path}  {os.path.getsize(path)} bytes")
+        elif args.cmd == "verify":
+            result = verify(args.snapshot)
+            print(f"{args.snapshot}: {result}")
+            exit(0 if result == "ok" else 1)
+        elif args.cmd == "restore":
+            snapshot = args.snapshot
+            if snapshot == "latest":
+                snaps = list_snapshots(args.dest)
+                if not snaps:
+                    print(f"No snapshots in {args.dest}")
+                    exit(1)
+                snapshot = snaps[0]
+            if not args.yes and input(f"Restore {snapshot} into {args.db}? This overwrites it. [y/N] ").strip().lower() != "y":
+                print("Aborted.")
+                exit(1)
+            info = restore(snapshot, args.db, args.dest, safety_copy=not args.no_safety_copy)
+            print(f"✔ Restored {info['restored']} into {info['into']}")
+            if info["safety_copy"]:
+                print(f"  previous database saved as {info['safety_copy']}")
+    except sqlite3.Error as e:
+        print(f"SQL error: {e}")
+        exit(1)
+    except Exception as e:
+        print(f"Error: {e}")
+        exit(1)
@@ -0,0 +1,23 @@
+"""
+Benchmarks for the backend. Run from the back/ directory, e.g.
+
+    py -m bench.api --size small
+    py -m bench.api --size large --save-baseline
+    py -m bench.seed --products 100000 --images 5 --db shop.db
+    py -m bench.serialize --products 100000
+    py -m bench.catalog --products 200000
+    py -m bench.images
+    py -m bench.analytics --days 365 --per-day 500
+    py -m bench.webhook_replay run --checkouts 200 --duplicates 3
+
+bench.api compares its results with bench/baseline.json and exits 1 on a
+regression. Latencies depend on the machine, so no baseline is committed:
+record one on the machine that runs the check (--save-baseline), and pass
+--require-baseline there so a missing one fails instead of passing silently.
+
+tests/test_webhooks.py (py -m pytest tests) uses paypal_stub and
+webhook_replay the same way, with the queue drained by the test itself.
+
+Everything runs against a throwaway working directory with its own shop.db,
+uploads folder and server.log, so it never touches the real database.
+"""
@@ -0,0 +1,112 @@
+import argparse
+import json
+import random
+import sqlite3
+import statistics
+import time
+from datetime import date, timedelta
+
+from bench import common, seed
+
+import analytics
+
+# What the dashboard asks for, computed straight from the base tables
+RAW_DAILY_ITEMS_SQL = """
+    SELECT date(c.captured_at) AS day, l.value ->> 'kind', l.value ->> 'id',
+           COUNT(DISTINCT c.paypal_order_id), SUM(l.value ->> 'qty'), SUM((l.value ->> 'qty') * (l.value ->> 'unit_price'))
+      FROM checkouts c, json_each(c.lines) l
+     WHERE c.captured_at IS NOT NULL AND date(c.captured_at) BETWEEN ? AND ?
+     GROUP BY 1, 2, 3
+"""
+RAW_TOP_ITEMS_SQL = """
+    SELECT l.value ->> 'kind', l.value ->> 'id', SUM((l.value ->> 'qty') * (l.value ->> 'unit_price')) AS revenue
+      FROM checkouts c, json_each(c.lines) l
+     WHERE c.captured_at IS NOT NULL AND date(c.captured_at) BETWEEN ? AND ?
+     GROUP BY 1, 2
+     ORDER BY revenue DESC
+     LIMIT 50
+"""
+RAW_TOTALS_SQL = """
+    SELECT COUNT(*), COUNT(captured_at), SUM(CASE WHEN captured_at IS NOT NULL THEN total END)
+      FROM checkouts WHERE date(created_at) BETWEEN ? AND ?
+"""
+
+
+def seed_sales(conn, days: int, per_day: int, products: int, rng: random.Random):
+    """per_day checkouts a day for `days` days up to today, ~80% captured, 1-4 lines each."""
+    today = date.today()
+    codes = (None, None, None, "DEV10", "SAVE5")
+    n = 0
+    for d in range(days):
+        day = (today - timedelta(days=days - 1 - d)).isoformat()
+        rows = []
+        for _ in range(per_day):
+            n += 1
+            lines = [{"kind": "product", "id": rng.randint(1, products), "name": "x", "unit_price": 10.0,
+                      "qty": rng.randint(1, 3)} for _ in range(rng.randint(1, 4))]
+            subtotal = sum(l["qty"] * l["unit_price"] for l in lines)
+            code = rng.choice(codes)
+            discount = round(subtotal * 0.1, 2) if code == "DEV10" else (5.0 if code == "SAVE5" else 0.0)
+            captured = f"{day} 12:00:00" if rng.random() < 0.8 else None
+            rows.append((f"PP{n}", json.dumps(lines), subtotal, discount, subtotal - discount, code,
+                         f"{day} 11:59:00", captured))
+        conn.executemany("""
+            INSERT INTO checkouts (paypal_order_id, lines, subtotal, discount, total, discount_code, created_at, captured_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+    conn.commit()
+    return n
+
+
+def timed(fn, runs: int) -> dict:
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return {"p50_ms": round(statistics.median(times) * 1000, 2), "max_ms": round(max(times) * 1000, 2)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Sales dashboard: aggregating checkouts per request vs analytics.py summary tables")
+    ap.add_argument("--days", type=int, default=365)
+    ap.add_argument("--per-day", type=int, default=500)
+    ap.add_argument("--products", type=int, default=2000)
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+
+    with common.workdir():
+        seed.seed_catalog("shop.db", products=args.products, services=0, images=0)
+        conn = sqlite3.connect("shop.db")
+        try:
+            t0 = time.perf_counter()
+            n = seed_sales(conn, args.days, args.per_day, args.products, random.Random(7))
+            print(f"Seeded {n} checkouts over {args.days} days in {time.perf_counter() - t0:.1f}s")
+            t0 = time.perf_counter()
+            info = analytics.rebuild(conn)
+            conn.commit()
+            print(f"analytics.rebuild(): {info} ({(time.perf_counter() - t0) * 1000:.0f} ms)")
+
+            end = date.today()
+            results = {}
+            for span in (7, 30, 365):
+                rng = ((end - timedelta(days=span - 1)).isoformat(), end.isoformat())
+                # dashboard landing: totals + top 50 items
+                results[f"{span}d totals+top50: raw scan"] = timed(
+                    lambda: (conn.execute(RAW_TOP_ITEMS_SQL, rng).fetchall(),
+                             conn.execute(RAW_TOTALS_SQL, rng).fetchall()), args.runs)
+                results[f"{span}d totals+top50: summaries"] = timed(
+                    lambda: (analytics.items(conn, *rng), analytics.totals(conn, *rng), analytics.daily(conn, *rng)), args.runs)
+                # full revenue per product per day (output grows with the range either way)
+                results[f"{span}d per item per day: raw scan"] = timed(
+                    lambda: conn.execute(RAW_DAILY_ITEMS_SQL, rng).fetchall(), args.runs)
+                results[f"{span}d per item per day: summaries"] = timed(
+                    lambda: analytics.items(conn, *rng, limit=10_000_000, by_day=True), args.runs)
+        finally:
+            conn.close()
+    common.print_table(f"Sales dashboard queries ({n} checkouts of history, {args.runs} runs)",
+                       results, columns=("p50_ms", "max_ms"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from bench import common, seed
+from bench.paypal_stub import start_stub
+
+SCENARIOS = ("list_products", "product_detail", "login", "create_order", "capture_order", "upload")
+
+# Relative share of --requests per scenario (the full listing and PBKDF2 logins are the slow ones)
+WEIGHTS = {"list_products": 0.1, "login": 0.25, "upload": 0.25}
+
+BASELINE_PATH = os.path.join(common.BENCH_DIR, "baseline.json")
+
+
+def http(method: str, url: str, body: bytes | None = None, headers: dict | None = None, timeout: float = 120):
+    req = urllib.request.Request(url, data=body, headers=headers or {}, method=method)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def http_json(method: str, url: str, obj=None, headers: dict | None = None):
+    body = json.dumps(obj).encode() if obj is not None else None
+    status, raw = http(method, url, body, {**(headers or {}), "Content-Type": "application/json"})
+    try:
+        return status, json.loads(raw or b"null")
+    except ValueError:
+        return status, None
+
+
+def _sample_image() -> bytes | None:
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    size = (2000, 1500)
+    img = Image.merge("RGB", [Image.effect_noise(size, sigma).convert("L") for sigma in (40, 60, 80)])
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+def _multipart(field: str, filename: str, data: bytes, content_type: str):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+class Runner:
+    def __init__(self, base: str, products: int, rng: random.Random):
+        self.base = base
+        self.products = products
+        self.rng = rng
+        self.rng_lock = threading.Lock()
+        status, data = http_json("POST", f"{base}/api/auth/login", {"email": seed.ADMIN_EMAIL, "password": seed.PASSWORD})
+        if status != 200:
+            raise RuntimeError(f"admin login failed: {status} {data}")
+        self.admin_headers = {"Authorization": f"Bearer {data['token']}"}
+        self.capture_ids = []
+        self.image = None
+
+    def _randint(self, lo, hi):
+        with self.rng_lock:
+            return self.rng.randint(lo, hi)
+
+    def _cart(self):
+        return [{"id": self._randint(1, self.products), "kind": "product", "qty": self._randint(1, 3)}
+                for _ in range(self._randint(1, 5))]
+
+    def prepare(self, scenario: str, n: int):
+        if scenario == "capture_order":
+            self.capture_ids = []
+            for _ in range(n):
+                status, data = http_json("POST", f"{self.base}/api/paypal/create-order", {"items": self._cart()})
+                if status == 200:
+                    self.capture_ids.append(data["id"])
+        elif scenario == "upload":
+            self.image = _sample_image()
+
+    def call(self, scenario: str, i: int) -> int:
+        if scenario == "list_products":
+            return http("GET", f"{self.base}/api/products")[0]
+        if scenario == "product_detail":
+            return http("GET", f"{self.base}/api/products/{self._randint(1, self.products)}")[0]
+        if scenario == "login":
+            return http_json("POST", f"{self.base}/api/auth/login", {"email": seed.USER_EMAIL, "password": seed.PASSWORD})[0]
+        if scenario == "create_order":
+            return http_json("POST", f"{self.base}/api/paypal/create-order", {"items": self._cart()})[0]
+        if scenario == "capture_order":
+            return http_json("POST", f"{self.base}/api/paypal/capture-order", {"order_id": self.capture_ids[i]})[0]
+        if scenario == "upload":
+            body, ctype = _multipart("image", f"photo_{i}.jpg", self.image, "image/jpeg")
+            return http("POST", f"{self.base}/api/upload/image", body, {**self.admin_headers, "Content-Type": ctype})[0]
+        raise ValueError(scenario)
+
+
+def run_scenario(runner: Runner, scenario: str, n: int, concurrency: int) -> dict:
+    runner.prepare(scenario, n)
+    if scenario == "capture_order":
+        n = len(runner.capture_ids)
+    if scenario == "upload" and runner.image is None:
+        return {"skipped": "Pillow not installed"}
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        t0 = time.perf_counter()
+        try:
+            status = runner.call(scenario, i)
+        except Exception:
+            status = 599
+        elapsed = time.perf_counter() - t0
+        with lock:
+            if status >= 400:
+                errors += 1
+            else:
+                latencies.append(elapsed)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(n)))
+    return common.summarize(latencies, errors, time.perf_counter() - t0)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Concurrent load test of the Flask API against a seeded shop.db")
+    ap.add_argument("--size", choices=sorted(seed.SIZES), default="small")
+    ap.add_argument("--products", type=int, help="override the preset catalog size")
+    ap.add_argument("--images", type=int, help="override images per product")
+    ap.add_argument("--requests", type=int, default=200, help="requests per scenario (scaled by scenario weight)")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--paypal-latency-ms", type=float, default=0.0, help="artificial latency of the PayPal stub")
+    ap.add_argument("--baseline", default=BASELINE_PATH)
+    ap.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    ap.add_argument("--require-baseline", action="store_true", help="exit 2 when there is no baseline for this key (CI)")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed regression vs baseline (0.25 = 25%%)")
+    ap.add_argument("--json", help="also write results to this file")
+    ap.add_argument("--keep", action="store_true", help="keep the temporary working directory")
+    args = ap.parse_args()
+
+    preset = seed.SIZES[args.size]
+    products = args.products if args.products is not None else preset["products"]
+    images = args.images if args.images is not None else preset["images"]
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        ap.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    key = f"{args.size}:{products}x{images}:c{args.concurrency}"
+
+    stub, stub_url = start_stub(latency_ms=args.paypal_latency_ms)
+    results = {}
+    with common.workdir(keep=args.keep):
+        info = seed.seed_catalog("shop.db", products=products, services=preset["services"], images=images)
+        print(f"Seeded catalog: {info}")
+        server = common.load_server(PAYPAL_API_BASE=stub_url, PAYPAL_CLIENT_ID="bench", PAYPAL_CLIENT_SECRET="bench")
+        from werkzeug.serving import make_server
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)  # no per-request access log
+        httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+        threading.Thread(target=httpd.serve_forever, name="bench-server", daemon=True).start()
+        base = f"http://127.0.0.1:{httpd.server_port}"
+        try:
+            with common.quiet():
+                runner = Runner(base, products, random.Random(1234))
+            for scenario in scenarios:
+                n = max(5, int(args.requests * WEIGHTS.get(scenario, 1.0)))
+                print(f"  running {scenario} ({n} requests, concurrency {args.concurrency})...", file=sys.stderr)
+                with common.quiet():
+                    results[scenario] = run_scenario(runner, scenario, n, args.concurrency)
+        finally:
+            httpd.shutdown()
+            stub.shutdown()
+            server.DB_POOL.clear()
+
+    measured = {k: v for k, v in results.items() if "skipped" not in v}
+    common.print_table(f"Results [{key}]", measured)
+    for name, r in results.items():
+        if "skipped" in r:
+            print(f"  {name}: skipped ({r['skipped']})")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "results": results}, f, indent=2)
+
+    if args.save_baseline:
+        common.save_baseline(args.baseline, key, measured)
+        print(f"\nSaved baseline for {key} to {args.baseline}")
+        return 0
+
+    baseline = common.load_baseline(args.baseline).get(key)
+    if not baseline:
+        print(f"\nNo baseline for {key} in {args.baseline} (run with --save-baseline to record one)")
+        return 2 if args.require_baseline else 0
+    problems = common.compare(measured, baseline, args.tolerance)
+    if problems:
+        print("\nREGRESSIONS vs baseline:")
+        for p in problems:
+            print(f"  - {p}")
+        return 1
+    print(f"\nNo regressions vs baseline (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import argparse
+import gc
+import sqlite3
+import statistics
+import time
+import tracemalloc
+
+from bench import common, seed
+
+import catalogstore
+import serializer
+
+ITEMS_SQL = ("SELECT id, name, bio, price, discount_price, effective_price, limited_edition, sold_out "
+             "FROM products ORDER BY id")
+IMAGES_SQL = "SELECT product_id, image_path FROM product_images ORDER BY product_id, sort_order, id"
+FLAGS = ("limited_edition", "sold_out")
+LIST_JSON = serializer.RowSerializer(
+    ("id", "name", "bio", "price", "discount_price", "limited_edition", "sold_out", "image_url", "image_count"))
+
+# (label, select() kwargs)
+QUERIES = (
+    ("price 50-300, in stock, by price", {"sort": "price", "min_price": 50, "max_price": 300, "flags": {"sold_out": False}}),
+    ("most expensive first", {"sort": "-price"}),
+    ("limited edition, by id", {"sort": "id", "flags": {"limited_edition": True}}),
+    ("by name, deep page", {"sort": "name", "offset": 10_000}),
+)
+
+
+def build_dicts(conn):
+    """A dict per product plus a list of image paths, the shape row_to_product used to build."""
+    items, by_id = [], {}
+    for r in conn.execute(ITEMS_SQL):
+        d = {"id": r[0], "name": r[1], "bio": r[2], "price": r[3], "discount_price": r[4],
+             "effective_price": r[5], "limited_edition": r[6], "sold_out": r[7], "images": []}
+        items.append(d)
+        by_id[r[0]] = d
+    for pid, path in conn.execute(IMAGES_SQL):
+        by_id[pid]["images"].append(path)
+    return items
+
+
+def build_compact(conn):
+    return catalogstore.CompactCatalog.build(conn.execute(ITEMS_SQL), conn.execute(IMAGES_SQL), FLAGS)
+
+
+def query_dicts(items, sort="id", min_price=None, max_price=None, flags=None, offset=0, limit=50):
+    lo = float("-inf") if min_price is None else min_price
+    hi = float("inf") if max_price is None else max_price
+    flags = flags or {}
+    matches = [d for d in items
+               if lo <= d["effective_price"] <= hi and all(bool(d[k]) == v for k, v in flags.items())]
+    key = sort.lstrip("-")
+    keyfn = {"id": lambda d: d["id"], "price": lambda d: (d["effective_price"], d["id"]),
+             "name": lambda d: ((d["name"] or "").casefold(), d["id"])}[key]
+    matches.sort(key=keyfn, reverse=sort.startswith("-"))
+    page = [{**{k: d[k] for k in ("id", "name", "bio", "price", "discount_price", "limited_edition", "sold_out")},
+             "image_url": d["images"][0] if d["images"] else None, "image_count": len(d["images"])}
+            for d in matches[offset:offset + limit]]
+    return serializer.dumps(page)
+
+
+def query_compact(cat, limit=50, **kw):
+    total, page = cat.select(limit=limit, **kw)
+    return LIST_JSON.encode_rows(cat.rows(page))
+
+
+def retained(build, conn) -> tuple:
+    gc.collect()
+    t0 = time.perf_counter()
+    build(conn)
+    seconds = time.perf_counter() - t0  # timed without tracemalloc, which slows allocation-heavy code a lot
+    gc.collect()
+    tracemalloc.start()
+    obj = build(conn)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, {"build_ms": round(seconds * 1000), "retained_mb": round(current / 1e6, 1), "peak_mb": round(peak / 1e6, 1)}
+
+
+def timed(fn, runs: int) -> dict:
+    first = None
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+        if first is None:
+            first = times[0]
+    return {"first_ms": round(first * 1000, 1), "p50_ms": round(statistics.median(times) * 1000, 2)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Product catalog in memory: dict per row vs catalogstore.CompactCatalog")
+    ap.add_argument("--products", type=int, default=200_000)
+    ap.add_argument("--images", type=int, default=3)
+    ap.add_argument("--runs", type=int, default=7)
+    args = ap.parse_args()
+
+    with common.workdir():
+        info = seed.seed_catalog("shop.db", products=args.products, services=0, images=args.images)
+        print(f"Seeded catalog: {info}")
+        conn = sqlite3.connect("shop.db")
+        try:
+            items, mem_dicts = retained(build_dicts, conn)
+            cat, mem_compact = retained(build_compact, conn)
+        finally:
+            conn.close()
+
+    common.print_table(f"Building the catalog ({args.products} products x {args.images} images)",
+                       {"dict per row": mem_dicts, "CompactCatalog": mem_compact},
+                       columns=("build_ms", "retained_mb", "peak_mb"))
+    print(f"  CompactCatalog.nbytes() estimate: {cat.nbytes() / 1e6:.1f} MB")
+
+    results = {}
+    for label, kw in QUERIES:
+        results[f"dicts: {label}"] = timed(lambda: query_dicts(items, **kw), args.runs)
+        results[f"compact: {label}"] = timed(lambda: query_compact(cat, **kw), args.runs)
+        assert query_dicts(items, **kw) == query_compact(cat, **kw), f"results differ for {label}"
+    common.print_table(f"Filter + sort + encode a 50-item page ({args.runs} runs; first run includes building sort orders)",
+                       results, columns=("first_ms", "p50_ms"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import contextlib
+import importlib
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACK_DIR = os.path.dirname(BENCH_DIR)
+
+if BACK_DIR not in sys.path:
+    sys.path.insert(0, BACK_DIR)
+
+
+@contextlib.contextmanager
+def workdir(keep: bool = False):
+    """chdir into a fresh temp directory (shop.db, static/uploads and server.log land there)."""
+    old = os.getcwd()
+    path = tempfile.mkdtemp(prefix="shop-bench-")
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(old)
+        if keep:
+            print(f"Kept benchmark directory: {path}")
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Swallow stdout (log() prints every line it writes to server.log)."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def load_server(**env):
+    """Import server.py with benchmark-friendly defaults. Must run inside workdir()."""
+    # The first request starts the background tasks; no maintenance tasks running in the middle of a measurement
+    defaults = {"SECRET_KEY": "bench-secret", "MAX_UPLOAD_MB": "10", "PROFILE_SLOW_MS": "0", "MAINT_ENABLED": "0"}
+    for k, v in {**defaults, **env}.items():
+        os.environ[k] = str(v)
+    with quiet():
+        if "server" in sys.modules:
+            return importlib.reload(sys.modules["server"])
+        import server
+        return server
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # nearest rank: the smallest value with at least pct% of the values at or below it
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summarize(latencies: list, errors: int, wall: float) -> dict:
+    lat = sorted(latencies)
+    ms = lambda s: round(s * 1000, 2)
+    return {
+        "requests": len(lat) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(lat) / wall, 1) if wall > 0 else 0.0,
+        "mean_ms": ms(sum(lat) / len(lat)) if lat else 0.0,
+        "p50_ms": ms(percentile(lat, 50)),
+        "p95_ms": ms(percentile(lat, 95)),
+        "p99_ms": ms(percentile(lat, 99)),
+        "max_ms": ms(lat[-1]) if lat else 0.0,
+    }
+
+
+def print_table(title: str, rows: dict, columns=("requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms")):
+    print(f"\n{title}")
+    name_w = max([len("scenario")] + [len(n) for n in rows])
+    print("  " + "scenario".ljust(name_w) + "".join(c.rjust(16) for c in columns))
+    for name, r in rows.items():
+        print("  " + name.ljust(name_w) + "".join(str(r.get(c, "")).rjust(16) for c in columns))
+
+
+def load_baseline(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, key: str, results: dict):
+    data = load_baseline(path)
+    data[key] = results
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Regressions: p95 slower or throughput lower than baseline by more than `tolerance` (0.25 = 25%)."""
+    problems = []
+    for name, now in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if base.get("p95_ms") and now["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            problems.append(f"{name}: p95 {now['p95_ms']} ms vs baseline {base['p95_ms']} ms")
+        if base.get("throughput_rps") and now["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            problems.append(f"{name}: {now['throughput_rps']} req/s vs baseline {base['throughput_rps']} req/s")
+        if now["errors"] > base.get("errors", 0):
+            problems.append(f"{name}: {now['errors']} errors vs baseline {base.get('errors', 0)}")
+    return problems
@@ -0,0 +1,136 @@
+import argparse
+import io
+import multiprocessing
+import resource
+import statistics
+import time
+
+from bench import common
+
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+
+
+def camera_jpeg(width: int, height: int, quality: int = 92) -> bytes:
+    """Stand-in for a camera photo: smooth gradients plus sensor-like noise, so the JPEG is photo-sized (~MBs)."""
+    small = (width // 8, height // 8)
+    base = Image.merge("RGB", (
+        Image.linear_gradient("L").resize(small),
+        Image.radial_gradient("L").resize(small),
+        Image.effect_noise(small, 60).filter(ImageFilter.GaussianBlur(6)),
+    )).resize((width, height), Image.Resampling.BICUBIC)
+    noise = Image.effect_noise((width, height), 18).convert("RGB")
+    img = Image.blend(base, noise, 0.15)
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=quality)
+    return out.getvalue()
+
+
+# --- what upload_image / save_image_and_get_rel_url did before ---
+
+def old_upload(data: bytes):
+    img = Image.open(io.BytesIO(data))
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
+    if img.width > 1600:
+        img = img.resize((1600, int(img.height * 1600 / float(img.width))))
+    img.load()
+    return img
+
+
+def old_thumbnail(data: bytes):
+    img = Image.open(io.BytesIO(data)).convert("RGB")  # convert() decodes the full image first
+    img.thumbnail((720, 720))
+    return img
+
+
+def new_upload(server, data: bytes):
+    return server.decode_upload_image(io.BytesIO(data), 1600, modes=("RGB", "RGBA"))
+
+
+def new_thumbnail(server, data: bytes):
+    return server.decode_upload_image(io.BytesIO(data), 720, 720)
+
+
+VARIANTS = {
+    "upload 1600w: open+resize (old)": ("old_upload", False),
+    "upload 1600w: draft+reducing_gap": ("new_upload", True),
+    "thumb 720: convert+thumbnail (old)": ("old_thumbnail", False),
+    "thumb 720: draft+reducing_gap": ("new_thumbnail", True),
+}
+
+
+def _peak_rss_kb() -> int:
+    # VmHWM belongs to this process image; ru_maxrss survives exec and can report the parent's peak
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _difference(a, b) -> float:
+    """Mean absolute per-channel difference (0-255) between two outputs, resized to the same size."""
+    if a.size != b.size:
+        b = b.resize(a.size, Image.Resampling.BICUBIC)
+    return round(sum(ImageStat.Stat(ImageChops.difference(a.convert("RGB"), b.convert("RGB"))).mean) / 3, 2)
+
+
+def _child(variant: str, data: bytes, runs: int, queue):
+    fn_name, needs_server = VARIANTS[variant]
+    fn = globals()[fn_name]
+    if needs_server:
+        with common.workdir():
+            server = common.load_server()
+        call = lambda: fn(server, data)
+    else:
+        call = lambda: fn(data)
+    base_rss = _peak_rss_kb()
+    times, size = [], None
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        with common.quiet():
+            img = call()
+        times.append(time.perf_counter() - t0)
+        size = img.size
+        del img
+    peak = _peak_rss_kb() - base_rss  # KiB
+    with common.quiet():
+        img = call()
+    out = io.BytesIO()
+    img.save(out, "PNG")
+    queue.put({"p50_ms": round(statistics.median(times) * 1000, 1), "min_ms": round(min(times) * 1000, 1),
+               "extra_rss_mb": round(peak / 1024, 1), "output": f"{size[0]}x{size[1]}", "png": out.getvalue()})
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Upload image decoding: full decode + resize vs draft mode + reducing_gap")
+    ap.add_argument("--width", type=int, default=6000)
+    ap.add_argument("--height", type=int, default=4000)  # 24MP
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+
+    data = camera_jpeg(args.width, args.height)
+    print(f"Test photo: {args.width}x{args.height} JPEG, {len(data) / 1e6:.1f} MB")
+    ctx = multiprocessing.get_context("spawn")  # a forked child would start with this process's RSS
+    results = {}
+    for variant in VARIANTS:
+        # one process per variant so the RSS high-water mark belongs to that variant alone
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_child, args=(variant, data, args.runs, queue))
+        proc.start()
+        results[variant] = queue.get()
+        proc.join()
+    # how far the new output is from the old one (0 = identical; 1-2 is invisible)
+    names = list(VARIANTS)
+    for old, new in ((names[0], names[1]), (names[2], names[3])):
+        a, b = (Image.open(io.BytesIO(results[n].pop("png"))) for n in (old, new))
+        results[new]["diff_vs_old"] = _difference(a, b)
+    common.print_table(f"Decoding a {args.width * args.height / 1e6:.0f}MP photo ({args.runs} runs)", results,
+                       columns=("p50_ms", "min_ms", "extra_rss_mb", "output", "diff_vs_old"))
+
+
+if __name__ == "__main__":
+    main()
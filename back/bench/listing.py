@@ -0,0 +1,73 @@
+import argparse
+import sqlite3
+import statistics
+import time
+
+from bench import common, seed
+
+# Listing query before primary_image existed: one correlated subquery per product
+CORRELATED = """
+    SELECT
+        p.id, p.name, p.bio, p.price, p.discount_price,
+        p.limited_edition, p.sold_out,
+        (
+            SELECT pi.image_path
+              FROM product_images pi
+             WHERE pi.product_id = p.id
+             ORDER BY pi.sort_order ASC, pi.id ASC
+             LIMIT 1
+        ) AS image_url
+    FROM products p
+"""
+
+DENORMALIZED = """
+    SELECT
+        p.id, p.name, p.bio, p.price, p.discount_price,
+        p.limited_edition, p.sold_out,
+        p.primary_image AS image_url, p.image_count
+    FROM products p
+"""
+
+
+def time_query(conn, sql: str, runs: int) -> dict:
+    samples = []
+    rows = 0
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        rows = len(conn.execute(sql).fetchall())
+        samples.append(time.perf_counter() - t0)
+    plan = [r[3] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+    return {"rows": rows, "median_ms": round(statistics.median(samples) * 1000, 2),
+            "min_ms": round(min(samples) * 1000, 2), "plan": " / ".join(plan)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Product listing query: correlated first-image subquery vs primary_image column")
+    ap.add_argument("--products", type=int, default=100_000)
+    ap.add_argument("--images", type=int, default=5)
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+
+    with common.workdir():
+        info = seed.seed_catalog("shop.db", products=args.products, services=0, images=args.images)
+        print(f"Seeded catalog: {info}")
+        conn = sqlite3.connect("shop.db")
+        try:
+            results = {
+                "correlated subquery": time_query(conn, CORRELATED, args.runs),
+                "primary_image column": time_query(conn, DENORMALIZED, args.runs),
+            }
+        finally:
+            conn.close()
+
+    common.print_table(f"Listing {args.products} products x {args.images} images ({args.runs} runs)",
+                       results, columns=("rows", "median_ms", "min_ms"))
+    for name, r in results.items():
+        print(f"  plan [{name}]: {r['plan']}")
+    before, after = results["correlated subquery"]["median_ms"], results["primary_image column"]["median_ms"]
+    if after:
+        print(f"\nSpeed-up: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
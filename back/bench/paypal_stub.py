@@ -0,0 +1,180 @@
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Webhooks: PayPal signs "<transmission id>|<time>|<webhook id>|<crc32 of the body>" with an RSA key
+# (PAYPAL-CERT-URL); the stub uses an HMAC over the same string so nobody needs certificates locally.
+# Point the server at it with PAYPAL_WEBHOOK_ID=WEBHOOK_ID.
+WEBHOOK_ID = "STUB-WEBHOOK-ID"
+SIGNING_KEY = b"paypal-stub-signing-key"
+
+
+def _signed_string(transmission_id: str, transmission_time: str, webhook_id: str, body: bytes) -> bytes:
+    return f"{transmission_id}|{transmission_time}|{webhook_id}|{zlib.crc32(body)}".encode("utf-8")
+
+
+def sign_webhook(body: bytes, webhook_id: str = WEBHOOK_ID) -> dict:
+    """The PAYPAL-* headers of a delivery of `body`, as the stub would sign it."""
+    tid = str(uuid.uuid4())
+    ttime = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    sig = hmac.new(SIGNING_KEY, _signed_string(tid, ttime, webhook_id, body), hashlib.sha256).digest()
+    return {
+        "PAYPAL-AUTH-ALGO": "SHA256withRSA",
+        "PAYPAL-CERT-URL": "https://api.sandbox.paypal.com/v1/notifications/certs/CERT-STUB",
+        "PAYPAL-TRANSMISSION-ID": tid,
+        "PAYPAL-TRANSMISSION-SIG": base64.b64encode(sig).decode("ascii"),
+        "PAYPAL-TRANSMISSION-TIME": ttime,
+    }
+
+
+def verify_webhook(fields: dict, event_raw: bytes) -> bool:
+    sig = hmac.new(SIGNING_KEY, _signed_string(fields.get("transmission_id") or "", fields.get("transmission_time") or "",
+                                               fields.get("webhook_id") or "", event_raw), hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(sig).decode("ascii"), fields.get("transmission_sig") or "")
+
+
+def _event(event_type: str, resource_type: str, resource: dict, summary: str) -> dict:
+    return {
+        "id": f"WH-{uuid.uuid4().hex[:20].upper()}",
+        "event_version": "1.0",
+        "create_time": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        "resource_type": resource_type,
+        "event_type": event_type,
+        "summary": summary,
+        "resource": resource,
+    }
+
+
+def capture_completed_event(order_id: str, value: str = "10.00", currency: str = "EUR", capture_id: str | None = None) -> dict:
+    return _event("PAYMENT.CAPTURE.COMPLETED", "capture", {
+        "id": capture_id or uuid.uuid4().hex[:17].upper(),
+        "status": "COMPLETED",
+        "amount": {"currency_code": currency, "value": value},
+        "final_capture": True,
+        "supplementary_data": {"related_ids": {"order_id": order_id}},
+    }, f"Payment completed for {currency} {value}")
+
+
+def order_approved_event(order_id: str, value: str = "10.00", currency: str = "EUR") -> dict:
+    return _event("CHECKOUT.ORDER.APPROVED", "checkout-order", {
+        "id": order_id,
+        "intent": "CAPTURE",
+        "status": "APPROVED",
+        "purchase_units": [{"amount": {"currency_code": currency, "value": value}}],
+    }, "An order has been approved by buyer")
+
+
+def deliver(url: str, event: dict, webhook_id: str = WEBHOOK_ID, headers: dict | None = None, timeout: float = 30):
+    """POST one event like PayPal does (signed unless headers are given). Returns (status, response body)."""
+    body = json.dumps(event).encode("utf-8")
+    headers = {"Content-Type": "application/json", **(headers if headers is not None else sign_webhook(body, webhook_id))}
+    req = urllib.request.Request(url, data=body, headers=headers, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Answers the handful of PayPal REST calls server.py makes."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):  # keep benchmark output clean
+        pass
+
+    def _reply(self, code: int, obj: dict):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        latency = self.server.latency_ms / 1000.0
+        if latency:
+            time.sleep(latency)
+        path = self.path.split("?", 1)[0]
+        if path == "/v1/oauth2/token":
+            return self._reply(200, {"access_token": "stub-token", "token_type": "Bearer", "expires_in": 32400})
+        if path == "/v2/checkout/orders":
+            data = json.loads(raw or b"{}")
+            order_id = uuid.uuid4().hex[:17].upper()
+            with self.server.lock:
+                self.server.orders[order_id] = data
+            return self._reply(201, {"id": order_id, "status": "CREATED"})
+        if path.startswith("/v2/checkout/orders/") and path.endswith("/capture"):
+            order_id = path.split("/")[4]
+            with self.server.lock:
+                order = self.server.orders.get(order_id)
+                already = order_id in self.server.captured
+                self.server.captured.add(order_id)
+            if order is None:
+                return self._reply(404, {"name": "RESOURCE_NOT_FOUND", "details": [{"issue": "INVALID_RESOURCE_ID"}]})
+            if already:
+                return self._reply(422, {"name": "UNPROCESSABLE_ENTITY", "details": [{"issue": "ORDER_ALREADY_CAPTURED"}]})
+            amount = (order.get("purchase_units") or [{}])[0].get("amount") or {}
+            capture_id = uuid.uuid4().hex[:17].upper()
+            if self.server.webhook_url:
+                # PayPal notifies asynchronously, a moment after answering the capture
+                event = capture_completed_event(order_id, amount.get("value", "0.00"), amount.get("currency_code", "EUR"), capture_id)
+                threading.Thread(target=deliver, args=(self.server.webhook_url, event), daemon=True).start()
+            return self._reply(201, {"id": order_id, "status": "COMPLETED", "purchase_units": [
+                {**(order.get("purchase_units") or [{}])[0],
+                 "payments": {"captures": [{"id": capture_id, "status": "COMPLETED", "amount": amount}]}}]})
+        if path == "/v1/notifications/verify-webhook-signature":
+            # The event is the last field; cut it out as sent (re-serializing it would change the CRC)
+            text = raw.decode("utf-8")
+            start = text.find('"webhook_event"')
+            event_raw = text[text.index(":", start) + 1:text.rindex("}")].strip().encode("utf-8") if start >= 0 else b""
+            ok = verify_webhook(json.loads(text), event_raw)
+            with self.server.lock:
+                self.server.verifications[ok] = self.server.verifications.get(ok, 0) + 1
+            return self._reply(200, {"verification_status": "SUCCESS" if ok else "FAILURE"})
+        return self._reply(404, {"name": "NOT_FOUND", "path": path})
+
+
+def start_stub(host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0, webhook_url: str | None = None):
+    """
+    Start the stub in a daemon thread; returns (server, base_url). Stop with server.shutdown().
+    With webhook_url (settable later as server.webhook_url) every capture also sends a signed
+    PAYMENT.CAPTURE.COMPLETED there.
+    """
+    server = ThreadingHTTPServer((host, port), _StubHandler)
+    server.daemon_threads = True
+    server.latency_ms = latency_ms
+    server.webhook_url = webhook_url
+    server.lock = threading.Lock()
+    server.orders = {}
+    server.captured = set()
+    server.verifications = {}  # {True: n, False: n}
+    threading.Thread(target=server.serve_forever, name="paypal-stub", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Run the PayPal API stub standalone")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--webhook-url", help="send PAYMENT.CAPTURE.COMPLETED here after each capture, e.g. http://127.0.0.1:5000/api/paypal/webhook")
+    args = ap.parse_args()
+    srv, url = start_stub(port=args.port, latency_ms=args.latency_ms, webhook_url=args.webhook_url)
+    print(f"PayPal stub listening on {url} (set PAYPAL_API_BASE={url} PAYPAL_WEBHOOK_ID={WEBHOOK_ID})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()
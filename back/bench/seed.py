@@ -0,0 +1,107 @@
+import argparse
+import hashlib
+import base64
+import os
+import random
+import sqlite3
+import time
+
+import init_db
+
+ADMIN_EMAIL = "admin@bench.local"
+ADMIN_USERNAME = "LeonBoussen"  # require_admin checks for this username
+USER_EMAIL = "user@bench.local"
+PASSWORD = "bench-password"
+
+SIZES = {
+    "small": {"products": 1_000, "services": 50, "images": 3},
+    "large": {"products": 100_000, "services": 500, "images": 5},
+}
+
+WORDS = ("secure", "phone", "privacy", "vault", "mesh", "shield", "pocket", "pro", "mini",
+         "ultra", "black", "graphene", "tor", "relay", "cipher", "node", "edition", "kit")
+
+
+def _password_hash(password: str, iterations: int = 200_000) -> tuple[str, str]:
+    # Same scheme as server.hash_password, without importing the Flask app
+    salt = os.urandom(16)
+    dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return base64.b64encode(dk).decode("ascii"), base64.b64encode(salt).decode("ascii")
+
+
+def _name(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(3)).title()
+
+
+def seed_catalog(db_path: str, products: int, services: int, images: int, seed: int = 42, batch: int = 10_000) -> dict:
+    """Create the schema in db_path and fill it with a deterministic synthetic catalog."""
+    rng = random.Random(seed)
+    t0 = time.perf_counter()
+    init_db.DATABASE = db_path
+    init_db.create_or_update_db_table()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA foreign_keys = ON")
+        cur = conn.cursor()
+        start_pid = (cur.execute("SELECT COALESCE(MAX(id), 0) FROM products").fetchone()[0]) + 1
+        for lo in range(0, products, batch):
+            n = min(batch, products - lo)
+            rows, imgs = [], []
+            for i in range(n):
+                pid = start_pid + lo + i
+                price = round(rng.uniform(5, 1500), 2)
+                discount = round(price * rng.uniform(0.6, 0.95), 2) if rng.random() < 0.3 else None
+                rows.append((pid, _name(rng), f"Synthetic product #{pid}. " * rng.randint(1, 6), price, discount,
+                             int(rng.random() < 0.1), int(rng.random() < 0.05), int(rng.random() < 0.05)))
+                imgs.extend((pid, f"/static/uploads/bench_{pid}_{k}.webp", None, k) for k in range(images))
+            cur.executemany("""
+                INSERT INTO products (id, name, bio, price, discount_price, limited_edition, sold_out, almost_sold_out)
+                VALUES (?,?,?,?,?,?,?,?)
+            """, rows)
+            cur.executemany(
+                "INSERT INTO product_images (product_id, image_path, alt_text, sort_order) VALUES (?,?,?,?)", imgs)
+            conn.commit()
+
+        for _ in range(services):
+            price = round(rng.uniform(20, 400), 2)
+            cur.execute("INSERT INTO services (name, bio, price, discount_price, active) VALUES (?,?,?,?,?)",
+                        (_name(rng), "Synthetic service", price, None, int(rng.random() < 0.9)))
+            sid = cur.lastrowid
+            cur.executemany(
+                "INSERT INTO service_images (service_id, image_path, alt_text, sort_order) VALUES (?,?,?,?)",
+                [(sid, f"/static/uploads/bench_s{sid}_{k}.webp", None, k) for k in range(images)])
+
+        for email, username in ((ADMIN_EMAIL, ADMIN_USERNAME), (USER_EMAIL, "bench-user")):
+            pwd_hash, salt = _password_hash(PASSWORD)
+            cur.execute("INSERT OR IGNORE INTO users (email, username, password_hash, salt) VALUES (?,?,?,?)",
+                        (email, username, pwd_hash, salt))
+        conn.commit()
+    finally:
+        conn.close()
+    return {"products": products, "services": services, "images_per_item": images,
+            "seconds": round(time.perf_counter() - t0, 2)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Seed a shop.db with a synthetic catalog")
+    ap.add_argument("--db", default="shop.db")
+    ap.add_argument("--size", choices=sorted(SIZES), help="preset size (overridden by explicit flags)")
+    ap.add_argument("--products", type=int)
+    ap.add_argument("--services", type=int)
+    ap.add_argument("--images", type=int, help="images per product/service")
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+    preset = SIZES[args.size or "small"]
+    info = seed_catalog(
+        args.db,
+        products=args.products if args.products is not None else preset["products"],
+        services=args.services if args.services is not None else preset["services"],
+        images=args.images if args.images is not None else preset["images"],
+        seed=args.seed,
+    )
+    print(f"Seeded {args.db}: {info}")
+
+
+if __name__ == "__main__":
+    main()
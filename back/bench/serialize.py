@@ -0,0 +1,96 @@
+import argparse
+import gc
+import json
+import sqlite3
+import statistics
+import time
+import tracemalloc
+
+from bench import common, seed
+
+import serializer
+
+LISTING_SQL = """
+    SELECT
+        p.id, p.name, p.bio, p.price, p.discount_price,
+        p.limited_edition, p.sold_out,
+        p.primary_image AS image_url, p.image_count
+    FROM products p
+"""
+
+KEYS = ("id", "name", "bio", "price", "discount_price", "limited_edition", "sold_out", "image_url", "image_count")
+
+
+def _dicts(rows):
+    # what row_to_product used to build for every row
+    return [dict(zip(KEYS, r[:7] + (r[7] or None, r[8]))) for r in rows]
+
+
+def stdlib_dicts(rows):
+    # stock jsonify: sort_keys=True, ensure_ascii=True, compact separators
+    return json.dumps(_dicts(rows), sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def orjson_dicts(rows):
+    return serializer.orjson.dumps(_dicts(rows))
+
+
+def row_serializer(backend):
+    ser = serializer.RowSerializer(KEYS, converters={"image_url": lambda v: v or None})
+
+    def run(rows):
+        serializer.set_backend(backend)
+        return ser.encode_rows(rows)
+    return run
+
+
+def measure(fn, rows, runs: int) -> dict:
+    cpu = []
+    size = 0
+    for _ in range(runs):
+        gc.collect()
+        t0 = time.process_time()
+        size = len(fn(rows))
+        cpu.append(time.process_time() - t0)
+    gc.collect()
+    tracemalloc.start()
+    fn(rows)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"cpu_ms": round(statistics.median(cpu) * 1000, 1), "min_cpu_ms": round(min(cpu) * 1000, 1),
+            "peak_mb": round(peak / 1e6, 1), "bytes": size}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="JSON encoding of the product listing: dicts + json/orjson vs RowSerializer")
+    ap.add_argument("--products", type=int, default=100_000)
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+
+    with common.workdir():
+        info = seed.seed_catalog("shop.db", products=args.products, services=0, images=1)
+        print(f"Seeded catalog: {info}")
+        conn = sqlite3.connect("shop.db")
+        try:
+            rows = conn.execute(LISTING_SQL).fetchall()
+        finally:
+            conn.close()
+
+    variants = {"stdlib json + dicts": stdlib_dicts, "RowSerializer (json)": row_serializer("json")}
+    if serializer.orjson is not None:
+        variants["orjson + dicts"] = orjson_dicts
+        variants["RowSerializer (orjson)"] = row_serializer("orjson")
+    else:
+        print("orjson not installed: only the stdlib variants are measured")
+
+    results = {name: measure(fn, rows, args.runs) for name, fn in variants.items()}
+    common.print_table(f"Encoding {len(rows)} listing rows ({args.runs} runs, CPU = process time)",
+                       results, columns=("cpu_ms", "min_cpu_ms", "peak_mb", "bytes"))
+    base = results["stdlib json + dicts"]
+    for name, r in results.items():
+        if r["cpu_ms"]:
+            print(f"  {name}: {base['cpu_ms'] / r['cpu_ms']:.1f}x CPU, {r['peak_mb'] / base['peak_mb']:.0%} peak memory vs stdlib + dicts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+PayPal webhook replay tool, against the stub in paypal_stub.py.
+
+    py -m bench.webhook_replay run --checkouts 200 --duplicates 3
+        end to end: seeded shop + stub + server with webhook workers; pays checkouts through
+        the browser capture, lost capture responses, closed tabs (approval only) and forged
+        events (also forged copies of genuine events, same id), delivers every event several
+        times, concurrently, then checks each sale was recorded exactly once. Exits 1 if not.
+    py -m bench.webhook_replay send http://127.0.0.1:5000/api/paypal/webhook events.jsonl [--repeat 2]
+        deliver events (one JSON object per line, "-" = stdin) to a running server, signed for the stub
+    py -m bench.webhook_replay sample capture-completed <paypal order id>
+        print an event to feed to `send`
+    py -m bench.webhook_replay export --db shop.db --status failed
+        stored events (webhook_events.body) as JSON lines, e.g. to replay them against a test server
+"""
+import argparse
+import json
+import logging
+import random
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench import common, seed
+from bench.api import http_json
+from bench.paypal_stub import WEBHOOK_ID, capture_completed_event, deliver, order_approved_event, sign_webhook, start_stub
+
+
+def _wait_for_queue(server, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        counts = server.WEBHOOK_QUEUE.stats()["counts"]
+        if counts["pending"] == 0 and counts["processing"] == 0:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _check(conn, paid: list, unpaid: list, customers: set, paid_events: set, forged_events: set) -> list[str]:
+    """Everything that isn't as it should be after all events were processed."""
+    problems = []
+    applied = {r[0] for r in conn.execute("SELECT event_id FROM webhook_events WHERE verified = 1 AND status = 'done'")}
+    if missing := paid_events - applied:
+        problems.append(f"{len(missing)} genuine events without a processed verified delivery, e.g. {sorted(missing)[:3]}")
+    if forged := forged_events & applied:
+        problems.append(f"{len(forged)} forged events verified, e.g. {sorted(forged)[:3]}")
+    captured = {r[0] for r in conn.execute("SELECT paypal_order_id FROM checkouts WHERE captured_at IS NOT NULL")}
+    if missing := [o for o in paid if o not in captured]:
+        problems.append(f"{len(missing)} paid checkouts not recorded, e.g. {missing[:3]}")
+    if forged := [o for o in unpaid if o in captured]:
+        problems.append(f"{len(forged)} checkouts recorded from forged events, e.g. {forged[:3]}")
+    orders, distinct = conn.execute("SELECT COUNT(*), COUNT(DISTINCT paypal_order_id) FROM orders").fetchone()
+    expected = len([o for o in paid if o in customers])
+    if orders != distinct or orders != expected:
+        problems.append(f"orders: {orders} rows for {distinct} PayPal orders, expected {expected}")
+    sales = conn.execute("SELECT COALESCE(SUM(orders), 0) FROM sales_daily_totals").fetchone()[0]
+    if sales != len(paid):
+        problems.append(f"sales_daily_totals counts {sales} sales, expected {len(paid)}")
+    return problems
+
+
+def run(args):
+    rng = random.Random(7)
+    stub, stub_url = start_stub(latency_ms=args.paypal_latency_ms)
+    with common.workdir(keep=args.keep):
+        seed.seed_catalog("shop.db", products=100, services=0, images=0)
+        server = common.load_server(
+            PAYPAL_API_BASE=stub_url, PAYPAL_CLIENT_ID="bench", PAYPAL_CLIENT_SECRET="bench",
+            PAYPAL_WEBHOOK_ID=WEBHOOK_ID, PAYPAL_WEBHOOK_CAPTURE_DELAY=0, WEBHOOK_WORKERS=args.workers,
+            WEBHOOK_RETRY_SECONDS=0.2)
+        from werkzeug.serving import make_server
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+        threading.Thread(target=httpd.serve_forever, name="bench-server", daemon=True).start()
+        base = f"http://127.0.0.1:{httpd.server_port}"
+        hook = f"{base}/api/paypal/webhook"
+        try:
+            with common.quiet():
+                server.WEBHOOK_QUEUE.start()
+                status, login = http_json("POST", f"{base}/api/auth/login", {"email": seed.USER_EMAIL, "password": seed.PASSWORD})
+                if status != 200:
+                    raise RuntimeError(f"user login failed: {status} {login}")
+                auth = {"Authorization": f"Bearer {login['token']}"}
+
+                print(f"  creating {args.checkouts} checkouts...", file=sys.stderr)
+                checkouts, customers = [], set()
+                for i in range(args.checkouts):
+                    cart = [{"id": rng.randint(1, 100), "kind": "product", "qty": rng.randint(1, 3)}]
+                    status, data = http_json("POST", f"{base}/api/paypal/create-order", {"items": cart},
+                                             auth if i % 2 else None)
+                    if status != 200:
+                        raise RuntimeError(f"create-order failed: {status} {data}")
+                    checkouts.append((data["id"], f"{data['amounts']['total']:.2f}"))
+                    if i % 2:
+                        customers.add(data["id"])
+
+                # browser: onApprove -> capture-order, then PayPal's event. lost: PayPal captured, our
+                # response never came back. closed: approved, the tab closed before onApprove. forged: bad signature.
+                groups = {name: checkouts[i::4] for i, name in enumerate(("browser", "lost", "closed", "forged"))}
+                print("  capturing...", file=sys.stderr)
+                sync_latencies = []
+                for order_id, _ in groups["browser"]:
+                    t0 = time.perf_counter()
+                    status, data = http_json("POST", f"{base}/api/paypal/capture-order", {"order_id": order_id})
+                    sync_latencies.append(time.perf_counter() - t0)
+                    if status != 200:
+                        raise RuntimeError(f"capture-order failed: {status} {data}")
+                for order_id, _ in groups["lost"]:
+                    http_json("POST", f"{stub_url}/v2/checkout/orders/{order_id}/capture", {})
+
+                def forge(event):
+                    return sign_webhook(json.dumps(event).encode("utf-8"), webhook_id="SOMEONE-ELSE")
+
+                deliveries, paid_events, forged_events = [], set(), set()
+                for order_id, value in groups["browser"] + groups["lost"]:
+                    event = capture_completed_event(order_id, value)
+                    paid_events.add(event["id"])
+                    # plus a forged copy under the genuine id: must not displace the real one
+                    copy = {**event, "summary": "forged"}
+                    deliveries += [(event, None)] * args.duplicates + [(copy, forge(copy))]
+                for order_id, value in groups["closed"]:
+                    event = order_approved_event(order_id, value)
+                    paid_events.add(event["id"])
+                    deliveries += [(event, None)] * args.duplicates
+                for order_id, value in groups["forged"]:
+                    event = capture_completed_event(order_id, value)
+                    forged_events.add(event["id"])
+                    deliveries += [(event, forge(event))] * args.duplicates
+                rng.shuffle(deliveries)
+
+                print(f"  delivering {len(deliveries)} webhooks (concurrency {args.concurrency})...", file=sys.stderr)
+                ack_latencies, errors = [], 0
+                lock = threading.Lock()
+
+                def one(item):
+                    nonlocal errors
+                    event, headers = item
+                    t0 = time.perf_counter()
+                    status, _ = deliver(hook, event, headers=headers)
+                    with lock:
+                        if status == 200:
+                            ack_latencies.append(time.perf_counter() - t0)
+                        else:
+                            errors += 1
+
+                t0 = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                    list(pool.map(one, deliveries))
+                acked = time.perf_counter() - t0
+                drained = _wait_for_queue(server, args.timeout)
+                processed = time.perf_counter() - t0
+                stats = server.WEBHOOK_QUEUE.stats()
+                server.WEBHOOK_QUEUE.stop()
+        finally:
+            httpd.shutdown()
+            stub.shutdown()
+            server.DB_POOL.clear()
+
+        conn = sqlite3.connect("shop.db")
+        try:
+            paid = [o for group in ("browser", "lost", "closed") for o, _ in groups[group]]
+            problems = _check(conn, paid, [o for o, _ in groups["forged"]], customers, paid_events, forged_events)
+        finally:
+            conn.close()
+
+    results = {
+        "capture-order (browser, sync)": common.summarize(sync_latencies, 0, sum(sync_latencies)),
+        "webhook delivery (ack)": common.summarize(ack_latencies, errors, acked),
+    }
+    common.print_table(f"PayPal stub latency {args.paypal_latency_ms:.0f} ms, {args.workers} webhook workers", results)
+    print(f"\n  {len(deliveries)} deliveries acknowledged in {acked:.2f}s, all processed after {processed:.2f}s")
+    print(f"  queue: {stats['counts']}, stub signature checks: {stub.verifications}")
+    if not drained:
+        problems.append(f"queue not drained after {args.timeout}s")
+    for p in problems:
+        print(f"  ✘ {p}")
+    if problems:
+        sys.exit(1)
+    print(f"  ✔ {len(paid)} sales recorded exactly once, {len(groups['forged'])} forged events rejected")
+
+
+def send_events(url: str, events: list, repeat: int = 1, webhook_id: str = WEBHOOK_ID, unsigned: bool = False) -> list:
+    """Deliver each event `repeat` times (signed afresh each time, like PayPal's redeliveries). [(event, status, body)]"""
+    results = []
+    for event in events:
+        for _ in range(repeat):
+            status, body = deliver(url, event, webhook_id=webhook_id, headers={} if unsigned else None)
+            results.append((event, status, body))
+    return results
+
+
+def send(args):
+    src = sys.stdin if args.file == "-" else open(args.file, encoding="utf-8")
+    try:
+        events = [json.loads(line) for line in src if line.strip()]
+    finally:
+        if src is not sys.stdin:
+            src.close()
+    for event, status, body in send_events(args.url, events, args.repeat, args.webhook_id, args.unsigned):
+        print(f"{event.get('id')} {event.get('event_type')}: {status} {body.decode('utf-8', 'replace').strip()}")
+
+
+def sample(args):
+    make = capture_completed_event if args.type == "capture-completed" else order_approved_event
+    print(json.dumps(make(args.order_id, args.value, args.currency)))
+
+
+def export(args):
+    conn = sqlite3.connect(args.db)
+    try:
+        sql, params = "SELECT body FROM webhook_events", ()
+        if args.status:
+            sql, params = sql + " WHERE status = ?", (args.status,)
+        for (body,) in conn.execute(sql + " ORDER BY received_at", params):
+            print(body)
+    finally:
+        conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay PayPal webhooks against the server (and the PayPal stub)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run", help="end-to-end check: every sale recorded once, however events arrive")
+    r.add_argument("--checkouts", type=int, default=200)
+    r.add_argument("--duplicates", type=int, default=3, help="deliveries per event (PayPal redelivers)")
+    r.add_argument("--concurrency", type=int, default=8)
+    r.add_argument("--workers", type=int, default=2, help="WEBHOOK_WORKERS")
+    r.add_argument("--paypal-latency-ms", type=float, default=300.0, help="artificial latency of the PayPal stub")
+    r.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for the queue to drain")
+    r.add_argument("--keep", action="store_true", help="keep the temporary working directory")
+    s = sub.add_parser("send", help="deliver events from a JSON-lines file to a running server")
+    s.add_argument("url")
+    s.add_argument("file", help='JSON lines, "-" = stdin')
+    s.add_argument("--repeat", type=int, default=1)
+    s.add_argument("--webhook-id", default=WEBHOOK_ID, help="sign for this webhook id (the server's PAYPAL_WEBHOOK_ID)")
+    s.add_argument("--unsigned", action="store_true", help="no PAYPAL-* headers (server with PAYPAL_WEBHOOK_VERIFY=0)")
+    m = sub.add_parser("sample", help="print one synthetic event")
+    m.add_argument("type", choices=("capture-completed", "order-approved"))
+    m.add_argument("order_id")
+    m.add_argument("--value", default="10.00")
+    m.add_argument("--currency", default="EUR")
+    e = sub.add_parser("export", help="print stored events as JSON lines")
+    e.add_argument("--db", default="shop.db")
+    e.add_argument("--status")
+    args = ap.parse_args()
+    {"run": run, "send": send, "sample": sample, "export": export}[args.cmd](args)
+
+
+if __name__ == "__main__":
+    main()
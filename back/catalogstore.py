@@ -0,0 +1,243 @@
+"""
+Compact in-memory catalog: one object per catalog instead of a dict per
+product plus a list of image paths per product.
+
+Columns are typed arrays (ids, prices, flags as a bitmask byte), strings
+are UTF-8 in one buffer per column with repeated values stored once
+(StringColumn), and all image paths sit in one column with an offsets
+array, so item i's images are entries image_offsets[i]..image_offsets[i + 1].
+
+select() filters on effective price (the effective_price column) and
+flags and sorts by id/price/name; sort orders are built lazily once per
+catalog object. With image_meta=True the primary image's metadata
+(imagemeta.py: width, height, bytes, color, blurhash) is kept per item too.
+row() rebuilds a listing tuple on demand for serializer.RowSerializer,
+so nothing per-row stays alive between requests.
+"""
+import bisect
+import itertools
+import math
+from array import array
+
+NAN = float("nan")
+SORT_KEYS = ("id", "price", "name")
+IMAGE_META = ("width", "height", "bytes", "color", "blurhash")
+FETCH_ROWS = 10_000
+
+
+class StringColumn:
+    """
+    Strings as UTF-8 in one buffer plus (start, length) per entry. Saves the
+    ~50 bytes of object overhead a Python str costs; values are decoded on
+    access. With intern=True equal strings share their bytes (worth it for
+    columns that repeat, like names; upload paths are unique uuids).
+    """
+    __slots__ = ("data", "starts", "lengths", "_seen")
+    NONE = 0xFFFFFFFF
+
+    def __init__(self, intern: bool = False):
+        self.data = bytearray()
+        self.starts = array("Q")
+        self.lengths = array("I")
+        self._seen = {} if intern else None
+
+    def extend(self, values: tuple):
+        seen, data, starts, lengths = self._seen, self.data, self.starts, self.lengths
+        if seen is None:
+            encoded = [b"" if v is None else v.encode("utf-8") for v in values]
+            starts.extend(itertools.islice(itertools.accumulate(map(len, encoded), initial=len(data)), len(encoded)))
+            lengths.extend([self.NONE if v is None else len(e) for v, e in zip(values, encoded)])
+            data += b"".join(encoded)
+            return
+        for v in values:
+            if v is None:
+                starts.append(0)
+                lengths.append(self.NONE)
+                continue
+            hit = seen.get(v)
+            if hit is None:
+                raw = v.encode("utf-8")
+                hit = seen[v] = (len(data), len(raw))
+                data += raw
+            starts.append(hit[0])
+            lengths.append(hit[1])
+
+    def freeze(self):
+        """Done appending: drop the intern table and the buffer's spare capacity."""
+        self._seen = None
+        self.data = bytes(self.data)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, i: int):
+        n = self.lengths[i]
+        if n == self.NONE:
+            return None
+        start = self.starts[i]
+        return self.data[start:start + n].decode("utf-8")
+
+    def nbytes(self) -> int:
+        return len(self.data) + len(self.starts) * 8 + len(self.lengths) * 4
+
+
+class CompactCatalog:
+    __slots__ = ("flag_names", "ids", "names", "bios", "prices", "discounts", "effective", "flags",
+                 "image_offsets", "image_paths", "image_meta", "_orders", "_sorted_prices")
+
+    def __init__(self, flag_names=(), image_meta: bool = False):
+        self.flag_names = tuple(flag_names)
+        if len(self.flag_names) > 8:
+            raise ValueError("at most 8 flags (one byte per item)")
+        self.ids = array("q")
+        self.names = StringColumn(intern=True)
+        self.bios = StringColumn()
+        self.prices = array("d")
+        self.discounts = array("d")  # NaN = no discount
+        self.effective = array("d")
+        self.flags = array("B")
+        self.image_offsets = array("I")
+        self.image_paths = StringColumn()
+        # primary image only: width/height/bytes (NONE = unknown), color (few distinct), blurhash
+        self.image_meta = ((array("I"), array("I"), array("I"), StringColumn(intern=True), StringColumn())
+                           if image_meta else None)
+        self._orders = {}
+        self._sorted_prices = None
+
+    @classmethod
+    def build(cls, cursor, image_cursor, flag_names=(), image_meta: bool = False):
+        """
+        cursor: rows (id, name, bio, price, discount_price, effective_price, *flags) ordered by id,
+        followed by the primary image's IMAGE_META columns when image_meta is set.
+        image_cursor: rows (owner_id, image_path) ordered by owner_id, then display
+        order, for owners that are in cursor's rows only.
+        Both are read in FETCH_ROWS chunks and appended a column at a time.
+        """
+        cat = cls(flag_names, image_meta)
+        meta_at = 6 + len(cat.flag_names)
+        for chunk in iter(lambda: cursor.fetchmany(FETCH_ROWS), []):
+            cols = list(zip(*chunk))
+            cat.ids.extend(cols[0])
+            cat.names.extend(cols[1])
+            cat.bios.extend(cols[2])
+            cat.prices.extend(float(p or 0) for p in cols[3])
+            cat.discounts.extend(NAN if d is None else float(d) for d in cols[4])
+            cat.effective.extend(float(e or 0) for e in cols[5])
+            bits = [0] * len(chunk)
+            for b, col in enumerate(cols[6:6 + len(cat.flag_names)]):
+                bit = 1 << b
+                bits = [x | bit if v else x for x, v in zip(bits, col)]
+            cat.flags.extend(bits)
+            if image_meta:
+                *numbers, colors, hashes = cat.image_meta
+                for column, values in zip(numbers, cols[meta_at:meta_at + 3]):
+                    column.extend(StringColumn.NONE if v is None else v for v in values)
+                colors.extend(cols[meta_at + 3])
+                hashes.extend(cols[meta_at + 4])
+
+        owners = array("q")
+        for chunk in iter(lambda: image_cursor.fetchmany(FETCH_ROWS), []):
+            cols = list(zip(*chunk))
+            owners.extend(cols[0])
+            cat.image_paths.extend(cols[1])
+        cat.image_offsets = array("I", (bisect.bisect_left(owners, iid) for iid in cat.ids))
+        cat.image_offsets.append(len(owners))
+        for col in (cat.names, cat.bios, cat.image_paths, *(cat.image_meta or ())[3:]):
+            col.freeze()
+        return cat
+
+    def __len__(self):
+        return len(self.ids)
+
+    def flag_mask(self, wanted: dict) -> tuple[int, int]:
+        """{"sold_out": False, ...} -> (mask, value) for (flags & mask) == value."""
+        mask = value = 0
+        for name, on in wanted.items():
+            bit = 1 << self.flag_names.index(name)
+            mask |= bit
+            if on:
+                value |= bit
+        return mask, value
+
+    def images(self, i: int) -> list:
+        return [self.image_paths[j] for j in range(self.image_offsets[i], self.image_offsets[i + 1])]
+
+    def row(self, i: int) -> tuple:
+        """(id, name, bio, price, discount_price, *flags, image_url, image_count[, *IMAGE_META]), the listing SELECT shape."""
+        start, end = self.image_offsets[i], self.image_offsets[i + 1]
+        discount = self.discounts[i]
+        bits = self.flags[i]
+        row = (self.ids[i], self.names[i], self.bios[i], self.prices[i],
+               None if math.isnan(discount) else discount,
+               *[(bits >> b) & 1 for b in range(len(self.flag_names))],
+               self.image_paths[start] if end > start else None, end - start)
+        if self.image_meta is None:
+            return row
+        *numbers, colors, hashes = self.image_meta
+        return row + (*[None if c[i] == StringColumn.NONE else c[i] for c in numbers], colors[i], hashes[i])
+
+    def rows(self, indexes):
+        return (self.row(i) for i in indexes)
+
+    def _order(self, key: str) -> array:
+        order = self._orders.get(key)
+        if order is None:
+            n = len(self.ids)
+            if key == "id":
+                order = array("I", sorted(range(n), key=self.ids.__getitem__))
+            elif key == "price":
+                order = array("I", sorted(range(n), key=lambda i: (self.effective[i], self.ids[i])))
+                self._sorted_prices = array("d", (self.effective[i] for i in order))
+            elif key == "name":
+                names = self.names
+                order = array("I", sorted(range(n), key=lambda i: ((names[i] or "").casefold(), self.ids[i])))
+            else:
+                raise ValueError(f"unknown sort key {key!r} (one of {', '.join(SORT_KEYS)})")
+            self._orders[key] = order
+        return order
+
+    def select(self, sort: str = "id", min_price=None, max_price=None, flags=None,
+               offset: int = 0, limit: int | None = None) -> tuple[int, list]:
+        """(total matches, item indexes of the requested page). sort is a key from SORT_KEYS, "-" prefix = descending."""
+        desc = sort.startswith("-")
+        key = sort[1:] if desc else sort
+        mask, want = self.flag_mask(flags or {})
+        has_range = min_price is not None or max_price is not None
+
+        if key == "price":
+            order = self._order("price")
+            lo = 0 if min_price is None else bisect.bisect_left(self._sorted_prices, min_price)
+            hi = len(order) if max_price is None else bisect.bisect_right(self._sorted_prices, max_price)
+            candidates = order[lo:hi]
+            if desc:
+                candidates = candidates[::-1]
+            if not mask:
+                end = None if limit is None else offset + limit
+                return len(candidates), list(candidates[offset:end])
+            matches = [i for i in candidates if self.flags[i] & mask == want]
+        else:
+            order = self._order(key)
+            if desc:
+                order = order[::-1]
+            lo = -math.inf if min_price is None else min_price
+            hi = math.inf if max_price is None else max_price
+            eff, fl = self.effective, self.flags
+            if has_range and mask:
+                matches = [i for i in order if lo <= eff[i] <= hi and fl[i] & mask == want]
+            elif has_range:
+                matches = [i for i in order if lo <= eff[i] <= hi]
+            elif mask:
+                matches = [i for i in order if fl[i] & mask == want]
+            else:
+                matches = order
+        end = None if limit is None else offset + limit
+        return len(matches), list(matches[offset:end])
+
+    def nbytes(self) -> int:
+        """Heap size of the columns and cached sort orders (excluding the small fixed object overhead)."""
+        arrays = (self.ids, self.prices, self.discounts, self.effective, self.flags, self.image_offsets,
+                  *self._orders.values(), *((self._sorted_prices,) if self._sorted_prices else ()))
+        if self.image_meta:
+            arrays += tuple(self.image_meta[:3])
+        strings = (self.names, self.bios, self.image_paths, *(self.image_meta or ())[3:])
+        return sum(a.buffer_info()[1] * a.itemsize for a in arrays) + sum(s.nbytes() for s in strings)
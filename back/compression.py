@@ -0,0 +1,107 @@
+"""
+Response compression helpers: Accept-Encoding negotiation, gzip/brotli
+encoders and Payload, a response body that keeps its compressed variants
+next to the raw bytes so cached responses are compressed only once.
+
+brotli is optional (pip install brotli, or brotlicffi); without it only
+gzip is offered.
+"""
+import gzip
+import threading
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+# Server preference when the client rates several encodings equally
+AVAILABLE = ("br", "gzip") if brotli is not None else ("gzip",)
+
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "application/x-ndjson",
+                      "image/svg+xml", "application/xml")
+
+
+def is_compressible(mimetype: str | None) -> bool:
+    return bool(mimetype) and (mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES)
+
+
+def _parse_accept_encoding(header: str) -> dict:
+    prefs = {}
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        prefs["gzip" if token == "x-gzip" else token] = q
+    return prefs
+
+
+def negotiate(accept_encoding: str, available=AVAILABLE) -> str | None:
+    """Best encoding the client accepts (q > 0), or None for identity."""
+    prefs = _parse_accept_encoding(accept_encoding)
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = prefs.get(encoding, prefs.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data, encoding: str, level: int) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(data, quality=level)
+    raise ValueError(f"unsupported encoding {encoding!r}")
+
+
+class Payload:
+    """
+    Raw response bytes plus lazily built compressed variants. Each encoding is
+    compressed at most once for the lifetime of the object (i.e. once per
+    catalog version when the Payload lives in the catalog cache).
+
+    raw can be any bytes-like object (a memoryview over a shared snapshot
+    too). fetch(encoding) / publish(encoding, data) let several processes
+    share the variants: fetch is tried before compressing, publish is called
+    with whatever got compressed here.
+    """
+
+    def __init__(self, raw, levels: dict, fetch=None, publish=None):
+        self.raw = raw
+        self.levels = levels  # encoding -> level/quality
+        self.fetch = fetch
+        self.publish = publish
+        self._variants = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.raw)
+
+    def variant(self, encoding: str):
+        data = self._variants.get(encoding)
+        if data is None:
+            with self._lock:
+                data = self._variants.get(encoding)
+                if data is None:
+                    data = self.fetch(encoding) if self.fetch else None
+                    if data is None:
+                        data = compress(self.raw, encoding, self.levels[encoding])
+                        if self.publish:
+                            self.publish(encoding, data)
+                    self._variants[encoding] = data
+        return data
+
+    def sizes(self) -> dict:
+        return {"identity": len(self.raw), **{enc: len(v) for enc, v in self._variants.items()}}
@@ -0,0 +1,306 @@
+"""
+Durable event queue in one SQLite table, for events that are acknowledged
+over HTTP right away and processed later by background workers (PayPal
+webhooks). Unlike writebehind.py nothing is held in memory: an event is
+committed before the sender gets its 200, so it survives a crash or restart.
+
+    pending -> processing -> done
+                          -> pending again, after a backoff (handler raised) ... -> failed (max_attempts)
+                          -> rejected (handler raised Reject: retrying can't help, e.g. bad signature)
+
+Anyone can POST an event with a real event id before the genuine one
+arrives, so with a verify callable an event id alone can't be the dedup
+key. A row is one delivery: unique on (event_id, delivery), delivery being
+a hash of body + headers, so the same delivery is stored once. Workers
+verify before handling; the first verified row of an event id wins (a
+partial unique index allows one per event id) and other deliveries of it
+end as done without running the handler. Once an event has a verified row,
+enqueue() doesn't store its deliveries any more. Unverified open rows are
+capped (max_unverified): past that enqueue() raises QueueFull, the sender
+retries later. Without verify, rows are stored as verified and the event id
+is the dedup key.
+
+Workers claim one due row at a time with a single UPDATE ... RETURNING,
+which is atomic between threads and between processes sharing the
+database. A claim is a lease: next_attempt_at is pushed `lease` seconds
+ahead, so an event whose worker died mid-way is claimed again once the
+lease runs out. Handlers must therefore be idempotent (they are:
+completing a checkout twice is a no-op).
+"""
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+STATUSES = ("pending", "processing", "done", "failed", "rejected")
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS webhook_events (
+           id              INTEGER PRIMARY KEY,
+           event_id        TEXT NOT NULL,
+           delivery        TEXT NOT NULL,
+           verified        INTEGER NOT NULL DEFAULT 0,
+           source          TEXT NOT NULL,
+           event_type      TEXT NOT NULL,
+           resource_id     TEXT,
+           body            TEXT NOT NULL,
+           headers         TEXT,
+           status          TEXT NOT NULL DEFAULT 'pending'
+                           CHECK (status IN ('pending', 'processing', 'done', 'failed', 'rejected')),
+           attempts        INTEGER NOT NULL DEFAULT 0,
+           next_attempt_at REAL NOT NULL,
+           last_error      TEXT,
+           result          TEXT,
+           received_at     TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+           processed_at    TEXT,
+           UNIQUE (event_id, delivery)
+       )''',
+    # One genuine row per event id; forged or repeated deliveries can't take its place
+    '''CREATE UNIQUE INDEX IF NOT EXISTS idx_webhook_events_verified
+           ON webhook_events(event_id) WHERE verified = 1''',
+    # Only open events are indexed, so the claim query stays one index probe however many done events pile up
+    '''CREATE INDEX IF NOT EXISTS idx_webhook_events_due
+           ON webhook_events(next_attempt_at) WHERE status IN ('pending', 'processing')''',
+    '''CREATE INDEX IF NOT EXISTS idx_webhook_events_resource ON webhook_events(resource_id)''',
+)
+
+CLAIM_SQL = """
+    UPDATE webhook_events SET status = 'processing', attempts = attempts + 1, next_attempt_at = ?2
+     WHERE id = (SELECT id FROM webhook_events
+                  WHERE status IN ('pending', 'processing') AND next_attempt_at <= ?1
+                  ORDER BY next_attempt_at LIMIT 1)
+    RETURNING id, event_id, source, event_type, resource_id, body, headers, attempts, verified
+"""
+EVENT_KEYS = ("id", "event_id", "source", "event_type", "resource_id", "body", "headers", "attempts", "verified")
+
+
+def create_table(conn):
+    for sql in SCHEMA:
+        conn.execute(sql)
+
+
+class Reject(Exception):
+    """Raised by a handler for events that must never be processed (not retried)."""
+
+
+class QueueFull(Exception):
+    """enqueue() refused: max_unverified unverified events are already waiting."""
+
+
+class EventQueue:
+    """
+    handler(event) gets a dict (id, event_id, source, event_type, resource_id,
+    body, headers, attempts, verified) and returns a JSON-serializable result.
+    It raises Reject to drop the event, anything else to have it retried after
+    retry_base * 2^(attempts - 1) seconds (capped at retry_max), up to max_attempts.
+    verify(event) -> bool runs before the handler, once per row: False rejects
+    the row, raising retries it like a handler error. None = events are trusted.
+    on_done(event, status, seconds, error) is called after every attempt (metrics/logging).
+    """
+
+    def __init__(self, connect, handler, workers: int = 2, lease: float = 120.0, max_attempts: int = 8,
+                 retry_base: float = 10.0, retry_max: float = 3600.0, poll: float = 5.0, on_done=None,
+                 verify=None, max_unverified: int = 0):
+        self.connect = connect
+        self.handler = handler
+        self.verify = verify
+        self.max_unverified = max_unverified  # 0 = no cap
+        self.workers = workers
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.poll = poll  # also picks up retries and events enqueued by other processes
+        self.on_done = on_done
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    # --- producer side ---
+
+    def enqueue(self, event_id: str, event_type: str, body: str, headers: dict | None = None,
+                resource_id: str | None = None, source: str = "paypal", delay: float = 0.0) -> bool:
+        """
+        Store a delivery (committed when this returns), due in `delay` seconds.
+        False if it's a duplicate: the same delivery was already stored, or the
+        event already has a verified row. Raises QueueFull past max_unverified.
+        """
+        headers_json = json.dumps(headers, sort_keys=True) if headers is not None else None
+        delivery = hashlib.sha256(f"{headers_json}\n{body}".encode("utf-8")).hexdigest()
+        with closing(self.connect()) as conn:
+            if self.verify is not None:
+                if conn.execute("SELECT 1 FROM webhook_events WHERE event_id = ? AND verified = 1", (event_id,)).fetchone():
+                    return False
+                if self.max_unverified and self.unverified(conn) >= self.max_unverified:
+                    raise QueueFull(f"{self.max_unverified} unverified events waiting")
+            cur = conn.execute("""
+                INSERT OR IGNORE INTO webhook_events
+                    (event_id, delivery, verified, source, event_type, resource_id, body, headers, next_attempt_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (event_id, delivery, int(self.verify is None), source, event_type, resource_id, body,
+                  headers_json, time.time() + delay))
+            conn.commit()
+            new = cur.rowcount == 1
+        if new and not delay:
+            self._wake.set()
+        return new
+
+    # --- worker side ---
+
+    def claim(self):
+        with closing(self.connect()) as conn:
+            now = time.time()
+            row = conn.execute(CLAIM_SQL, (now, now + self.lease)).fetchone()
+            conn.commit()
+        if row is None:
+            return None
+        event = dict(zip(EVENT_KEYS, row))
+        event["headers"] = json.loads(event["headers"]) if event["headers"] else {}
+        return event
+
+    def _finish(self, event: dict, status: str, result=None, error: str | None = None, retry_at: float | None = None):
+        # attempts guards against a worker whose lease ran out finishing over the one that took the event over
+        with closing(self.connect()) as conn:
+            conn.execute("""
+                UPDATE webhook_events
+                   SET status = ?, result = ?, last_error = ?, next_attempt_at = COALESCE(?, next_attempt_at),
+                       processed_at = CASE WHEN ? IN ('done', 'failed', 'rejected') THEN CURRENT_TIMESTAMP END
+                 WHERE id = ? AND status = 'processing' AND attempts = ?
+            """, (status, json.dumps(result) if result is not None else None, error, retry_at, status,
+                  event["id"], event["attempts"]))
+            conn.commit()
+
+    def _check_delivery(self, event: dict):
+        """Verify an unverified row. Returns the id of the event's verified row if that's another one (a duplicate)."""
+        if self.verify is None or event["verified"]:
+            return None
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT id FROM webhook_events WHERE event_id = ? AND verified = 1",
+                               (event["event_id"],)).fetchone()
+        if row is not None:
+            return row[0]  # no need to ask whether this one is genuine
+        if not self.verify(event):
+            raise Reject("signature verification failed")
+        with closing(self.connect()) as conn:
+            try:
+                conn.execute("UPDATE webhook_events SET verified = 1 WHERE id = ?", (event["id"],))
+                conn.commit()
+            except sqlite3.IntegrityError:
+                # another delivery of the same event was verified in the meantime
+                conn.rollback()
+                return conn.execute("SELECT id FROM webhook_events WHERE event_id = ? AND verified = 1",
+                                    (event["event_id"],)).fetchone()[0]
+        event["verified"] = 1
+        return None
+
+    def process_one(self) -> bool:
+        """Claim and handle one due event in the calling thread. False when nothing was due."""
+        event = self.claim()
+        if event is None:
+            return False
+        t0 = time.perf_counter()
+        error = None
+        try:
+            duplicate_of = self._check_delivery(event)
+            result = {"duplicate_of": duplicate_of} if duplicate_of is not None else self.handler(event)
+            status = "done"
+            self._finish(event, status, result=result)
+        except Reject as e:
+            status, error = "rejected", str(e)
+            self._finish(event, status, error=error)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if event["attempts"] >= self.max_attempts:
+                status = "failed"
+                self._finish(event, status, error=error)
+            else:
+                status = "pending"
+                delay = min(self.retry_base * 2 ** (event["attempts"] - 1), self.retry_max)
+                self._finish(event, status, error=error, retry_at=time.time() + delay * random.uniform(0.9, 1.1))
+        if self.on_done:
+            self.on_done(event, status, time.perf_counter() - t0, error)
+        return True
+
+    def drain(self, limit: int = 1000) -> int:
+        """Process due events in the calling thread until none are left (or `limit`). Returns events handled."""
+        n = 0
+        while n < limit and self.process_one():
+            n += 1
+        return n
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.process_one():
+                    continue
+            except Exception:
+                pass  # database busy/locked: the event stays claimable, try again after a pause
+            self._wake.wait(self.poll)
+            self._wake.clear()
+
+    # --- lifecycle ---
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._loop, name=f"event-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def running(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    # --- admin ---
+
+    @staticmethod
+    def unverified(conn) -> int:
+        # open rows only, so it's read from the small idx_webhook_events_due
+        return conn.execute("""
+            SELECT COUNT(*) FROM webhook_events WHERE status IN ('pending', 'processing') AND verified = 0
+        """).fetchone()[0]
+
+    def stats(self) -> dict:
+        with closing(self.connect()) as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM webhook_events GROUP BY status").fetchall())
+            oldest = conn.execute("""
+                SELECT MIN(received_at) FROM webhook_events WHERE status IN ('pending', 'processing')
+            """).fetchone()[0]
+            unverified = self.unverified(conn)
+        return {"counts": {s: counts.get(s, 0) for s in STATUSES}, "oldest_open": oldest, "unverified_open": unverified,
+                "max_unverified": self.max_unverified, "workers": len(self._threads), "running": self.running()}
+
+    def retry(self, event_ids=None, status: str = "failed") -> int:
+        """Put failed/rejected rows (all with that status, or just those of event_ids) back in the queue with fresh attempts."""
+        with closing(self.connect()) as conn:
+            sql = "UPDATE webhook_events SET status='pending', attempts=0, next_attempt_at=?, processed_at=NULL WHERE status=?"
+            params = [time.time(), status]
+            if event_ids:
+                sql += f" AND event_id IN ({','.join('?' * len(event_ids))})"
+                params += list(event_ids)
+            n = conn.execute(sql, params).rowcount
+            conn.commit()
+        if n:
+            self._wake.set()
+        return n
+
+    def prune(self, keep_days: float) -> dict:
+        """Forget done/rejected events older than keep_days (dedup only matters while PayPal still redelivers)."""
+        with closing(self.connect()) as conn:
+            n = conn.execute("""
+                DELETE FROM webhook_events
+                 WHERE status IN ('done', 'rejected') AND processed_at < datetime('now', ?)
+            """, (f"-{float(keep_days)} days",)).rowcount
+            conn.commit()
+        return {"deleted": n}
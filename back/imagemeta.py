@@ -0,0 +1,112 @@
+"""
+Per-image metadata for progressive rendering: pixel size, byte size, a
+dominant colour (for a plain placeholder) and a BlurHash string (for a
+blurred one, decoded on the client; see blurha.sh). Pure Python + Pillow.
+
+Both are computed from a 32px copy of the image, so the cost doesn't
+depend on the upload's size.
+"""
+import math
+import os
+
+from PIL import Image
+
+SAMPLE_SIZE = 32
+BLURHASH_COMPONENTS = (4, 3)  # x, y; 4x3 is the usual choice for product photos (~28 chars)
+
+_BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+_SRGB_TO_LINEAR = [((v / 255) / 12.92) if v / 255 <= 0.04045 else ((v / 255 + 0.055) / 1.055) ** 2.4
+                   for v in range(256)]
+
+
+def _encode83(value: int, length: int) -> str:
+    return "".join(_BASE83[(value // 83 ** (length - i - 1)) % 83] for i in range(length))
+
+
+def _linear_to_srgb(v: float) -> int:
+    v = max(0.0, min(1.0, v))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(v: float, exp: float) -> float:
+    return math.copysign(abs(v) ** exp, v)
+
+
+def _sample(img: Image.Image) -> Image.Image:
+    small = img.convert("RGBA") if "transparency" in img.info else img
+    small = small.convert("RGB") if small.mode != "RGB" else small.copy()
+    small.thumbnail((SAMPLE_SIZE, SAMPLE_SIZE), Image.Resampling.BILINEAR)
+    return small
+
+
+def blurhash(sample: Image.Image, x_components: int = BLURHASH_COMPONENTS[0],
+             y_components: int = BLURHASH_COMPONENTS[1]) -> str:
+    """BlurHash of an RGB image (pass a small one: cost is pixels x components)."""
+    width, height = sample.size
+    pixels = [(_SRGB_TO_LINEAR[r], _SRGB_TO_LINEAR[g], _SRGB_TO_LINEAR[b]) for r, g, b in sample.getdata()]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            r = g = b = 0.0
+            cx = cos_x[i]
+            for y in range(height):
+                cy = cos_y[j][y]
+                row = pixels[y * width:(y + 1) * width]
+                for x, (pr, pg, pb) in enumerate(row):
+                    basis = cx[x] * cy
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = (1 if i == 0 and j == 0 else 2) / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    out = _encode83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(c) for f in ac for c in f)
+        quantised_max = max(0, min(82, int(actual_max * 166 - 0.5)))
+        max_value = (quantised_max + 1) / 166
+        out += _encode83(quantised_max, 1)
+    else:
+        max_value = 1.0
+        out += _encode83(0, 1)
+    out += _encode83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+    for f in ac:
+        q = [max(0, min(18, int(_sign_pow(c / max_value, 0.5) * 9 + 9.5))) for c in f]
+        out += _encode83(q[0] * 19 * 19 + q[1] * 19 + q[2], 2)
+    return out
+
+
+def dominant_color(sample: Image.Image, colors: int = 5) -> str:
+    """Most common colour after reducing the sample to a few colours, as #rrggbb."""
+    quantized = sample.quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
+    palette = quantized.getpalette()
+    _, index = max(quantized.getcolors())
+    r, g, b = palette[index * 3:index * 3 + 3]
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def describe(img: Image.Image, nbytes: int | None = None) -> dict:
+    """Metadata for an image already in memory (e.g. the processed upload right before/after saving)."""
+    sample = _sample(img)
+    return {
+        "width": img.size[0],
+        "height": img.size[1],
+        "bytes": nbytes,
+        "color": dominant_color(sample),
+        "blurhash": blurhash(sample),
+    }
+
+
+def describe_file(path: str) -> dict:
+    with Image.open(path) as img:
+        width, height = img.size
+        img.draft("RGB", (SAMPLE_SIZE, SAMPLE_SIZE))  # JPEG: decode at 1/8 scale, the sample is tiny anyway
+        meta = describe(img, os.path.getsize(path))
+    meta["width"], meta["height"] = width, height
+    return meta
@@ -1,6 +1,8 @@
 import os
 import sqlite3
 
+import analytics
+
 DATABASE = 'shop.db'
 
 
@@ -14,202 +16,707 @@ def table_exists(cursor, table_name: str) -> bool:
 
 
 def column_exists(cursor, table_name: str, column_name: str) -> bool:
-    """Check if a given column exists in a table."""
-    cursor.execute(f"PRAGMA table_info({table_name})")
+    """Check if a given column exists in a table (generated columns included)."""
+    cursor.execute(f"PRAGMA table_xinfo({table_name})")
     return any(row[1] == column_name for row in cursor.fetchall())
 
 
-def create_or_update_db_table():
-    conn = sqlite3.connect(DATABASE)
-    try:
-        # Make sure foreign key constraints are enforced
-        conn.execute("PRAGMA foreign_keys = ON;")
-        cursor = conn.cursor()
+# ----------------------------
+# Migrations
+# ----------------------------
+# The schema version lives in PRAGMA user_version. Each migration has a
+# number and is applied at most once, in order. Schema migrations run in a
+# single BEGIN EXCLUSIVE transaction together with the version bump, so a
+# second worker starting at the same time just waits and then sees the new
+# version. Chunked (data) migrations process CHUNK_SIZE rows per short
+# transaction so they never hold the write lock for long; they must be
+# idempotent per chunk and return how many rows they touched (0 = done).
+
+CHUNK_SIZE = 5000
+MIGRATIONS = []
+
+
+def migration(version: int, description: str, chunked: bool = False):
+    def register(fn):
+        MIGRATIONS.append((version, description, chunked, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def get_schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+@migration(1, "baseline schema (tables, image indexes, column backfills)")
+def _m001_baseline(cursor):
+    # MAIN TABLES (latest schema)
+    # Products: image_path is gone, images live in product_images
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            bio TEXT,
+            price REAL NOT NULL,
+            discount_price REAL,
+            limited_edition INTEGER DEFAULT 0,
+            sold_out INTEGER DEFAULT 0,
+            almost_sold_out INTEGER DEFAULT 0
+        )
+    ''')
+
+    # Services: same deal, image_path removed
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS services (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            bio TEXT,
+            price REAL NOT NULL,
+            discount_price REAL,
+            active INTEGER DEFAULT 1
+        )
+    ''')
+
+    # Contact form submissions
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS contact_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            message TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+    ''')
+
+    # Users: fairly standard auth + some profile data
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT NOT NULL UNIQUE,
+            username TEXT NOT NULL,
+            password_hash TEXT NOT NULL,
+            salt TEXT NOT NULL,
+            phone TEXT,
+            address TEXT,
+            preferred_payment TEXT
+        )
+    ''')
+
+    # Orders + order_items: classic one-to-many
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            status TEXT CHECK(status IN ('ordered', 'confirmed', 'shipped', 'delivered')) NOT NULL DEFAULT 'ordered',
+            shipping_date TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS order_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            FOREIGN KEY (order_id) REFERENCES orders(id),
+            FOREIGN KEY (product_id) REFERENCES products(id)
+        )
+    ''')
+
+    # Product images (new normalized table)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS product_images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL,
+            image_path TEXT NOT NULL,
+            alt_text TEXT,
+            sort_order INTEGER DEFAULT 0,
+            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_product_images_product_id ON product_images(product_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_product_images_sort ON product_images(product_id, sort_order)')
+
+    # Service images (same idea as products)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS service_images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            service_id INTEGER NOT NULL,
+            image_path TEXT NOT NULL,
+            alt_text TEXT,
+            sort_order INTEGER DEFAULT 0,
+            FOREIGN KEY (service_id) REFERENCES services(id) ON DELETE CASCADE
+        )
+    ''')
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS discount_codes (
+            id            INTEGER PRIMARY KEY AUTOINCREMENT,
+            code          TEXT NOT NULL UNIQUE,
+            kind          TEXT NOT NULL CHECK (kind IN ('percent','fixed')),
+            value         REAL NOT NULL CHECK (value >= 0),
+            active        INTEGER NOT NULL DEFAULT 1,               -- 1=true, 0=false
+            starts_at     TEXT,                                     -- ISO8601 or NULL
+            expires_at    TEXT,                                     -- ISO8601 or NULL
+            max_uses      INTEGER,                                  -- NULL = unlimited
+            used_count    INTEGER NOT NULL DEFAULT 0,
+            applies_to    TEXT DEFAULT 'all',                       -- 'all' | 'product' | 'service' (extend as needed)
+            created_at    TEXT NOT NULL DEFAULT (datetime('now'))
+        );
+        """)
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_service_images_service_id ON service_images(service_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_service_images_sort ON service_images(service_id, sort_order)')
 
-        # MAIN TABLES (latest schema)
-        # Products: image_path is gone, images live in product_images
+    # Add missing columns to products if the DB was created earlier
+    products_backfill = [
+        ('products', 'bio', 'TEXT'),
+        ('products', 'price', 'REAL NOT NULL DEFAULT 0'),
+        ('products', 'discount_price', 'REAL'),
+        ('products', 'limited_edition', 'INTEGER DEFAULT 0'),
+        ('products', 'sold_out', 'INTEGER DEFAULT 0'),
+        ('products', 'almost_sold_out', 'INTEGER DEFAULT 0'),
+    ]
+    for table, col, definition in products_backfill:
+        if table_exists(cursor, table) and not column_exists(cursor, table, col):
+            print(f"Adding column {col} to {table}")
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {col} {definition}')
+
+    # Add missing columns to services
+    services_backfill = [
+        ('services', 'bio', 'TEXT'),
+        ('services', 'discount_price', 'REAL'),
+        ('services', 'active', 'INTEGER DEFAULT 1'),
+    ]
+    for table, col, definition in services_backfill:
+        if table_exists(cursor, table) and not column_exists(cursor, table, col):
+            print(f"Adding column {col} to {table}")
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {col} {definition}')
+
+    # Add missing columns to users
+    users_backfill = [
+        ('users', 'preferred_payment', 'TEXT'),
+        ('users', 'phone', 'TEXT'),
+        ('users', 'address', 'TEXT'),
+    ]
+    for table, col, definition in users_backfill:
+        if table_exists(cursor, table) and not column_exists(cursor, table, col):
+            print(f"Adding column {col} to {table}")
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {col} {definition}')
+
+
+@migration(2, "copy legacy products/services.image_path into the image tables", chunked=True)
+def _m002_legacy_image_path(cursor, limit: int) -> int:
+    moved = 0
+    # Move legacy product.image_path into product_images
+    if column_exists(cursor, 'products', 'image_path'):
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                bio TEXT,
-                price REAL NOT NULL,
-                discount_price REAL,
-                limited_edition INTEGER DEFAULT 0,
-                sold_out INTEGER DEFAULT 0,
-                almost_sold_out INTEGER DEFAULT 0
-            )
-        ''')
+            INSERT INTO product_images (product_id, image_path, alt_text, sort_order)
+            SELECT p.id, p.image_path, NULL, 0
+            FROM products p
+            WHERE p.image_path IS NOT NULL AND TRIM(p.image_path) <> ''
+              AND NOT EXISTS (
+                  SELECT 1 FROM product_images pi
+                  WHERE pi.product_id = p.id AND pi.sort_order = 0
+              )
+            LIMIT ?
+        ''', (limit,))
+        moved += cursor.rowcount
 
-        # Services: same deal, image_path removed
+    # Move legacy service.image_path into service_images
+    if moved < limit and column_exists(cursor, 'services', 'image_path'):
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS services (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                bio TEXT,
-                price REAL NOT NULL,
-                discount_price REAL,
-                active INTEGER DEFAULT 1
-            )
+            INSERT INTO service_images (service_id, image_path, alt_text, sort_order)
+            SELECT s.id, s.image_path, NULL, 0
+            FROM services s
+            WHERE s.image_path IS NOT NULL AND TRIM(s.image_path) <> ''
+              AND NOT EXISTS (
+                  SELECT 1 FROM service_images si
+                  WHERE si.service_id = s.id AND si.sort_order = 0
+              )
+            LIMIT ?
+        ''', (limit - moved,))
+        moved += cursor.rowcount
+
+    if moved:
+        print(f"Migrated {moved} legacy image_path rows...")
+    return moved
+
+
+# products/services carry their first image + image count so listings don't
+# need a correlated subquery per row. Kept in sync by triggers on the image tables.
+IMAGE_OWNERS = (
+    # (owner table, image table, FK column)
+    ('products', 'product_images', 'product_id'),
+    ('services', 'service_images', 'service_id'),
+)
+
+
+def _image_summary_sql(owner: str, images: str, fk: str, ref: str) -> str:
+    return f'''
+        UPDATE {owner} SET
+            primary_image = (
+                SELECT image_path FROM {images}
+                 WHERE {fk} = {ref}
+                 ORDER BY sort_order ASC, id ASC
+                 LIMIT 1
+            ),
+            image_count = (SELECT COUNT(*) FROM {images} WHERE {fk} = {ref})
+        WHERE id = {ref};
+    '''
+
+
+@migration(3, "primary_image/image_count columns on products and services + sync triggers")
+def _m003_primary_image(cursor):
+    for owner, images, fk in IMAGE_OWNERS:
+        if not column_exists(cursor, owner, 'primary_image'):
+            cursor.execute(f'ALTER TABLE {owner} ADD COLUMN primary_image TEXT')
+        if not column_exists(cursor, owner, 'image_count'):
+            cursor.execute(f'ALTER TABLE {owner} ADD COLUMN image_count INTEGER NOT NULL DEFAULT 0')
+
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{images}_ai AFTER INSERT ON {images}
+            BEGIN {_image_summary_sql(owner, images, fk, f"NEW.{fk}")} END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{images}_ad AFTER DELETE ON {images}
+            BEGIN {_image_summary_sql(owner, images, fk, f"OLD.{fk}")} END
+        ''')
+        # An image can move to another owner, so refresh both sides
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{images}_au AFTER UPDATE OF {fk}, image_path, sort_order ON {images}
+            BEGIN
+                {_image_summary_sql(owner, images, fk, f"OLD.{fk}")}
+                {_image_summary_sql(owner, images, fk, f"NEW.{fk}")}
+            END
         ''')
 
-        # Contact form submissions
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS contact_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                email TEXT NOT NULL,
-                message TEXT NOT NULL,
-                created_at TEXT NOT NULL DEFAULT (datetime('now'))
+
+@migration(4, "backfill primary_image/image_count", chunked=True)
+def _m004_backfill_primary_image(cursor, limit: int) -> int:
+    # Rows that have images but still image_count = 0 are the ones not done yet
+    done = 0
+    for owner, images, fk in IMAGE_OWNERS:
+        cursor.execute(f'''
+            UPDATE {owner} SET
+                primary_image = (
+                    SELECT image_path FROM {images} i
+                     WHERE i.{fk} = {owner}.id
+                     ORDER BY i.sort_order ASC, i.id ASC
+                     LIMIT 1
+                ),
+                image_count = (SELECT COUNT(*) FROM {images} i WHERE i.{fk} = {owner}.id)
+            WHERE id IN (
+                SELECT o.id FROM {owner} o
+                 WHERE o.image_count = 0
+                   AND EXISTS (SELECT 1 FROM {images} i WHERE i.{fk} = o.id)
+                 LIMIT ?
             )
-        ''')
+        ''', (limit - done,))
+        done += cursor.rowcount
+        if done >= limit:
+            break
+    if done:
+        print(f"Backfilled primary_image for {done} rows...")
+    return done
+
+
+@migration(5, "indexes for foreign keys and common filters")
+def _m005_missing_indexes(cursor):
+    # FK columns: SQLite doesn't index them on its own
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items(order_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_items_product_id ON order_items(product_id)')
+    # Admin inbox sorts by date, services_get filters on active
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_contact_messages_created_at ON contact_messages(created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_services_active ON services(active)')
 
-        # Users: fairly standard auth + some profile data
+
+@migration(6, "contact_messages.ref for idempotent write-behind inserts")
+def _m006_contact_message_ref(cursor):
+    # Client-side id of a queued message: replaying the spool file after a
+    # crash must not insert messages that already made it to the table
+    if not column_exists(cursor, 'contact_messages', 'ref'):
+        cursor.execute('ALTER TABLE contact_messages ADD COLUMN ref TEXT')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_contact_messages_ref ON contact_messages(ref)')
+
+
+# What a customer actually pays for one unit. The only definition of the rule:
+# checkout, listing sorts and price filters all read effective_price.
+EFFECTIVE_PRICE_SQL = "CASE WHEN discount_price IS NOT NULL AND discount_price < price THEN discount_price ELSE price END"
+
+
+@migration(7, "effective_price generated column + indexes on products and services")
+def _m007_effective_price(cursor):
+    # ALTER TABLE can only add VIRTUAL generated columns (STORED would mean
+    # rebuilding the tables). The indexes are only read by the SQL listing
+    # path (CATALOG_CACHE=0); with the cache on, filters and sorts run on the
+    # in-memory CompactCatalog and never touch them.
+    for table in ('products', 'services'):
+        if not column_exists(cursor, table, 'effective_price'):
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN effective_price REAL '
+                           f'GENERATED ALWAYS AS ({EFFECTIVE_PRICE_SQL}) VIRTUAL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_effective_price ON products(effective_price)')
+    # Storefront only lists active services
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_services_active_effective_price ON services(active, effective_price)')
+
+
+@migration(8, "token revocation: users.token_generation + token_revocations event log")
+def _m008_token_revocation(cursor):
+    # Bumped on password change / "log out everywhere"; tokens carry it as "gen"
+    if not column_exists(cursor, 'users', 'token_generation'):
+        cursor.execute('ALTER TABLE users ADD COLUMN token_generation INTEGER NOT NULL DEFAULT 0')
+    # One row per revocation: a single token (jti) or a user's new generation.
+    # AUTOINCREMENT so ids never get reused - workers sync by "id > last seen".
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS token_revocations (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            jti         TEXT,
+            user_id     INTEGER,
+            generation  INTEGER NOT NULL DEFAULT 0,
+            expires_at  INTEGER NOT NULL,
+            created_at  TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_token_revocations_expires_at ON token_revocations(expires_at)')
+
+
+@migration(9, "image_meta: dimensions, size, dominant color and blurhash per image path")
+def _m009_image_meta(cursor):
+    # Keyed by path, not image row: the same upload can back a product and a
+    # service image, and upload_image() runs before the path is attached to
+    # anything. Filled at upload and by the image_meta_backfill maintenance
+    # task; a row with error set is a file that couldn't be read (not retried).
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_meta (
+            path        TEXT PRIMARY KEY,
+            width       INTEGER,
+            height      INTEGER,
+            bytes       INTEGER,
+            color       TEXT,
+            blurhash    TEXT,
+            error       TEXT,
+            computed_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+@migration(10, "orders: totals, PayPal id, (user_id, id) index; order_items snapshots; checkouts")
+def _m010_order_history(cursor):
+    for column, decl in (('created_at', 'TEXT'), ('paypal_order_id', 'TEXT'), ('currency', 'TEXT'),
+                         ('subtotal', 'REAL'), ('discount', 'REAL'), ('total', 'REAL'), ('discount_code', 'TEXT')):
+        if not column_exists(cursor, 'orders', column):
+            # ALTER TABLE can't add a CURRENT_TIMESTAMP default; inserts set created_at
+            cursor.execute(f'ALTER TABLE orders ADD COLUMN {column} {decl}')
+    # A capture (browser or webhook) creates at most one order
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_paypal_order_id ON orders(paypal_order_id)')
+    # Order history: WHERE user_id=? AND id < ? ORDER BY id DESC (keyset pages)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_id_id ON orders(user_id, id)')
+    cursor.execute('DROP INDEX IF EXISTS idx_orders_user_id')  # prefix of the one above
+
+    # order_items is rebuilt (SQLite can't relax NOT NULL / change a FK in place):
+    # the line keeps what was bought at the time (name, unit price, qty,
+    # image), so deleting or repricing a product doesn't rewrite history and
+    # the FK just goes NULL. Services are ordered too, hence kind/service_id.
+    if not column_exists(cursor, 'order_items', 'unit_price'):
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email TEXT NOT NULL UNIQUE,
-                username TEXT NOT NULL,
-                password_hash TEXT NOT NULL,
-                salt TEXT NOT NULL,
-                phone TEXT,
-                address TEXT,
-                preferred_payment TEXT
+            CREATE TABLE order_items_new (
+                id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                order_id    INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+                kind        TEXT NOT NULL DEFAULT 'product' CHECK(kind IN ('product', 'service')),
+                product_id  INTEGER REFERENCES products(id) ON DELETE SET NULL,
+                service_id  INTEGER REFERENCES services(id) ON DELETE SET NULL,
+                name        TEXT,
+                unit_price  REAL,
+                qty         INTEGER NOT NULL DEFAULT 1,
+                image_url   TEXT
             )
         ''')
-
-        # Orders + order_items: classic one-to-many
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                status TEXT CHECK(status IN ('ordered', 'confirmed', 'shipped', 'delivered')) NOT NULL DEFAULT 'ordered',
-                shipping_date TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
+            INSERT INTO order_items_new (id, order_id, kind, product_id, name, unit_price, image_url)
+            SELECT oi.id, oi.order_id, 'product', oi.product_id, p.name, p.effective_price, p.primary_image
+              FROM order_items oi LEFT JOIN products p ON p.id = oi.product_id
         ''')
+        cursor.execute('DROP TABLE order_items')
+        cursor.execute('ALTER TABLE order_items_new RENAME TO order_items')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items(order_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_items_product_id ON order_items(product_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_items_service_id ON order_items(service_id)')
+
+    # Created with the PayPal order, turned into an orders row when it's
+    # captured. lines = the priced cart as JSON (same shape as order_items).
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS checkouts (
+            paypal_order_id TEXT PRIMARY KEY,
+            user_id         INTEGER REFERENCES users(id) ON DELETE SET NULL,
+            lines           TEXT NOT NULL,
+            currency        TEXT,
+            subtotal        REAL,
+            discount        REAL,
+            total           REAL,
+            discount_code   TEXT,
+            order_id        INTEGER REFERENCES orders(id),
+            created_at      TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_checkouts_created_at ON checkouts(created_at)')
+
+
+# The values of the CHECK on orders.status (migration 1), in fulfillment order.
+# The server validates status changes against this before writing, so a bad
+# value is rejected per order instead of aborting a batch with a CHECK error.
+ORDER_STATUSES = ('ordered', 'confirmed', 'shipped', 'delivered')
 
+
+@migration(11, "orders(status, id) index for the fulfillment queue")
+def _m011_orders_status_index(cursor):
+    # WHERE status=? AND id > ? ORDER BY id (keyset pages), and per-status counts from the index alone
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_status_id ON orders(status, id)')
+
+
+@migration(12, "sales summary tables (analytics.py) + checkouts.captured_at, built from existing checkouts", chunked=True)
+def _m012_sales_summaries(cursor, limit: int) -> int:
+    # First call: the (cheap) schema part and a progress row, committed on their own.
+    # Then `limit` checkouts per call, in paypal_order_id order; the progress row moves
+    # in the same transaction, so an interrupted run resumes where it stopped.
+    # Workers only serve once migrate() returned, so no live capture is counted twice.
+    if not table_exists(cursor, '_m012_progress'):
+        if not column_exists(cursor, 'checkouts', 'captured_at'):
+            cursor.execute('ALTER TABLE checkouts ADD COLUMN captured_at TEXT')
+        # The tables as they were at this version (analytics.SCHEMA is the current shape, may move on)
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS order_items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                order_id INTEGER NOT NULL,
-                product_id INTEGER NOT NULL,
-                FOREIGN KEY (order_id) REFERENCES orders(id),
-                FOREIGN KEY (product_id) REFERENCES products(id)
-            )
+            CREATE TABLE IF NOT EXISTS sales_daily (
+                day      TEXT NOT NULL,
+                kind     TEXT NOT NULL,
+                item_id  INTEGER NOT NULL,
+                name     TEXT,
+                orders   INTEGER NOT NULL DEFAULT 0,
+                units    INTEGER NOT NULL DEFAULT 0,
+                revenue  REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, kind, item_id)
+            ) WITHOUT ROWID
         ''')
-
-        # Product images (new normalized table)
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS product_images (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_id INTEGER NOT NULL,
-                image_path TEXT NOT NULL,
-                alt_text TEXT,
-                sort_order INTEGER DEFAULT 0,
-                FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
-            )
+            CREATE TABLE IF NOT EXISTS sales_daily_totals (
+                day      TEXT PRIMARY KEY,
+                orders   INTEGER NOT NULL DEFAULT 0,
+                units    INTEGER NOT NULL DEFAULT 0,
+                subtotal REAL NOT NULL DEFAULT 0,
+                discount REAL NOT NULL DEFAULT 0,
+                revenue  REAL NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
         ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_product_images_product_id ON product_images(product_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_product_images_sort ON product_images(product_id, sort_order)')
-
-        # Service images (same idea as products)
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS service_images (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                service_id INTEGER NOT NULL,
-                image_path TEXT NOT NULL,
-                alt_text TEXT,
-                sort_order INTEGER DEFAULT 0,
-                FOREIGN KEY (service_id) REFERENCES services(id) ON DELETE CASCADE
-            )
+            CREATE TABLE IF NOT EXISTS discount_daily (
+                day      TEXT NOT NULL,
+                code     TEXT NOT NULL,
+                orders   INTEGER NOT NULL DEFAULT 0,
+                discount REAL NOT NULL DEFAULT 0,
+                revenue  REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, code)
+            ) WITHOUT ROWID
         ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS checkout_daily (
+                day      TEXT PRIMARY KEY,
+                created  INTEGER NOT NULL DEFAULT 0,
+                captured INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+        for table in ('sales_daily', 'sales_daily_totals', 'discount_daily', 'checkout_daily'):
+            cursor.execute(f'DELETE FROM {table}')
+        cursor.execute('CREATE TABLE _m012_progress (last_key TEXT NOT NULL)')
+        cursor.execute("INSERT INTO _m012_progress (last_key) VALUES ('')")
+        return 1
+    after = cursor.execute('SELECT last_key FROM _m012_progress').fetchone()[0]
+    # Until now only customers' captures left a trace (the order)
+    cursor.execute('''
+        UPDATE checkouts SET captured_at = (SELECT created_at FROM orders WHERE orders.id = checkouts.order_id)
+         WHERE order_id IS NOT NULL AND captured_at IS NULL
+           AND paypal_order_id IN (SELECT paypal_order_id FROM checkouts WHERE paypal_order_id > ?
+                                    ORDER BY paypal_order_id LIMIT ?)
+    ''', (after, limit))
+    count, last = analytics.add_chunk(cursor, after, limit)
+    if not count:
+        cursor.execute('DROP TABLE _m012_progress')  # same transaction as the version bump
+        return 0
+    cursor.execute('UPDATE _m012_progress SET last_key = ?', (last,))
+    print(f"Summarized {count} checkouts (up to {last})...")
+    return count
 
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS discount_codes (
-                id            INTEGER PRIMARY KEY AUTOINCREMENT,
-                code          TEXT NOT NULL UNIQUE,
-                kind          TEXT NOT NULL CHECK (kind IN ('percent','fixed')),
-                value         REAL NOT NULL CHECK (value >= 0),
-                active        INTEGER NOT NULL DEFAULT 1,               -- 1=true, 0=false
-                starts_at     TEXT,                                     -- ISO8601 or NULL
-                expires_at    TEXT,                                     -- ISO8601 or NULL
-                max_uses      INTEGER,                                  -- NULL = unlimited
-                used_count    INTEGER NOT NULL DEFAULT 0,
-                applies_to    TEXT DEFAULT 'all',                       -- 'all' | 'product' | 'service' (extend as needed)
-                created_at    TEXT NOT NULL DEFAULT (datetime('now'))
-            );
-            """)
-
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_service_images_service_id ON service_images(service_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_service_images_sort ON service_images(service_id, sort_order)')
-
-        # Add missing columns to products if the DB was created earlier
-        products_backfill = [
-            ('products', 'bio', 'TEXT'),
-            ('products', 'price', 'REAL NOT NULL DEFAULT 0'),
-            ('products', 'discount_price', 'REAL'),
-            ('products', 'limited_edition', 'INTEGER DEFAULT 0'),
-            ('products', 'sold_out', 'INTEGER DEFAULT 0'),
-            ('products', 'almost_sold_out', 'INTEGER DEFAULT 0'),
-        ]
-        for table, col, definition in products_backfill:
-            if table_exists(cursor, table) and not column_exists(cursor, table, col):
-                print(f"Adding column {col} to {table}")
-                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {col} {definition}')
-
-        # Add missing columns to services
-        services_backfill = [
-            ('services', 'bio', 'TEXT'),
-            ('services', 'discount_price', 'REAL'),
-            ('services', 'active', 'INTEGER DEFAULT 1'),
-        ]
-        for table, col, definition in services_backfill:
-            if table_exists(cursor, table) and not column_exists(cursor, table, col):
-                print(f"Adding column {col} to {table}")
-                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {col} {definition}')
-
-        # Add missing columns to users
-        users_backfill = [
-            ('users', 'preferred_payment', 'TEXT'),
-            ('users', 'phone', 'TEXT'),
-            ('users', 'address', 'TEXT'),
-        ]
-        for table, col, definition in users_backfill:
-            if table_exists(cursor, table) and not column_exists(cursor, table, col):
-                print(f"Adding column {col} to {table}")
-                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {col} {definition}')
-
-        # Move legacy product.image_path into product_images
-        if column_exists(cursor, 'products', 'image_path'):
-            print("Migrating products.image_path to product_images...")
-            cursor.execute('''
-                INSERT INTO product_images (product_id, image_path, alt_text, sort_order)
-                SELECT p.id, p.image_path, NULL, 0
-                FROM products p
-                WHERE p.image_path IS NOT NULL AND TRIM(p.image_path) <> ''
-                  AND NOT EXISTS (
-                      SELECT 1 FROM product_images pi
-                      WHERE pi.product_id = p.id AND pi.sort_order = 0
-                  )
-            ''')
 
-        # Move legacy service.image_path into service_images
-        if column_exists(cursor, 'services', 'image_path'):
-            print("Migrating services.image_path to service_images...")
-            cursor.execute('''
-                INSERT INTO service_images (service_id, image_path, alt_text, sort_order)
-                SELECT s.id, s.image_path, NULL, 0
-                FROM services s
-                WHERE s.image_path IS NOT NULL AND TRIM(s.image_path) <> ''
-                  AND NOT EXISTS (
-                      SELECT 1 FROM service_images si
-                      WHERE si.service_id = s.id AND si.sort_order = 0
-                  )
+@migration(13, "webhook_events: durable, deduplicated queue of incoming PayPal webhooks (eventqueue.py)")
+def _m013_webhook_events(cursor):
+    # The table as it was at this version; migration 14 moves it to one row per delivery
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_events (
+            event_id        TEXT PRIMARY KEY,
+            source          TEXT NOT NULL,
+            event_type      TEXT NOT NULL,
+            resource_id     TEXT,
+            body            TEXT NOT NULL,
+            headers         TEXT,
+            status          TEXT NOT NULL DEFAULT 'pending'
+                            CHECK (status IN ('pending', 'processing', 'done', 'failed', 'rejected')),
+            attempts        INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error      TEXT,
+            result          TEXT,
+            received_at     TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            processed_at    TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_webhook_events_due
+            ON webhook_events(next_attempt_at) WHERE status IN ('pending', 'processing')
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_webhook_events_resource ON webhook_events(resource_id)')
+
+
+@migration(14, "webhook_events: one row per delivery, verified flag, one verified row per event id")
+def _m014_webhook_deliveries(cursor):
+    # event_id was the primary key, so a forged event could take a genuine
+    # one's id. Rows stored so far keep their event id as delivery key; done
+    # ones passed verification (or it was off) and count as verified.
+    cursor.execute('ALTER TABLE webhook_events RENAME TO _m014_webhook_events')
+    cursor.execute('DROP INDEX IF EXISTS idx_webhook_events_due')
+    cursor.execute('DROP INDEX IF EXISTS idx_webhook_events_resource')
+    cursor.execute('''
+        CREATE TABLE webhook_events (
+            id              INTEGER PRIMARY KEY,
+            event_id        TEXT NOT NULL,
+            delivery        TEXT NOT NULL,
+            verified        INTEGER NOT NULL DEFAULT 0,
+            source          TEXT NOT NULL,
+            event_type      TEXT NOT NULL,
+            resource_id     TEXT,
+            body            TEXT NOT NULL,
+            headers         TEXT,
+            status          TEXT NOT NULL DEFAULT 'pending'
+                            CHECK (status IN ('pending', 'processing', 'done', 'failed', 'rejected')),
+            attempts        INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error      TEXT,
+            result          TEXT,
+            received_at     TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            processed_at    TEXT,
+            UNIQUE (event_id, delivery)
+        )
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX idx_webhook_events_verified
+            ON webhook_events(event_id) WHERE verified = 1
+    ''')
+    cursor.execute('''
+        CREATE INDEX idx_webhook_events_due
+            ON webhook_events(next_attempt_at) WHERE status IN ('pending', 'processing')
+    ''')
+    cursor.execute('CREATE INDEX idx_webhook_events_resource ON webhook_events(resource_id)')
+    cursor.execute('''
+        INSERT INTO webhook_events (event_id, delivery, verified, source, event_type, resource_id, body, headers,
+                                    status, attempts, next_attempt_at, last_error, result, received_at, processed_at)
+        SELECT event_id, event_id, status = 'done', source, event_type, resource_id, body, headers,
+               status, attempts, next_attempt_at, last_error, result, received_at, processed_at
+          FROM _m014_webhook_events
+    ''')
+    cursor.execute('DROP TABLE _m014_webhook_events')
+
+
+@migration(15, "catalog_meta: catalog version moved by triggers on every catalog write (listing caches, ETags)")
+def _m015_catalog_version(cursor):
+    # One row; every write to a table the listings are built from moves the
+    # version in its own transaction, whichever process (or sqlite3 shell)
+    # made it. Microseconds since the epoch, never less than the last value
+    # + 1: a restored backup's next write still gets a version no running
+    # worker has seen, and restarts never hand out an old version again.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    now_us = "CAST((julianday('now') - 2440587.5) * 86400000000 AS INTEGER)"
+    cursor.execute(f'INSERT OR IGNORE INTO catalog_meta (id, version) VALUES (1, {now_us})')
+    for table in ('products', 'services', 'product_images', 'service_images', 'image_meta'):
+        for event, short in (('INSERT', 'ai'), ('UPDATE', 'au'), ('DELETE', 'ad')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_catalog_{short} AFTER {event} ON {table}
+                BEGIN UPDATE catalog_meta SET version = MAX(version + 1, {now_us}) WHERE id = 1; END
             ''')
 
+
+def _apply_schema_migration(conn, version: int, fn) -> bool:
+    conn.execute("BEGIN EXCLUSIVE")
+    try:
+        if get_schema_version(conn) >= version:
+            conn.rollback()  # another worker got there first
+            return False
+        fn(conn.cursor())
+        conn.execute(f"PRAGMA user_version = {int(version)}")
         conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _apply_chunked_migration(conn, version: int, fn, chunk_size: int) -> bool:
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                return False
+            if fn(conn.cursor(), chunk_size):
+                conn.commit()  # release the write lock between chunks
+                continue
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+            return True
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def migrate(conn, chunk_size: int | None = None) -> int:
+    """Apply pending migrations on an autocommit (isolation_level=None) connection. Returns how many ran."""
+    chunk_size = chunk_size or CHUNK_SIZE
+    current = get_schema_version(conn)
+    applied = 0
+    for version, description, chunked, fn in MIGRATIONS:
+        if version <= current:
+            continue
+        print(f"Applying migration {version}: {description}")
+        if chunked:
+            done = _apply_chunked_migration(conn, version, fn, chunk_size)
+        else:
+            done = _apply_schema_migration(conn, version, fn)
+        applied += int(done)
+        current = version
+    return applied
+
 
+def create_or_update_db_table():
+    # Autocommit mode: migrate() issues its own BEGIN EXCLUSIVE / IMMEDIATE
+    conn = sqlite3.connect(DATABASE, timeout=30, isolation_level=None)
+    try:
+        # Up to date -> one PRAGMA read and we're done
+        if get_schema_version(conn) >= latest_version():
+            return 0
+        # Brand-new file: turn on incremental auto-vacuum while it's still free
+        # (on an existing database this needs a full VACUUM, so we leave those alone)
+        if not conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+        # Make sure foreign key constraints are enforced (can't be toggled inside a transaction)
+        conn.execute("PRAGMA foreign_keys = ON;")
+        applied = migrate(conn)
+        # WAL: readers don't block the writer (and vice versa); persists in the file
+        conn.execute("PRAGMA journal_mode = WAL;")
+        return applied
     finally:
         conn.close()
 
@@ -219,8 +726,8 @@ if __name__ == '__main__':
             print("No database found → creating a new one...")
         else:
             print("Database found → checking schema and upgrading if needed...")
-        create_or_update_db_table()
-        print("✔ Done.")
+        applied = create_or_update_db_table()
+        print(f"✔ Done. Schema version {latest_version()} ({applied} migration(s) applied).")
     except sqlite3.Error as e:
         print(f"SQL error: {e}")
         input("Press Enter to exit...")
@@ -0,0 +1,151 @@
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def try_lock(path: str):
+    """Exclusive lock on `path` without waiting: the open file (keep it open to hold the lock) or None if taken."""
+    f = open(path, "a+")
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+class Task:
+    def __init__(self, name: str, fn, interval: float, quiet_only: bool = False, run_at_start: bool = False,
+                 single: bool = False):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.quiet_only = quiet_only
+        self.single = single
+        self.lock = threading.Lock()
+        self.next_due = time.monotonic() + (0 if run_at_start else interval)
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_duration_ms = None
+        self.last_result = None
+        self.last_error = None
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "interval_s": self.interval,
+            "quiet_only": self.quiet_only,
+            "single": self.single,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_run": self.last_run,
+            "last_duration_ms": self.last_duration_ms,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+            "due_in_s": max(0, round(self.next_due - time.monotonic(), 1)),
+            "running": self.lock.locked(),
+        }
+
+
+class Scheduler:
+    """
+    Tiny interval scheduler running on one daemon thread.
+
+    quiet_only tasks are postponed until is_quiet() says the server is idle.
+    on_run(name, seconds, error) is called after every run (metrics/logging).
+
+    Every worker process has its own scheduler. single tasks (backups,
+    ANALYZE, ... - once per database, not per process) only run in the one
+    process holding an exclusive lock on lock_path. It's taken on the first
+    tick that finds it free and kept until the process exits, so when that
+    process dies another one takes over. Without lock_path this process
+    runs them all.
+    """
+
+    def __init__(self, is_quiet=lambda: True, on_run=None, tick: float = 5.0, lock_path: str | None = None):
+        self.is_quiet = is_quiet
+        self.on_run = on_run
+        self.tick = tick
+        self.lock_path = lock_path
+        self._lock_file = None
+        self._tasks = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, name: str, fn, interval: float, quiet_only: bool = False, run_at_start: bool = False,
+            single: bool = False) -> Task:
+        task = self._tasks[name] = Task(name, fn, interval, quiet_only, run_at_start, single)
+        return task
+
+    def leader(self) -> bool:
+        """Whether this process runs the single tasks."""
+        return self.lock_path is None or self._lock_file is not None
+
+    def _take_lock(self) -> bool:
+        if self.lock_path is not None and self._lock_file is None:
+            self._lock_file = try_lock(self.lock_path)
+        return self.leader()
+
+    def tasks(self) -> list[str]:
+        return list(self._tasks)
+
+    def run_now(self, name: str) -> dict:
+        task = self._tasks[name]
+        self._run(task, blocking=True)
+        return task.status()
+
+    def status(self) -> list[dict]:
+        return [t.status() for t in self._tasks.values()]
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="maintenance", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, task: Task, blocking: bool = False):
+        if not task.lock.acquire(blocking=blocking):
+            return
+        error = None
+        t0 = time.perf_counter()
+        try:
+            task.last_result = task.fn()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            task.failures += 1
+        finally:
+            elapsed = time.perf_counter() - t0
+            task.runs += 1
+            task.last_run = datetime.now().isoformat(timespec="seconds")
+            task.last_duration_ms = round(elapsed * 1000, 2)
+            task.last_error = error
+            task.next_due = time.monotonic() + task.interval
+            task.lock.release()
+        if self.on_run:
+            self.on_run(task.name, elapsed, error)
+
+    def _loop(self):
+        while not self._stop.wait(self.tick):
+            now = time.monotonic()
+            leader = self._take_lock()
+            for task in list(self._tasks.values()):
+                if now < task.next_due:
+                    continue
+                if task.single and not leader:
+                    continue
+                if task.quiet_only and not self.is_quiet():
+                    continue
+                self._run(task)
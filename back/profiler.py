@@ -0,0 +1,96 @@
+import collections
+import itertools
+import os
+import sys
+import threading
+import time
+
+MAX_STACK_DEPTH = 64
+
+
+def _collapse(frame) -> str:
+    # "outer;inner;leaf" (flamegraph.pl / speedscope "collapsed" format)
+    parts = []
+    while frame is not None and len(parts) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    parts.reverse()
+    return ";".join(parts)
+
+
+class StackSampler:
+    """
+    Samples the Python stacks of tracked threads every `interval` seconds.
+
+    Only threads registered with track() are looked at, so the cost is close
+    to zero while no request is in flight. The sampling thread is started
+    lazily on first use.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._tracked = {}
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+            self._thread.start()
+
+    def track(self, thread_id: int) -> collections.Counter:
+        samples = collections.Counter()
+        with self._lock:
+            self._ensure_started()
+            self._tracked[thread_id] = samples
+        return samples
+
+    def untrack(self, thread_id: int):
+        with self._lock:
+            return self._tracked.pop(thread_id, None)
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._tracked:
+                    continue
+                tracked = list(self._tracked.items())
+            frames = sys._current_frames()
+            for tid, samples in tracked:
+                frame = frames.get(tid)
+                if frame is not None and tid != me:
+                    samples[_collapse(frame)] += 1
+
+
+class ProfileStore:
+    """Fixed-size ring buffer of captured request profiles (oldest dropped first)."""
+
+    def __init__(self, size: int = 50):
+        self._lock = threading.Lock()
+        self._entries = collections.deque(maxlen=max(1, size))
+        self._ids = itertools.count(1)
+
+    def add(self, entry: dict) -> int:
+        with self._lock:
+            entry["id"] = next(self._ids)
+            self._entries.append(entry)
+            return entry["id"]
+
+    def get(self, profile_id: int):
+        with self._lock:
+            for e in self._entries:
+                if e["id"] == profile_id:
+                    return e
+        return None
+
+    def summaries(self) -> list[dict]:
+        with self._lock:
+            entries = list(self._entries)
+        return [
+            {k: v for k, v in e.items() if k not in ("stacks", "sql", "pstats", "prof")}
+            | {"sql_count": len(e.get("sql") or []), "has_cprofile": bool(e.get("pstats"))}
+            for e in reversed(entries)
+        ]
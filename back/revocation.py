@@ -0,0 +1,120 @@
+"""
+In-memory token revocation list, so checking a token never touches the DB.
+
+Two ways a token stops being valid before its exp:
+    - its jti was revoked (logout): kept in a dict jti -> exp until it
+      would have expired anyway
+    - its "gen" claim is older than the user's token generation (password
+      change, "log out everywhere"): a dict user_id -> generation, only for
+      users that ever bumped it
+
+is_revoked() is two dict lookups. Changes are written to the
+token_revocations table (an append-only event log) by whichever worker
+makes them and applied to its own list once committed; other workers pick
+them up with sync(), which only reads events newer than the last one seen.
+sync_if_due() is what token checks call: at most one sync per interval,
+on the checking thread, so it doesn't wait behind any background task.
+"""
+import threading
+import time
+from contextlib import closing
+
+
+class RevocationList:
+    def __init__(self):
+        self.jtis = {}         # jti -> exp (unix seconds)
+        self.generations = {}  # user_id -> current token generation
+        self.last_event_id = 0
+        self.loaded = False
+        self.synced_at = 0.0  # time.monotonic() of the last load/sync
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def is_revoked(self, claims: dict) -> bool:
+        jti = claims.get("jti")
+        if jti is not None and jti in self.jtis:
+            return True
+        return self.generations.get(claims.get("user_id"), 0) > claims.get("gen", 0)
+
+    # --- local updates (also used when applying events) ---
+    # Our own writes don't move last_event_id: an event from another worker
+    # with a lower id may not have been synced yet. sync() re-applies ours, harmlessly.
+
+    def _apply(self, event_id: int, jti, user_id, generation, expires_at):
+        if jti:
+            self.jtis[jti] = expires_at
+        elif user_id is not None and generation > self.generations.get(user_id, 0):
+            self.generations[user_id] = generation
+        if event_id > self.last_event_id:
+            self.last_event_id = event_id
+
+    # --- DB side ---
+
+    # Both commit (together with whatever the caller wrote on conn) and only
+    # then update the list: a failed commit must not leave this worker
+    # rejecting tokens the database still considers valid.
+
+    def revoke_token(self, conn, jti: str, user_id, expires_at: int) -> int:
+        """Revoke one token. Commits conn."""
+        cur = conn.execute("INSERT INTO token_revocations (jti, user_id, expires_at) VALUES (?,?,?)",
+                           (jti, user_id, int(expires_at)))
+        conn.commit()
+        with self._lock:
+            self._apply(0, jti, user_id, 0, int(expires_at))
+        return cur.lastrowid
+
+    def revoke_user(self, conn, user_id: int, token_ttl: int) -> int:
+        """Invalidate every token the user has now. Returns the new generation (put it in new tokens). Commits conn."""
+        conn.execute("UPDATE users SET token_generation = token_generation + 1 WHERE id=?", (user_id,))
+        generation = conn.execute("SELECT token_generation FROM users WHERE id=?", (user_id,)).fetchone()[0]
+        # The event only has to live until the last token of the old generation has expired
+        cur = conn.execute("INSERT INTO token_revocations (user_id, generation, expires_at) VALUES (?,?,?)",
+                           (user_id, generation, int(time.time()) + token_ttl))
+        conn.commit()
+        with self._lock:
+            self._apply(0, None, user_id, generation, 0)
+        return generation
+
+    def load(self, conn):
+        """Full load at startup: generations from users, unexpired revoked jtis from the event log."""
+        now = int(time.time())
+        generations = dict(conn.execute("SELECT id, token_generation FROM users WHERE token_generation > 0"))
+        jtis = dict(conn.execute("SELECT jti, expires_at FROM token_revocations WHERE jti IS NOT NULL AND expires_at > ?", (now,)))
+        last = conn.execute("SELECT COALESCE(MAX(id), 0) FROM token_revocations").fetchone()[0]
+        with self._lock:
+            self.generations, self.jtis, self.last_event_id = generations, jtis, last
+            self.loaded = True
+        self.synced_at = time.monotonic()
+        return {"users": len(generations), "tokens": len(jtis), "last_event_id": last}
+
+    def sync(self, conn) -> int:
+        """Apply events written by other workers since the last load/sync. Returns how many were new."""
+        rows = conn.execute("""
+            SELECT id, jti, user_id, generation, expires_at FROM token_revocations
+             WHERE id > ? ORDER BY id
+        """, (self.last_event_id,)).fetchall()
+        with self._lock:
+            for row in rows:
+                self._apply(*row)
+        self.synced_at = time.monotonic()
+        return len(rows)
+
+    def sync_if_due(self, connect, interval: float):
+        """sync() on a connect() connection if the last one is `interval` seconds old. None if not due or another thread is at it."""
+        if time.monotonic() - self.synced_at < interval or not self._sync_lock.acquire(blocking=False):
+            return None
+        try:
+            with closing(connect()) as conn:
+                return self.sync(conn)
+        finally:
+            self.synced_at = time.monotonic()  # a failing database isn't asked again on every request either
+            self._sync_lock.release()
+
+    def prune(self, conn) -> dict:
+        """Forget revocations of tokens that have expired on their own (memory and DB). Caller commits."""
+        now = int(time.time())
+        with self._lock:
+            # New dict instead of deleting in place: is_revoked() reads without the lock
+            self.jtis = {jti: exp for jti, exp in self.jtis.items() if exp > now}
+        deleted = conn.execute("DELETE FROM token_revocations WHERE expires_at <= ?", (now,)).rowcount
+        return {"tokens_in_memory": len(self.jtis), "events_deleted": deleted}
@@ -0,0 +1,185 @@
+"""
+Fast JSON encoding for API responses.
+
+Uses orjson when it's installed (pip install orjson) and the stdlib json
+module otherwise; JSON_BACKEND=json in the environment forces the stdlib.
+RowSerializer turns sqlite row tuples straight into a JSON array of objects
+through a precomputed key template, so listings don't build a dict per row.
+"""
+import json
+import math
+import os
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None and os.environ.get("JSON_BACKEND", "auto") != "json" else "json"
+
+_encode_str = json.encoder.encode_basestring  # C-accelerated, keeps non-ASCII as-is
+
+
+def set_backend(name: str):
+    """Switch between "orjson" and "json" at runtime (benchmarks, debugging)."""
+    global BACKEND
+    if name == "orjson" and orjson is None:
+        raise RuntimeError("orjson is not installed")
+    if name not in ("orjson", "json"):
+        raise ValueError(f"unknown JSON backend {name!r}")
+    BACKEND = name
+
+
+def dumps(obj, default=None) -> bytes:
+    if BACKEND == "orjson":
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data):
+    return orjson.loads(data) if BACKEND == "orjson" else json.loads(data)
+
+
+def _json_value(v) -> str:
+    """Stdlib encoding of one scalar column value."""
+    if v is None:
+        return "null"
+    t = type(v)
+    if t is str:
+        return _encode_str(v)
+    if t is int:
+        return int.__repr__(v)
+    if t is float:
+        return float.__repr__(v) if math.isfinite(v) else "null"
+    if t is bool:
+        return "true" if v else "false"
+    return json.dumps(v, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _orjson_value(v) -> bytes:
+    return orjson.dumps(v, default=str)
+
+
+def _raw_json(v) -> str:
+    return "null" if v is None else v
+
+
+def _raw_json_bytes(v) -> bytes:
+    return b"null" if v is None else v.encode("utf-8")
+
+
+class RowSerializer:
+    """
+    Encode rows (tuples, in SELECT order) as JSON objects with the given keys.
+
+    converters maps a key to a function applied to that column first, e.g.
+    {"image_url": lambda v: v or None}. raw lists keys whose column already
+    holds JSON text (json_group_array(...) etc.), spliced in as-is. The object template ('{"id":%s,...}')
+    and a row function filling it are generated once, so per row there's one
+    call, one encode per value and one % format, and no dict.
+    """
+
+    def __init__(self, keys, converters: dict | None = None, raw=()):
+        self.keys = tuple(keys)
+        converters = converters or {}
+        self.raw = frozenset(raw)
+        unknown = (set(converters) | self.raw) - set(self.keys)
+        if unknown:
+            raise ValueError(f"converters/raw for unknown keys: {', '.join(sorted(unknown))}")
+        self._converters = [converters.get(k) for k in self.keys]
+        template = "{" + ",".join(json.dumps(k).replace("%", "%%") + ":%s" for k in self.keys) + "}"
+        self._template = template
+
+        env = {f"c{i}": fn for i, fn in enumerate(self._converters) if fn}
+        args = []
+        for i, (key, fn) in enumerate(zip(self.keys, self._converters)):
+            value = f"c{i}(r[{i}])" if fn else f"r[{i}]"
+            args.append(f"raw({value})" if key in self.raw else f"enc({value})")
+        src = f"lambda r: T % ({', '.join(args)},)"
+        self._fns = {"json": eval(src, {**env, "T": template, "enc": _json_value, "raw": _raw_json})}
+        if orjson is not None:
+            env.update(T=template.encode("utf-8"), raw=_raw_json_bytes)
+            self._fns["orjson"] = eval(src, {**env, "enc": orjson.dumps})
+            # orjson.dumps can't take default= positionally; rows with odd types (bytes, Decimal) go through this one
+            self._fns["orjson_safe"] = eval(src, {**env, "enc": _orjson_value})
+
+    def _check(self, row):
+        if len(row) != len(self.keys):
+            raise ValueError(f"row has {len(row)} columns, serializer expects {len(self.keys)}")
+
+    def _encode_orjson(self, row) -> bytes:
+        try:
+            return self._fns["orjson"](row)
+        except TypeError:
+            return self._fns["orjson_safe"](row)
+
+    def encode_row(self, row) -> bytes:
+        self._check(row)
+        if BACKEND == "orjson":
+            return self._encode_orjson(row)
+        return self._fns["json"](row).encode("utf-8")
+
+    def encode_rows(self, rows) -> bytes:
+        """JSON array of objects. Appends into one bytearray instead of joining a list of row strings."""
+        out = bytearray(b"[")
+        first = True
+        if BACKEND == "orjson":
+            fast, encode = self._fns["orjson"], self._encode_orjson
+            for row in rows:
+                if first:
+                    self._check(row)
+                    first = False
+                try:
+                    out += fast(row)
+                except TypeError:
+                    out += encode(row)
+                out += b","
+        else:
+            fn = self._fns["json"]
+            for row in rows:
+                if first:
+                    self._check(row)
+                    first = False
+                out += fn(row).encode("utf-8")
+                out += b","
+        if first:
+            out += b"]"
+        else:
+            out[-1:] = b"]"
+        return bytes(out)
+
+    def to_dict(self, row) -> dict:
+        """Same shape as encode_row, as a dict (for responses that nest rows in a bigger object)."""
+        self._check(row)
+        out = {}
+        for k, fn, v in zip(self.keys, self._converters, row):
+            v = fn(v) if fn else v
+            out[k] = loads(v) if k in self.raw and v is not None else v
+        return out
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by dumps()/loads() above. Keys keep insertion order."""
+
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs) -> str:
+        if BACKEND != "orjson" or kwargs:
+            kwargs.setdefault("default", self.default)
+            kwargs.setdefault("sort_keys", self.sort_keys)
+            kwargs.setdefault("ensure_ascii", self.ensure_ascii)
+            return json.dumps(obj, **kwargs)
+        return dumps(obj, default=self.default).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if BACKEND != "orjson" or kwargs:
+            return json.loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(obj)  # pretty-printed in debug mode, like stock Flask
+        return self._app.response_class(dumps(obj, default=self.default), mimetype=self.mimetype)
@@ -1,21 +1,38 @@
 try:
     import init_db
+    import metrics
+    import profiler
+    import maintenance
+    import backup_db
+    import serializer
+    import compression
+    import writebehind
+    import snapshot
+    import catalogstore
+    import revocation
+    import analytics
+    import eventqueue
+    import atexit
     import uuid
-    from flask import Flask, request, jsonify, send_from_directory
+    from flask import Flask, request, jsonify, send_from_directory, g, Response, has_request_context, stream_with_context
     from flask_cors import CORS
     import sqlite3
-    from datetime import datetime
+    from datetime import datetime, timedelta, timezone
     import colorama
     import random
-    import os, hashlib, hmac, base64, json, time
+    import os, re, hashlib, hmac, base64, json, time
+    import io, csv, threading, collections, cProfile, pstats, marshal
     from functools import wraps
+    from contextlib import closing
     from werkzeug.utils import secure_filename
     from dotenv import load_dotenv
     import urllib.request
     import urllib.parse
     import ssl
+    from werkzeug.exceptions import RequestEntityTooLarge
     try:
         from PIL import Image
+        import imagemeta
         PIL_AVAILABLE = True
     except Exception:
         PIL_AVAILABLE = False
@@ -34,7 +51,8 @@ except Exception as e:
 try:
     app = Flask(__name__, static_folder="static")
     app.config["JSON_SORT_KEYS"] = False
-    CORS(app)
+    app.json = serializer.FastJSONProvider(app)  # orjson when installed, stdlib json otherwise
+    CORS(app, expose_headers=["X-Total-Count"])
 except Exception as e:
     print(f"Failed to initialize Flask app: {e}")
     input("Press Enter to exit...")
@@ -46,15 +64,103 @@ try:
     UPLOAD_DIR = os.path.join(os.getcwd(), "static", "uploads")
     os.makedirs(UPLOAD_DIR, exist_ok=True)
     MAX_UPLOAD_MB = int(os.environ.get("MAX_UPLOAD_MB"))
+    app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_MB * 1024 * 1024  # request bodies are cut off (413) while streaming in, not after buffering
+    IMPORT_MAX_MB = int(os.environ.get("IMPORT_MAX_MB", "512"))  # body limit for /api/admin/products/import instead of MAX_UPLOAD_MB
+    UPLOAD_MAX_PIXELS = int(os.environ.get("UPLOAD_MAX_PIXELS", "50000000"))  # refuse images with more pixels (decompression bombs), checked from the header
+    UPLOAD_REDUCING_GAP = float(os.environ.get("UPLOAD_REDUCING_GAP", "2.0"))  # resize(): cheap reduce() down to this many times the target size, then resample
+    IMAGE_META_BACKFILL_MIN = float(os.environ.get("IMAGE_META_BACKFILL_MIN", "10"))  # how often images without metadata are looked for (0 = never)
+    IMAGE_META_BACKFILL_BATCH = int(os.environ.get("IMAGE_META_BACKFILL_BATCH", "200"))  # images per backfill run (~15 ms each)
     ALLOWED_EXT = {".png", ".jpg", ".jpeg", ".webp"}
     ALLOW_UPLOADS_WITHOUT_EXIF_REMOVED = False # if PIL not installed do we allow for file uploads where we couldnt reconstruct the image without EXIF data? (default: no, for privacy reasons & security)
     DATABASE = 'shop.db'
     PBKDF2_ITERATIONS = 200_000  # used by hash_password/verify_password
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")  # if set, /metrics requires "Authorization: Bearer <token>"
+
+    # --- Request profiling ---
+    PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "500"))  # capture the SQL trace of requests slower than this (0 = off)
+    PROFILE_STACK_SAMPLING = os.environ.get("PROFILE_STACK_SAMPLING", "0") == "1"  # also sample every request's stack so slow captures include a flame graph (extra thread, some CPU)
+    PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))  # fraction of requests run under cProfile (0.0 - 1.0)
+    PROFILE_HEADER_TOKEN = os.environ.get("PROFILE_HEADER_TOKEN", "")  # if set, "X-Profile: <token>" forces cProfile for that request
+    PROFILE_RING_SIZE = int(os.environ.get("PROFILE_RING_SIZE", "50"))
+    PROFILE_SAMPLER_INTERVAL_MS = float(os.environ.get("PROFILE_SAMPLER_INTERVAL_MS", "10"))
+    SQL_TRACE_LIMIT = 500  # max statements remembered per request
+
+    # --- Database access layer ---
+    SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))  # statements slower than this are logged with their query plan
+    QUERY_COUNT_WARN = int(os.environ.get("QUERY_COUNT_WARN", "50"))  # warn when one request issues more statements than this
+    N_PLUS_ONE_WARN = int(os.environ.get("N_PLUS_ONE_WARN", "10"))  # warn when one request repeats the same statement this often
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))  # idle connections kept around for reuse
+    DB_STATEMENT_CACHE = int(os.environ.get("DB_STATEMENT_CACHE", "256"))  # prepared statements cached per connection
+
+    # --- Background DB maintenance (PRAGMA optimize, ANALYZE, WAL checkpoints, incremental vacuum) ---
+    MAINT_ENABLED = os.environ.get("MAINT_ENABLED", "1") == "1"
+    MAINT_QUIET_SECONDS = float(os.environ.get("MAINT_QUIET_SECONDS", "30"))  # no requests for this long = quiet period
+    MAINT_OPTIMIZE_MIN = float(os.environ.get("MAINT_OPTIMIZE_MIN", "60"))
+    MAINT_ANALYZE_HOURS = float(os.environ.get("MAINT_ANALYZE_HOURS", "24"))
+    MAINT_CHECKPOINT_MIN = float(os.environ.get("MAINT_CHECKPOINT_MIN", "5"))
+    MAINT_VACUUM_MIN = float(os.environ.get("MAINT_VACUUM_MIN", "60"))
+    MAINT_VACUUM_PAGES = int(os.environ.get("MAINT_VACUUM_PAGES", "1000"))  # pages released per incremental_vacuum run
+    MAINT_LOCK = os.environ.get("MAINT_LOCK", "maintenance.lock")  # the worker process holding this lock runs backups/ANALYZE/...; the others skip them
+
+    # --- Scheduled online backups (see backup_db.py for the CLI / restore) ---
+    BACKUP_INTERVAL_MIN = float(os.environ.get("BACKUP_INTERVAL_MIN", "0"))  # 0 = no scheduled backups
+    BACKUP_DIR = os.environ.get("BACKUP_DIR", "backups")
+    BACKUP_KEEP = int(os.environ.get("BACKUP_KEEP", "7"))
+    BACKUP_COMPRESS = os.environ.get("BACKUP_COMPRESS", "1") == "1"
+    BACKUP_PAGES = int(os.environ.get("BACKUP_PAGES", "256"))  # pages copied per backup step
+    BACKUP_PAUSE_MS = float(os.environ.get("BACKUP_PAUSE_MS", "20"))  # pause between steps so live traffic keeps the disk
+
+    # --- Bulk catalog import/export ---
+    IMPORT_CHUNK_ROWS = int(os.environ.get("IMPORT_CHUNK_ROWS", "1000"))  # rows per import transaction
+    IMPORT_MAX_ERRORS = int(os.environ.get("IMPORT_MAX_ERRORS", "1000"))  # per-row errors included in the import report
+    EXPORT_FETCH_ROWS = int(os.environ.get("EXPORT_FETCH_ROWS", "500"))  # rows fetched (and flushed) per export batch
+    BATCH_MAX_OPS = int(os.environ.get("BATCH_MAX_OPS", "1000"))  # operations accepted by one /api/admin/batch call
+    CATALOG_PAGE_MAX = int(os.environ.get("CATALOG_PAGE_MAX", "500"))  # max ?limit= for filtered/sorted listings
+    CATALOG_IDS_MAX = int(os.environ.get("CATALOG_IDS_MAX", "100"))  # ids accepted by /api/products?ids=... and /api/services?ids=...
+    BOOTSTRAP_PAGE_SIZE = int(os.environ.get("BOOTSTRAP_PAGE_SIZE", "24"))  # products/services included in /api/bootstrap
+
+    # --- Contact form write-behind ---
+    CONTACT_WRITE_BEHIND = os.environ.get("CONTACT_WRITE_BEHIND", "1") == "1"  # 0 = insert + commit per message like before
+    CONTACT_QUEUE_MAX = int(os.environ.get("CONTACT_QUEUE_MAX", "5000"))  # queued messages before we answer 503
+    CONTACT_BATCH_SIZE = int(os.environ.get("CONTACT_BATCH_SIZE", "200"))
+    CONTACT_FLUSH_MS = float(os.environ.get("CONTACT_FLUSH_MS", "500"))  # max time a message waits in the queue
+    CONTACT_SPOOL = os.environ.get("CONTACT_SPOOL", "contact_spool.jsonl")  # append-only spool replayed on restart ("" = memory only); each process locks its own slot: name.jsonl, name.1.jsonl, ...
+    CONTACT_SPOOL_FSYNC = os.environ.get("CONTACT_SPOOL_FSYNC", "0") == "1"  # fsync every spooled message (survives power loss, slower)
+    CONTACT_RETRY_AFTER = int(os.environ.get("CONTACT_RETRY_AFTER", "5"))  # seconds, sent with the 503 when the queue is full
+    TOKEN_TTL_SECONDS = int(os.environ.get("TOKEN_TTL_SECONDS", str(60 * 60 * 24 * 7)))  # lifetime of login/signup tokens
+    ORDERS_PAGE_SIZE = int(os.environ.get("ORDERS_PAGE_SIZE", "20"))  # default ?limit= for /api/user/orders
+    ORDERS_PAGE_MAX = int(os.environ.get("ORDERS_PAGE_MAX", "100"))
+    ORDERS_BULK_MAX = int(os.environ.get("ORDERS_BULK_MAX", "1000"))  # orders per bulk status change
+    ANALYTICS_DEFAULT_DAYS = int(os.environ.get("ANALYTICS_DEFAULT_DAYS", "30"))  # range of the analytics endpoints without ?from=
+    TOKEN_REVOCATION_SYNC_SECONDS = float(os.environ.get("TOKEN_REVOCATION_SYNC_SECONDS", "2"))  # how fast other workers see a logout / password change (one indexed query per interval, on a token check)
+    CATALOG_CACHE_ENABLED = os.environ.get("CATALOG_CACHE", "1") == "1"  # cache listings per catalog version
+    CATALOG_VERSION_POLL_SECONDS = float(os.environ.get("CATALOG_VERSION_POLL_SECONDS", "0.5"))  # SNAPSHOT_BACKEND=local: how often the catalog version is re-read from shop.db (how fast other workers' writes show up)
+    SNAPSHOT_BACKEND = os.environ.get("SNAPSHOT_BACKEND", "local")  # local | mmap | redis - where cached listings/version live (shared between workers unless local)
+    SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "catalog_snapshots")  # directory for SNAPSHOT_BACKEND=mmap (same one for every worker)
+    REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")  # for SNAPSHOT_BACKEND=redis; inprocess:// = built-in stand-in, no server
+
+    # --- Response compression (brotli only if the brotli package is installed) ---
+    COMPRESS_ENABLED = os.environ.get("COMPRESS_ENABLED", "1") == "1"
+    COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))  # smaller responses are sent as-is
+    COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", "6"))  # per-request compression
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", "5"))
+    COMPRESS_CACHED_GZIP_LEVEL = int(os.environ.get("COMPRESS_CACHED_GZIP_LEVEL", "6"))  # cached catalog payloads, compressed once per version (9 is ~2x slower for ~3% smaller)
+    COMPRESS_CACHED_BROTLI_QUALITY = int(os.environ.get("COMPRESS_CACHED_BROTLI_QUALITY", "9"))
 
     # --- PayPal / currency configuration ---
     PAYPAL_CLIENT_ID = os.environ.get("PAYPAL_CLIENT_ID", "")
     PAYPAL_CLIENT_SECRET = os.environ.get("PAYPAL_CLIENT_SECRET", "")
     PAYPAL_ENV = (os.environ.get("PAYPAL_ENV", "sandbox") or "sandbox").lower()  # "sandbox" or "live"
+    PAYPAL_API_BASE = os.environ.get("PAYPAL_API_BASE", "").rstrip("/")  # override the API host (e.g. the stub in bench/paypal_stub.py)
+    PAYPAL_WEBHOOK_ID = os.environ.get("PAYPAL_WEBHOOK_ID", "")  # id PayPal shows for our webhook; /api/paypal/webhook answers 503 without it
+    PAYPAL_WEBHOOK_VERIFY = os.environ.get("PAYPAL_WEBHOOK_VERIFY", "1") == "1"  # 0 = skip signature checks (local replays only, never in production)
+    PAYPAL_WEBHOOK_CAPTURE_DELAY = float(os.environ.get("PAYPAL_WEBHOOK_CAPTURE_DELAY", "120"))  # seconds an approved order gets to be captured by the browser before we do it
+    WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "2"))  # threads processing queued webhooks (0 = none in this process)
+    WEBHOOK_MAX_ATTEMPTS = int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", "8"))  # then the event is marked failed (POST /api/admin/webhooks/retry)
+    WEBHOOK_RETRY_SECONDS = float(os.environ.get("WEBHOOK_RETRY_SECONDS", "10"))  # first retry delay, doubles per attempt (capped at an hour)
+    WEBHOOK_MAX_KB = int(os.environ.get("WEBHOOK_MAX_KB", "64"))  # body limit for webhook deliveries (PayPal events are a few KB)
+    WEBHOOK_MAX_UNVERIFIED = int(os.environ.get("WEBHOOK_MAX_UNVERIFIED", "1000"))  # unverified deliveries waiting before we answer 503 (PayPal retries; 0 = no cap)
+    WEBHOOK_KEEP_DAYS = float(os.environ.get("WEBHOOK_KEEP_DAYS", "30"))  # processed events kept for dedup/inspection (PayPal redelivers for 3 days)
     CURRENCY = os.environ.get("CURRENCY", "EUR")
     _PAYPAL_TOKEN = None
     _PAYPAL_TOKEN_EXP = 0
@@ -93,6 +199,459 @@ def log(message, status="DEFAULT"):
 
 print("Log Fucntion OK\nSwitching to LOG mode")
 
+# ----------------------------
+# Metrics (scraped via /metrics)
+# ----------------------------
+
+HTTP_REQUESTS = metrics.REGISTRY.counter(
+    "http_requests_total", "HTTP requests by route, method and status code", ("route", "method", "status"))
+HTTP_LATENCY = metrics.REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("route", "method"))
+HTTP_IN_PROGRESS = metrics.REGISTRY.gauge(
+    "http_requests_in_progress", "HTTP requests currently being handled")
+DB_CONNECTIONS = metrics.REGISTRY.counter(
+    "sqlite_connections_opened_total", "SQLite connections opened through db()")
+DB_QUERIES = metrics.REGISTRY.counter(
+    "sqlite_queries_total", "SQL statements executed, by statement type", ("op",))
+DB_QUERY_SECONDS = metrics.REGISTRY.histogram(
+    "sqlite_query_duration_seconds", "Time spent in execute()/executemany(), by statement type", ("op",))
+DB_FETCH_SECONDS = metrics.REGISTRY.counter(
+    "sqlite_fetch_seconds_total", "Time spent stepping result rows in fetch*(), by statement type", ("op",))
+CACHE_REQUESTS = metrics.REGISTRY.counter(
+    "cache_requests_total", "Cache lookups by cache name and result (hit/miss)", ("cache", "result"))
+PAYPAL_LATENCY = metrics.REGISTRY.histogram(
+    "paypal_request_duration_seconds", "PayPal upstream latency by endpoint and HTTP status", ("endpoint", "status"))
+PBKDF2_IN_PROGRESS = metrics.REGISTRY.gauge(
+    "pbkdf2_in_progress", "PBKDF2 derivations currently running (waiting + computing)")
+PBKDF2_SECONDS = metrics.REGISTRY.histogram(
+    "pbkdf2_duration_seconds", "PBKDF2 derivation time", ("op",))
+DB_SLOW_QUERIES = metrics.REGISTRY.counter(
+    "sqlite_slow_queries_total", "Statements slower than SLOW_QUERY_MS, by statement type", ("op",))
+DB_POOL_IDLE = metrics.REGISTRY.gauge(
+    "sqlite_pool_idle_connections", "Idle connections parked in the db() pool")
+MAINT_RUNS = metrics.REGISTRY.counter(
+    "maintenance_runs_total", "Background maintenance task runs by task and result", ("task", "result"))
+MAINT_SECONDS = metrics.REGISTRY.histogram(
+    "maintenance_task_duration_seconds", "Background maintenance task duration", ("task",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0))
+HTTP_REQUEST_QUERIES = metrics.REGISTRY.histogram(
+    "http_request_sql_statements", "SQL statements issued per request, by route", ("route",),
+    buckets=(1, 2, 3, 5, 10, 25, 50, 100, 250, 500))
+CONTACT_MESSAGES = metrics.REGISTRY.counter(
+    "contact_messages_total", "Contact messages by result (accepted/rejected/flushed)", ("result",))
+CONTACT_QUEUE_DEPTH = metrics.REGISTRY.gauge(
+    "contact_queue_depth", "Contact messages waiting for the write-behind flush")
+HTTP_COMPRESSED = metrics.REGISTRY.counter(
+    "http_compressed_responses_total", "Compressed responses by encoding and source (cached/dynamic)", ("encoding", "source"))
+HTTP_COMPRESSION_BYTES = metrics.REGISTRY.counter(
+    "http_compression_bytes_total", "Body bytes of compressed responses before (raw) and after (sent) compression", ("encoding", "kind"))
+TOKENS_REVOKED = metrics.REGISTRY.counter(
+    "auth_tokens_revoked_total", "Token revocations by kind (logout/logout_all/password_change)", ("kind",))
+TOKENS_REJECTED_REVOKED = metrics.REGISTRY.counter(
+    "auth_tokens_rejected_revoked_total", "Requests refused because their (otherwise valid) token was revoked")
+ORDER_STATUS_CHANGES = metrics.REGISTRY.counter(
+    "order_status_changes_total", "Orders moved by the fulfillment endpoints, by new status and result", ("status", "result"))
+WEBHOOK_RECEIVED = metrics.REGISTRY.counter(
+    "paypal_webhooks_received_total", "PayPal webhook deliveries by event type and result (queued/duplicate/invalid/throttled/error)", ("event_type", "result"))
+WEBHOOK_PROCESSED = metrics.REGISTRY.counter(
+    "paypal_webhooks_processed_total", "Queued webhook processing attempts by event type and outcome (done/pending/failed/rejected)", ("event_type", "status"))
+WEBHOOK_SECONDS = metrics.REGISTRY.histogram(
+    "paypal_webhook_processing_seconds", "Time to process one queued webhook (signature check included)", ("event_type",))
+
+def _sql_op(sql: str) -> str:
+    # First keyword only (SELECT/INSERT/...) so the label set stays small
+    head = sql.lstrip().split(None, 1)
+    return head[0].upper() if head else "EMPTY"
+
+def cache_lookup(cache: str, hit: bool):
+    CACHE_REQUESTS.inc((cache, "hit" if hit else "miss"))
+
+_LAST_REQUEST_AT = 0.0  # monotonic time of the last request, for quiet-period detection
+
+def _route_label() -> str:
+    return request.url_rule.rule if request.url_rule else "<unmatched>"
+
+# ----------------------------
+# Database access layer
+# ----------------------------
+# Every connection handed out by db() is instrumented: each statement is
+# timed, counted per request, and statements slower than SLOW_QUERY_MS are
+# logged together with their EXPLAIN QUERY PLAN. Closed connections go back
+# to a small pool instead of being torn down, so sqlite3's per-connection
+# prepared statement cache actually gets reused between requests.
+
+SLOW_QUERY_LOG = collections.deque(maxlen=100)
+_PLAN_CACHE = {}
+_PLAN_CACHE_LIMIT = 256
+
+def _compact_sql(sql: str) -> str:
+    return " ".join(sql.split())
+
+def _trace_sql(sql: str, elapsed: float):
+    # Per-request statement log (query counts, N+1 detection, slow-request profiles)
+    if not has_request_context():
+        return None
+    g.sql_count = g.get("sql_count", 0) + 1
+    trace = g.get("sql_trace")
+    if trace is None or len(trace) >= SQL_TRACE_LIMIT:
+        return None
+    entry = [sql, elapsed, 0.0]  # [sql, execute seconds, fetch seconds]
+    trace.append(entry)
+    return entry
+
+def _explain(conn, sql: str, parameters) -> list[str]:
+    plan = _PLAN_CACHE.get(sql)
+    if plan is not None:
+        return plan
+    try:
+        # Plain cursor on purpose: the EXPLAIN itself shouldn't be instrumented
+        rows = conn.cursor(sqlite3.Cursor).execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+    except sqlite3.Error as e:
+        return [f"(no plan: {e})"]
+    depth = {0: -1}
+    plan = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        plan.append("  " * depth[node_id] + detail)
+    if len(_PLAN_CACHE) >= _PLAN_CACHE_LIMIT:
+        _PLAN_CACHE.clear()
+    _PLAN_CACHE[sql] = plan
+    return plan
+
+def _record_slow_query(conn, op: str, sql: str, parameters, elapsed: float, many: bool):
+    DB_SLOW_QUERIES.inc((op,))
+    plan = ["(executemany: plan not captured)"] if many else _explain(conn, sql, parameters)
+    entry = {
+        "at": datetime.now().isoformat(timespec="seconds"),
+        "route": _route_label() if has_request_context() else None,
+        "ms": round(elapsed * 1000, 3),
+        "sql": _compact_sql(sql),
+        "plan": plan,
+    }
+    SLOW_QUERY_LOG.append(entry)
+    log(f"Slow query ({entry['ms']} ms) on {entry['route']}: {entry['sql']} | plan: {' / '.join(plan)}", "WARNING")
+
+class _InstrumentedCursor(sqlite3.Cursor):
+    """sqlite3 cursor that reports statement counts and timings to the metrics registry."""
+    _op = "EMPTY"
+    _trace = None
+    _sql = None
+
+    def _executed(self, sql, parameters, elapsed, many=False):
+        DB_QUERIES.inc((self._op,))
+        DB_QUERY_SECONDS.observe(elapsed, (self._op,))
+        self._trace = _trace_sql(sql, elapsed)
+        self._sql, self._params, self._many = sql, parameters, many
+        self._elapsed, self._slow_logged = elapsed, False
+        self._check_slow()
+
+    def _fetched(self, elapsed):
+        DB_FETCH_SECONDS.inc((self._op,), elapsed)
+        if self._trace is not None:
+            self._trace[2] += elapsed
+        if self._sql is not None:
+            self._elapsed += elapsed
+            self._check_slow()
+
+    def _check_slow(self):
+        # execute() + fetch*() together, so big SELECTs are caught too
+        if not self._slow_logged and SLOW_QUERY_MS > 0 and self._elapsed * 1000 >= SLOW_QUERY_MS:
+            self._slow_logged = True
+            _record_slow_query(self.connection, self._op, self._sql, self._params, self._elapsed, self._many)
+
+    def execute(self, sql, parameters=()):
+        self._op = _sql_op(sql)
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._executed(sql, parameters, time.perf_counter() - t0)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._op = _sql_op(sql)
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._executed(sql, None, time.perf_counter() - t0, many=True)
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._fetched(time.perf_counter() - t0)
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        try:
+            return super().fetchmany(size) if size is not None else super().fetchmany()
+        finally:
+            self._fetched(time.perf_counter() - t0)
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._fetched(time.perf_counter() - t0)
+
+class _InstrumentedConnection(sqlite3.Connection):
+    _pool = None
+
+    # conn.execute() builds a cursor through cursor() but then bypasses a
+    # subclassed Cursor.execute, so route the shortcuts through it explicitly
+    def cursor(self, factory=_InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        # Handlers keep calling conn.close(); pooled connections are parked instead
+        if self._pool is None or not self._pool.release(self):
+            super().close()
+
+class _ConnectionPool:
+    """LIFO pool of idle connections. Uncommitted work is rolled back on release, same as close()."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def acquire(self):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is not None:
+            DB_POOL_IDLE.dec()
+            return conn
+        DB_CONNECTIONS.inc()
+        conn = sqlite3.connect(DATABASE, factory=_InstrumentedConnection,
+                               cached_statements=DB_STATEMENT_CACHE, check_same_thread=False)
+        # Same on every connection, not only in the handlers that ask for it
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn._pool = self if self.size > 0 else None
+        return conn
+
+    def release(self, conn) -> bool:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            return False
+        with self._lock:
+            if len(self._idle) >= self.size:
+                return False
+            self._idle.append(conn)
+        DB_POOL_IDLE.inc()
+        return True
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            DB_POOL_IDLE.dec()
+            conn._pool = None
+            conn.close()
+
+DB_POOL = _ConnectionPool(DB_POOL_SIZE)
+
+def db():
+    return DB_POOL.acquire()
+
+@app.before_request
+def _db_request_started():
+    g.sql_count = 0
+
+@app.after_request
+def _db_request_finished(response):
+    count = g.get("sql_count", 0)
+    route = _route_label()
+    HTTP_REQUEST_QUERIES.observe(count, (route,))
+    if count > QUERY_COUNT_WARN:
+        log(f"{request.method} {request.path} issued {count} SQL statements (QUERY_COUNT_WARN={QUERY_COUNT_WARN})", "WARNING")
+    if count >= N_PLUS_ONE_WARN:
+        repeated = collections.Counter(entry[0] for entry in g.get("sql_trace") or [])
+        sql, times = repeated.most_common(1)[0] if repeated else (None, 0)
+        if times >= N_PLUS_ONE_WARN:
+            log(f"Possible N+1 on {route}: same statement ran {times}x in one request: {_compact_sql(sql)}", "WARNING")
+    return response
+
+@app.before_request
+def _metrics_request_started():
+    global _LAST_REQUEST_AT
+    g.request_started = time.perf_counter()
+    _LAST_REQUEST_AT = time.monotonic()
+    HTTP_IN_PROGRESS.inc()
+
+@app.after_request
+def _metrics_request_finished(response):
+    started = g.get("request_started")
+    if started is not None:
+        route = _route_label()
+        HTTP_LATENCY.observe(time.perf_counter() - started, (route, request.method))
+        HTTP_REQUESTS.inc((route, request.method, str(response.status_code)))
+    return response
+
+@app.teardown_request
+def _metrics_request_teardown(exc):
+    if g.pop("request_started", None) is not None:
+        HTTP_IN_PROGRESS.dec()
+
+# ----------------------------
+# Response compression
+# ----------------------------
+# gzip (and brotli when installed) negotiated from Accept-Encoding, for
+# compressible responses of at least COMPRESS_MIN_BYTES. Cached catalog
+# responses are compression.Payload objects that keep their compressed
+# variants next to the raw bytes (see catalog_response()), so they are
+# compressed once per catalog version. Everything else is compressed here.
+
+_DYNAMIC_LEVELS = {"gzip": COMPRESS_GZIP_LEVEL, "br": COMPRESS_BROTLI_QUALITY}
+_CACHED_LEVELS = {"gzip": COMPRESS_CACHED_GZIP_LEVEL, "br": COMPRESS_CACHED_BROTLI_QUALITY}
+
+def _count_compression(encoding: str, source: str, raw_len: int, sent_len: int):
+    HTTP_COMPRESSED.inc((encoding, source))
+    HTTP_COMPRESSION_BYTES.inc((encoding, "raw"), raw_len)
+    HTTP_COMPRESSION_BYTES.inc((encoding, "sent"), sent_len)
+
+def catalog_response(payload: compression.Payload) -> Response:
+    response = Response(mimetype="application/json")
+    response.set_data(payload.raw)  # may be a memoryview over a shared snapshot; set_data keeps it as one chunk
+    if not COMPRESS_ENABLED or len(payload) < COMPRESS_MIN_BYTES:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = compression.negotiate(request.headers.get("Accept-Encoding", ""))
+    if encoding:
+        data = payload.variant(encoding)
+        response.set_data(data)
+        response.headers["Content-Encoding"] = encoding
+        _count_compression(encoding, "cached", len(payload), len(data))
+    return response
+
+@app.after_request
+def _compress_response(response):
+    if not COMPRESS_ENABLED or response.direct_passthrough or response.is_streamed:
+        return response
+    if request.method == "HEAD" or response.status_code < 200 or response.status_code in (204, 206, 304):
+        return response
+    if "Content-Encoding" in response.headers or not compression.is_compressible(response.mimetype):
+        return response
+    length = response.calculate_content_length()
+    if length is None or length < COMPRESS_MIN_BYTES:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = compression.negotiate(request.headers.get("Accept-Encoding", ""))
+    if not encoding:
+        return response
+    raw = response.get_data()
+    data = compression.compress(raw, encoding, _DYNAMIC_LEVELS[encoding])
+    if len(data) >= len(raw):
+        return response
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    _count_compression(encoding, "dynamic", len(raw), len(data))
+    return response
+
+# ----------------------------
+# Request profiling
+# ----------------------------
+# Every request gets a cheap SQL trace, kept when the request turns out
+# slower than PROFILE_SLOW_MS. Stack sampling (PROFILE_STACK_SAMPLING=1) and
+# cProfile (X-Profile header or sample rate) are opt-in because they cost
+# CPU on every request they watch.
+
+STACK_SAMPLER = profiler.StackSampler(interval=PROFILE_SAMPLER_INTERVAL_MS / 1000.0)
+PROFILE_STORE = profiler.ProfileStore(size=PROFILE_RING_SIZE)
+
+def _profile_requested() -> str | None:
+    if PROFILE_HEADER_TOKEN:
+        header = request.headers.get("X-Profile", "")
+        if header and hmac.compare_digest(header.encode(), PROFILE_HEADER_TOKEN.encode()):
+            return "header"
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "sample"
+    return None
+
+@app.before_request
+def _profiling_request_started():
+    g.sql_trace = []
+    reason = _profile_requested()
+    if reason:
+        g.profile_reason = reason
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+            g.cprofile = prof
+        except ValueError:
+            # Another profiler already owns the interpreter; fall back to stack samples
+            log("cProfile unavailable for this request, using stack samples only", "WARNING")
+    if (PROFILE_STACK_SAMPLING and PROFILE_SLOW_MS > 0) or reason:
+        g.stack_samples = STACK_SAMPLER.track(threading.get_ident())
+
+def _stop_profiling():
+    prof = g.pop("cprofile", None)
+    if prof is not None:
+        prof.disable()
+    samples = g.pop("stack_samples", None)
+    if samples is not None:
+        STACK_SAMPLER.untrack(threading.get_ident())
+    return prof, samples
+
+def _build_profile_entry(reason, elapsed_ms, status, prof, samples) -> dict:
+    sql = [
+        {"sql": " ".join(stmt.split()), "exec_ms": round(ex * 1000, 3), "fetch_ms": round(fe * 1000, 3)}
+        for stmt, ex, fe in (g.get("sql_trace") or [])
+    ]
+    entry = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "method": request.method,
+        "path": request.full_path.rstrip("?"),
+        "route": request.url_rule.rule if request.url_rule else None,
+        "status": status,
+        "reason": reason,
+        "duration_ms": round(elapsed_ms, 2),
+        "sql_ms": round(sum(q["exec_ms"] + q["fetch_ms"] for q in sql), 3),
+        "sample_interval_ms": PROFILE_SAMPLER_INTERVAL_MS,
+        "sql": sql,
+        "stacks": dict(samples.most_common(200)) if samples else {},
+    }
+    if prof is not None:
+        stream = io.StringIO()
+        stats = pstats.Stats(prof, stream=stream)  # takes ownership of prof.stats
+        stats.sort_stats("cumulative").print_stats(60)
+        entry["pstats"] = stream.getvalue()
+        entry["prof"] = marshal.dumps(stats.stats)  # loadable with pstats / snakeviz
+    return entry
+
+@app.after_request
+def _profiling_request_finished(response):
+    prof, samples = _stop_profiling()
+    reason = g.pop("profile_reason", None)
+    started = g.get("request_started")
+    if started is None:
+        return response
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if reason is None:
+        if PROFILE_SLOW_MS <= 0 or elapsed_ms < PROFILE_SLOW_MS:
+            return response
+        reason = "slow"
+    entry = _build_profile_entry(reason, elapsed_ms, response.status_code, prof, samples)
+    profile_id = PROFILE_STORE.add(entry)
+    response.headers["X-Profile-Id"] = str(profile_id)
+    log(f"Captured {reason} profile #{profile_id} for {request.method} {request.path} ({elapsed_ms:.1f} ms, {len(entry['sql'])} SQL statements)",
+        "WARNING" if reason == "slow" else "INFO")
+    return response
+
+@app.teardown_request
+def _profiling_request_teardown(exc):
+    # after_request is skipped if a later hook blew up, don't leak the sampler slot
+    _stop_profiling()
+
 def b64url(data: bytes) -> str:
     log("Encoding data to URL-safe base64", "INFO")
     b = base64.urlsafe_b64encode(data).rstrip(b"=").decode()
@@ -106,10 +665,28 @@ def ub64url(data: str) -> bytes:
     log(f"Decoded bytes length: {len(b)}", "SUCCESS")
     return b
 
+# Revoked tokens (logout) and token generations (password change) are kept
+# in memory, see revocation.py; verify_token() checks them without the DB,
+# except for one query per TOKEN_REVOCATION_SYNC_SECONDS that picks up
+# revocations made by other worker processes.
+TOKEN_REVOCATIONS = revocation.RevocationList()
+
+def sync_token_revocations():
+    try:
+        n = TOKEN_REVOCATIONS.sync_if_due(db, TOKEN_REVOCATION_SYNC_SECONDS)
+    except Exception as e:
+        log(f"Token revocation sync failed, checking against the list as it is: {e}", "WARNING")
+        return
+    if n:
+        log(f"Token revocations synced: {n} new events from other workers", "INFO")
+
 def sign_token(payload: dict, exp_seconds: int = 3600):
     log("Signing token with HMAC-SHA256", "INFO")
     body = payload.copy()
-    body["exp"] = int(time.time()) + exp_seconds
+    now = int(time.time())
+    body["iat"] = now
+    body["exp"] = now + exp_seconds
+    body.setdefault("jti", uuid.uuid4().hex)
     raw = json.dumps(body, separators=(",", ":")).encode()
     sig = hmac.new(SECRET_KEY.encode(), raw, hashlib.sha256).digest()
     ret = f"{b64url(raw)}.{b64url(sig)}"
@@ -127,15 +704,17 @@ def verify_token(token: str):
         body = json.loads(raw)
         if int(time.time()) > int(body.get("exp", 0)):
             return None
+        sync_token_revocations()
+        if TOKEN_REVOCATIONS.is_revoked(body):
+            TOKENS_REJECTED_REVOKED.inc()
+            log(f"Token rejected: revoked (jti={body.get('jti')}, user_id={body.get('user_id')})", "WARNING")
+            return None
         log(f"Token verified successfully {body}", "SUCCESS")
         return body
     except Exception:
         log("Token verification failed", "ERROR")
         return None
 
-def db():
-    return sqlite3.connect(DATABASE)
-
 def require_admin(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
@@ -154,6 +733,7 @@ def require_admin(fn):
         if not row or row[0] != "LeonBoussen":
             return jsonify({"error": "Admin access denied"}), 403
         request.user_id = body["user_id"]
+        request.token_claims = body
         return fn(*args, **kwargs)
     return wrapper
 
@@ -168,30 +748,41 @@ def require_user(fn):
         if not body or body.get("role") != "user":
             return jsonify({"error": "Invalid user token"}), 403
         request.user_id = body.get("user_id")
+        request.token_claims = body
         return fn(*args, **kwargs)
     return wrapper
 
-def row_to_product(r):
-    log(f"row_to_product called with row: {r}", "INFO")
-    result = {
-        "id": r[0], "name": r[1], "bio": r[2],
-        "price": r[3], "discount_price": r[4],
-        "limited_edition": r[5], "sold_out": r[6],
-        "image_url": r[7] if r[7] else None
-    }
-    log(f"row_to_product returning: {result}", "SUCCESS")
-    return result
-
-def row_to_service(r):
-    log(f"row_to_service called with row: {r}", "INFO")
-    result = {
-        "id": r[0], "name": r[1], "bio": r[2],
-        "price": r[3], "discount_price": r[4],
-        "active": r[5],
-        "image_url": r[6] if len(r) > 6 else None
-    }
-    log(f"row_to_service returning: {result}", "SUCCESS")
-    return result
+def optional_user_id():
+    """user_id from a valid Bearer token, or None (guest) - for endpoints that work either way."""
+    auth = request.headers.get("Authorization", "")
+    if not auth.startswith("Bearer "):
+        return None
+    body = verify_token(auth.split(" ", 1)[1].strip())
+    if not body or body.get("role") != "user":
+        return None
+    return body.get("user_id")
+
+def issue_user_token(user_id: int, generation: int = 0) -> str:
+    payload = {"role": "user", "user_id": user_id}
+    if generation:
+        payload["gen"] = generation
+    return sign_token(payload, exp_seconds=TOKEN_TTL_SECONDS)
+
+# Listing rows go straight from the SELECT tuple to JSON (see serializer.py),
+# no intermediate dict per row. Keys are in SELECT column order. The image_*
+# keys after image_count are the primary image's metadata (image_meta table,
+# joined with LISTING_IMAGE_META_SQL), null until computed.
+LISTING_IMAGE_META_KEYS = ("image_width", "image_height", "image_bytes", "image_color", "image_blurhash")
+LISTING_IMAGE_META_SQL = "m.width, m.height, m.bytes, m.color, m.blurhash"
+PRODUCT_LIST_JSON = serializer.RowSerializer(
+    ("id", "name", "bio", "price", "discount_price", "limited_edition", "sold_out", "image_url", "image_count",
+     *LISTING_IMAGE_META_KEYS),
+    converters={"image_url": lambda v: v or None},
+)
+SERVICE_LIST_JSON = serializer.RowSerializer(
+    ("id", "name", "bio", "price", "discount_price", "active", "image_url", "image_count", *LISTING_IMAGE_META_KEYS),
+    converters={"image_url": lambda v: v or None},
+)
 
 def _b64e(b: bytes) -> str:
     log(f"_b64e called with bytes: {b[:20]}... (truncated)", "INFO")
@@ -205,6 +796,16 @@ def _b64d(s: str) -> bytes:
     log(f"_b64d returning bytes of length: {len(decoded)}", "SUCCESS")
     return decoded
 
+def _pbkdf2(password: str, salt: bytes, op: str) -> bytes:
+    # Tracked separately: with threaded workers these pile up under login bursts
+    PBKDF2_IN_PROGRESS.inc()
+    t0 = time.perf_counter()
+    try:
+        return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, PBKDF2_ITERATIONS)
+    finally:
+        PBKDF2_IN_PROGRESS.dec()
+        PBKDF2_SECONDS.observe(time.perf_counter() - t0, (op,))
+
 def hash_password(password: str) -> tuple[str, str]:
     """
     Returns (hash_b64, salt_b64) using PBKDF2-HMAC-SHA256 with PBKDF2_ITERATIONS.
@@ -215,7 +816,7 @@ def hash_password(password: str) -> tuple[str, str]:
         raise TypeError("password must be a string")
     salt = os.urandom(16)
     log(f"hash_password: generated salt: {_b64e(salt)}", "INFO")
-    dk = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, PBKDF2_ITERATIONS)
+    dk = _pbkdf2(password, salt, "hash")
     log(f"hash_password: derived key (hash) generated", "INFO")
     hash_b64, salt_b64 = _b64e(dk), _b64e(salt)
     log(f"hash_password returning hash_b64: {hash_b64}, salt_b64: {salt_b64}", "SUCCESS")
@@ -229,7 +830,7 @@ def verify_password(password: str, stored_hash_b64: str, salt_b64: str) -> bool:
     try:
         salt = _b64d(salt_b64)
         log(f"verify_password: decoded salt", "INFO")
-        dk = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, PBKDF2_ITERATIONS)
+        dk = _pbkdf2(password, salt, "verify")
         log(f"verify_password: derived key (hash) generated", "INFO")
         calc = _b64e(dk)
         result = hmac.compare_digest(calc, stored_hash_b64)
@@ -241,10 +842,61 @@ def verify_password(password: str, stored_hash_b64: str, salt_b64: str) -> bool:
 
 def _allowed_file(filename: str) -> bool:
     log(f"_allowed_file called with filename: {filename}", "INFO")
-    allowed = "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXT
+    allowed = os.path.splitext(filename)[1].lower() in ALLOWED_EXT  # ALLOWED_EXT entries include the dot
     log(f"_allowed_file returning: {allowed}", "SUCCESS" if allowed else "WARNING")
     return allowed
 
+# ----------------------------
+# Upload decoding
+# ----------------------------
+# Uploads are decoded as little as possible: Image.open() only reads the
+# header, so the pixel count is checked before any pixel data is touched;
+# JPEGs are then decoded at 1/2, 1/4 or 1/8 scale with draft() when that's
+# still at least the target size (the DCT averages while decoding, so this
+# is a real downscale, and a 24MP photo for a 720px thumbnail never exists
+# in full size in memory), and the rest is done by resize() with
+# reducing_gap (cheap reduce() first, bicubic for the last step).
+
+class ImageTooLarge(ValueError):
+    pass
+
+if PIL_AVAILABLE:
+    # Pillow's own guard (warning above this, DecompressionBombError above 2x) for anything that skips ours
+    Image.MAX_IMAGE_PIXELS = UPLOAD_MAX_PIXELS
+
+def decode_upload_image(stream, max_width: int, max_height: int | None = None, modes=("RGB",)):
+    """Open an uploaded image, scaled down to fit max_width x max_height (aspect kept, never upscaled)."""
+    try:
+        img = Image.open(stream)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    width, height, fmt = img.size[0], img.size[1], img.format
+    if width * height > UPLOAD_MAX_PIXELS:
+        raise ImageTooLarge(f"image has {width}x{height} pixels (limit {UPLOAD_MAX_PIXELS})")
+    scale = min(1.0, max_width / width, (max_height / height) if max_height else 1.0)
+    target = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if scale < 1.0:
+        # JPEG only (no-op for other formats): picks the smallest DCT scale still >= the requested size
+        img.draft(None, target)
+    if img.mode not in modes:
+        img = img.convert(modes[0])
+    if img.size != target:
+        img = img.resize(target, Image.Resampling.BICUBIC, reducing_gap=UPLOAD_REDUCING_GAP)
+    log(f"Decoded {fmt} upload {width}x{height} -> {img.size[0]}x{img.size[1]} {img.mode}", "INFO")
+    return img
+
+@app.errorhandler(RequestEntityTooLarge)
+def _request_too_large(e):
+    limit = request.max_content_length or 0
+    log(f"Request body too large for {request.path} (limit {limit} bytes, Content-Length {request.content_length})", "WARNING")
+    if limit >= 1024 * 1024:
+        shown = f"{limit // (1024 * 1024)}MB"
+    elif limit >= 1024:
+        shown = f"{limit // 1024}KB"  # e.g. WEBHOOK_MAX_KB
+    else:
+        shown = f"{limit} bytes"
+    return jsonify({"error": f"request too large (>{shown})"}), 413
+
 def save_image_and_get_rel_url(file_storage) -> str:
     log("save_image_and_get_rel_url called", "INFO")
     if not file_storage or not getattr(file_storage, "filename", None):
@@ -258,56 +910,325 @@ def save_image_and_get_rel_url(file_storage) -> str:
     dest = os.path.join(UPLOAD_DIR, fname)
     log(f"save_image_and_get_rel_url: destination path: {dest}", "INFO")
 
-    if Image is None:
+    if not PIL_AVAILABLE:
         log("save_image_and_get_rel_url: Pillow not available, saving raw file", "WARNING")
         file_storage.save(dest)
     else:
-        log("save_image_and_get_rel_url: Opening image with Pillow", "INFO")
-        img = Image.open(file_storage.stream).convert("RGB")
-        log(f"save_image_and_get_rel_url: Image opened, size: {img.size}", "INFO")
-        img.thumbnail((720, 720))
+        log("save_image_and_get_rel_url: Decoding image with Pillow", "INFO")
+        img = decode_upload_image(file_storage.stream, 720, 720)
         log(f"save_image_and_get_rel_url: Image resized to: {img.size}", "INFO")
         img.save(dest, "WEBP", quality=88, method=6)
         log("save_image_and_get_rel_url: Image saved as WEBP", "SUCCESS")
 
     rel_url = f"/static/uploads/{fname}"
+    if PIL_AVAILABLE:
+        record_image_meta(rel_url, img, dest)
     log(f"save_image_and_get_rel_url returning: {rel_url}", "SUCCESS")
     return rel_url
 
+# ----------------------------
+# Image metadata
+# ----------------------------
+# Width, height, file size, dominant color and a BlurHash per image path
+# (image_meta table, imagemeta.py), so the storefront can reserve the box
+# and paint a placeholder before the image loads. Computed from the
+# processed image while it's still in memory at upload; files from before
+# this (or from imports) are filled in by the image_meta_backfill task.
+
+IMAGE_META_UPSERT_SQL = """
+    INSERT OR REPLACE INTO image_meta (path, width, height, bytes, color, blurhash, error, computed_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+"""
+
+def _store_image_meta(conn, rel_url: str, meta: dict | None, error: str | None = None):
+    meta = meta or {}
+    conn.execute(IMAGE_META_UPSERT_SQL, (rel_url, meta.get("width"), meta.get("height"), meta.get("bytes"),
+                                         meta.get("color"), meta.get("blurhash"), error))
+
+def record_image_meta(rel_url: str, img, path: str) -> dict | None:
+    """Metadata for a freshly saved upload. Failing here never fails the upload (the backfill retries it)."""
+    try:
+        t0 = time.perf_counter()
+        meta = imagemeta.describe(img, os.path.getsize(path))
+        with closing(db()) as conn:
+            _store_image_meta(conn, rel_url, meta)
+            conn.commit()
+        log(f"Image metadata for {rel_url}: {meta} ({(time.perf_counter() - t0) * 1000:.1f} ms)", "INFO")
+        return meta
+    except Exception as e:
+        log(f"Could not compute image metadata for {rel_url}: {e}", "WARNING")
+        return None
+
+def _upload_file_path(rel_url: str) -> str | None:
+    """Local file behind a /static/uploads/ URL, None for anything else (external URLs)."""
+    prefix = "/static/uploads/"
+    if not rel_url or not rel_url.startswith(prefix):
+        return None
+    name = os.path.basename(rel_url[len(prefix):])
+    return os.path.join(UPLOAD_DIR, name) if name else None
+
+def backfill_image_meta(limit: int) -> dict:
+    """Compute metadata for up to `limit` referenced images that have none yet."""
+    with closing(db()) as conn:
+        paths = [r[0] for r in conn.execute("""
+            SELECT image_path FROM product_images
+             UNION
+            SELECT image_path FROM service_images
+             EXCEPT
+            SELECT path FROM image_meta
+             LIMIT ?
+        """, (limit,))]
+        done = failed = 0
+        for rel_url in paths:
+            path = _upload_file_path(rel_url)
+            try:
+                if path is None:
+                    raise ValueError("not a local upload")
+                _store_image_meta(conn, rel_url, imagemeta.describe_file(path))
+                done += 1
+            except Exception as e:
+                # Recorded with the error so it isn't picked up again every run
+                _store_image_meta(conn, rel_url, None, str(e)[:200])
+                failed += 1
+                log(f"Image metadata backfill: {rel_url}: {e}", "WARNING")
+        conn.commit()
+    if done:
+        invalidate_catalog(f"image metadata for {done} images")  # listings carry the primary image's metadata
+    return {"computed": done, "failed": failed, "more": len(paths) == limit}
+
+# Full records (with the complete images array) for a list of ids in ONE
+# statement: ids go in as a JSON array through json_each, so the statement
+# text is the same for any number of ids (one prepared statement), and the
+# image list is aggregated in SQL. image_count (kept by triggers) lets 0/1
+# image rows skip the aggregate subquery. images_meta has the same order as
+# images, with each image's metadata (nulls until it has been computed).
+_DETAIL_IMAGES_SQL = """
+        CASE
+            WHEN t.image_count > 1 THEN (
+                SELECT json_group_array(image_path) FROM (
+                    SELECT i.image_path FROM {images} i
+                     WHERE i.{owner} = t.id
+                     ORDER BY i.sort_order ASC, i.id ASC
+                )
+            )
+            WHEN t.image_count = 1 THEN json_array(t.primary_image)
+            ELSE '[]'
+        END AS images,
+        CASE
+            WHEN t.image_count > 0 THEN (
+                SELECT json_group_array(json_object('path', image_path, 'width', m.width, 'height', m.height,
+                                                    'bytes', m.bytes, 'color', m.color, 'blurhash', m.blurhash))
+                  FROM (
+                    SELECT i.image_path FROM {images} i
+                     WHERE i.{owner} = t.id
+                     ORDER BY i.sort_order ASC, i.id ASC
+                  )
+                  LEFT JOIN image_meta m ON m.path = image_path
+            )
+            ELSE '[]'
+        END AS images_meta
+"""
+CATALOG_DETAIL_SQL = {
+    "product": """
+        SELECT t.id, t.name, t.bio, t.price, t.discount_price,
+               t.limited_edition, t.sold_out, t.primary_image,""" + _DETAIL_IMAGES_SQL.format(images="product_images", owner="product_id") + """
+          FROM json_each(?) j
+          JOIN products t ON t.id = j.value
+         ORDER BY j.key
+    """,
+    "service": """
+        SELECT t.id, t.name, t.bio, t.price, t.discount_price,
+               t.active, t.primary_image,""" + _DETAIL_IMAGES_SQL.format(images="service_images", owner="service_id") + """
+          FROM json_each(?) j
+          JOIN services t ON t.id = j.value
+         ORDER BY j.key
+    """,
+}
+CATALOG_DETAIL_JSON = {
+    "product": serializer.RowSerializer(
+        ("id", "name", "bio", "price", "discount_price", "limited_edition", "sold_out", "image_url", "images",
+         "images_meta"),
+        converters={"image_url": lambda v: v or None}, raw=("images", "images_meta")),
+    "service": serializer.RowSerializer(
+        ("id", "name", "bio", "price", "discount_price", "active", "image_url", "images", "images_meta"),
+        converters={"image_url": lambda v: v or None}, raw=("images", "images_meta")),
+}
+
+def fetch_catalog_details(kind: str, ids: list) -> list:
+    """Rows for CATALOG_DETAIL_JSON[kind], in the order of `ids` (unknown ids are skipped)."""
+    with closing(db()) as conn:
+        return conn.execute(CATALOG_DETAIL_SQL[kind], (json.dumps(ids),)).fetchall()
+
 def get_product_with_images(pid: int):
     log(f"get_product_with_images called with pid: {pid}", "INFO")
-    with db() as conn:
-        cur = conn.cursor()
-        log(f"get_product_with_images: querying product with id={pid}", "INFO")
-        p = cur.execute("""
-            SELECT id, name, bio, price, discount_price, limited_edition, sold_out
-              FROM products
-             WHERE id = ?
-        """, (pid,)).fetchone()
-        if not p:
-            log(f"get_product_with_images: product not found for id={pid}", "WARNING")
-            return None
-        log(f"get_product_with_images: product row: {p}", "INFO")
-        imgs = [r[0] for r in cur.execute("""
-            SELECT image_path FROM product_images
-             WHERE product_id = ?
-             ORDER BY sort_order ASC, id ASC
-        """, (pid,)).fetchall()]
-        log(f"get_product_with_images: images found: {imgs}", "INFO")
-        first = imgs[0] if imgs else None
-        result = {
-            "id": p[0],
-            "name": p[1],
-            "bio": p[2],
-            "price": p[3],
-            "discount_price": p[4],
-            "limited_edition": p[5],
-            "sold_out": p[6],
-            "image_url": first,
-            "images": imgs,
-        }
-        log(f"get_product_with_images returning: {result}", "SUCCESS")
-        return result
+    rows = fetch_catalog_details("product", [pid])
+    if not rows:
+        log(f"get_product_with_images: product not found for id={pid}", "WARNING")
+        return None
+    result = CATALOG_DETAIL_JSON["product"].to_dict(rows[0])
+    log(f"get_product_with_images returning: {result}", "SUCCESS")
+    return result
+
+# ----------------------------
+# Catalog cache and writes
+# ----------------------------
+# Listings are rebuilt from shop.db only when the catalog version moves.
+# Every catalog write bumps the version through invalidate_catalog() once,
+# after its commit, no matter how many rows it touched (batch, import).
+# The version and the encoded listings live in CATALOG_STORE (snapshot.py):
+# with SNAPSHOT_BACKEND=mmap or redis every worker process sees the same
+# version and the first worker to build (or compress) a listing for it
+# publishes the bytes for the others. Each worker still keeps its own
+# _CATALOG_CACHE on top so the hot path doesn't touch the store.
+# With the default local backend the version is the catalog_meta row in
+# shop.db, moved by triggers in the write's own transaction (init_db
+# migration 15): other workers pick it up within CATALOG_VERSION_POLL_SECONDS
+# and invalidate_catalog() only makes this worker re-read it right away.
+# The SQL for creating/updating/deleting products and services lives in
+# catalog_insert/catalog_update/catalog_delete so the single-item endpoints,
+# the batch endpoint and anything else share it.
+
+def _stored_catalog_version() -> int:
+    with closing(db()) as conn:
+        return conn.execute("SELECT version FROM catalog_meta WHERE id = 1").fetchone()[0]
+
+try:
+    CATALOG_STORE = snapshot.open_store(SNAPSHOT_BACKEND, SNAPSHOT_DIR, REDIS_URL,
+                                        read_version=_stored_catalog_version,
+                                        poll_interval=CATALOG_VERSION_POLL_SECONDS)
+except Exception as e:
+    log(f"Failed to open {SNAPSHOT_BACKEND} catalog snapshot store: {e}", "ERROR")
+    exit(1)
+if CATALOG_STORE.shared:
+    # shop.db may have changed while no worker was running (restore, manual edits): don't trust old snapshots.
+    # Clock-based, so a store that lost its counter (Redis flushed, inprocess://, SNAPSHOT_DIR wiped)
+    # still doesn't hand out a version clients already have an ETag for.
+    CATALOG_STORE.bump(at_least=time.time_ns() // 1000)
+    log(f"Catalog snapshots: {CATALOG_STORE.describe()}, version {CATALOG_STORE.version()}", "INFO")
+else:
+    # not read here: under `py server.py` shop.db is only migrated further down
+    log(f"Catalog snapshots: {CATALOG_STORE.describe()}", "INFO")
+
+_CATALOG_LOCK = threading.Lock()
+_CATALOG_CACHE = {}
+
+def catalog_version() -> int:
+    return CATALOG_STORE.version()
+
+def invalidate_catalog(reason: str):
+    with _CATALOG_LOCK:
+        version = CATALOG_STORE.bump()
+        _CATALOG_CACHE.clear()
+    log(f"Catalog cache invalidated ({reason}), now at version {version}", "INFO")
+
+def catalog_cached(key: str, build):
+    """Return build() for the current catalog version, computing it at most once per version."""
+    version = catalog_version()
+    entry = _CATALOG_CACHE.get(key) if CATALOG_CACHE_ENABLED else None
+    if entry and entry[0] == version:
+        cache_lookup("catalog", True)
+        return entry[1]
+    cache_lookup("catalog", False)
+    value = build()
+    with _CATALOG_LOCK:
+        # Don't store something built from data that was replaced while we were building it
+        if CATALOG_CACHE_ENABLED and catalog_version() == version:
+            _CATALOG_CACHE[key] = (version, value)
+    return value
+
+def catalog_snapshot(key: str, build) -> compression.Payload:
+    """
+    Cached JSON bytes from build() as a compression.Payload: this worker's
+    cache, then the shared store, then build() (published to the store).
+    Compressed variants are shared through the store the same way.
+    """
+    if not CATALOG_CACHE_ENABLED:
+        return compression.Payload(build(), _DYNAMIC_LEVELS)
+
+    def load():
+        version = catalog_version()
+        raw = CATALOG_STORE.get(key, version)
+        if raw is None:
+            raw = build()
+            CATALOG_STORE.put(key, version, raw)
+        elif CATALOG_STORE.shared:
+            log(f"Catalog snapshot {key!r} v{version} loaded from the shared store ({len(raw)} bytes)", "INFO")
+        return compression.Payload(
+            raw, _CACHED_LEVELS,
+            fetch=lambda enc: CATALOG_STORE.get(f"{key}.{enc}", version),
+            publish=lambda enc, data: CATALOG_STORE.put(f"{key}.{enc}", version, data),
+        )
+    return catalog_cached(key, load)
+
+CATALOG_KINDS = {
+    "product": {
+        "table": "products", "images": "product_images", "owner": "product_id",
+        "columns": ("name", "bio", "price", "discount_price", "limited_edition", "sold_out", "almost_sold_out"),
+        "flags": {"limited_edition": 0, "sold_out": 0, "almost_sold_out": 0},  # flag -> default
+    },
+    "service": {
+        "table": "services", "images": "service_images", "owner": "service_id",
+        "columns": ("name", "bio", "price", "discount_price", "active"),
+        "flags": {"active": 1},
+    },
+}
+
+def _catalog_value(spec: dict, col: str, value):
+    return int(bool(value)) if col in spec["flags"] else value
+
+def _write_catalog_images(cur, spec: dict, iid: int, images: list, replace: bool):
+    if replace:
+        cur.execute(f"DELETE FROM {spec['images']} WHERE {spec['owner']}=?", (iid,))
+    if images:
+        cur.executemany(
+            f"INSERT INTO {spec['images']} ({spec['owner']}, image_path, alt_text, sort_order) VALUES (?,?,?,?)",
+            [(iid, p, None, i) for i, p in enumerate(images)]
+        )
+
+def catalog_insert(cur, kind: str, data: dict) -> int:
+    """Insert a product/service with its images. Raises ValueError on missing name/price."""
+    spec = CATALOG_KINDS[kind]
+    if not data.get("name") or data.get("price") is None:
+        raise ValueError("`name` and `price` are required")
+    cols = spec["columns"]
+    cur.execute(
+        f"INSERT INTO {spec['table']} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+        [_catalog_value(spec, c, data.get(c, spec["flags"].get(c))) for c in cols]
+    )
+    new_id = cur.lastrowid
+    images = data.get("images") or ([data["image_url"]] if data.get("image_url") else [])
+    _write_catalog_images(cur, spec, new_id, images, replace=False)
+    return new_id
+
+def catalog_update(cur, kind: str, iid: int, data: dict) -> bool:
+    """
+    Update the given fields; "images" (or "image_url") replaces the image list.
+    Raises ValueError when there is nothing to update, returns False if the row doesn't exist.
+    """
+    spec = CATALOG_KINDS[kind]
+    fields = [c for c in spec["columns"] if c in data]
+    images = None
+    if "images" in data:
+        images = data.get("images") or []
+    elif "image_url" in data:
+        images = [data["image_url"]] if data["image_url"] else []
+    if not fields and images is None:
+        raise ValueError("no fields to update")
+
+    if fields:
+        cur.execute(f"UPDATE {spec['table']} SET {', '.join(f'{c}=?' for c in fields)} WHERE id=?",
+                    [_catalog_value(spec, c, data[c]) for c in fields] + [iid])
+        found = cur.rowcount > 0
+    else:
+        found = cur.execute(f"SELECT 1 FROM {spec['table']} WHERE id=?", (iid,)).fetchone() is not None
+    if found and images is not None:
+        _write_catalog_images(cur, spec, iid, images, replace=True)
+    return found
+
+def catalog_delete(cur, kind: str, iid: int) -> bool:
+    spec = CATALOG_KINDS[kind]
+    cur.execute(f"DELETE FROM {spec['table']} WHERE id=?", (iid,))
+    return cur.rowcount > 0
 
 # ----------------------------
 # PayPal helpers and endpoints
@@ -315,24 +1236,38 @@ def get_product_with_images(pid: int):
 
 def paypal_api_base() -> str:
     log(f"paypal_api_base called, PAYPAL_ENV={PAYPAL_ENV}", "INFO")
-    base = "https://api-m.paypal.com" if PAYPAL_ENV == "live" else "https://api-m.sandbox.paypal.com"
+    if PAYPAL_API_BASE:
+        base = PAYPAL_API_BASE
+    else:
+        base = "https://api-m.paypal.com" if PAYPAL_ENV == "live" else "https://api-m.sandbox.paypal.com"
     log(f"paypal_api_base returning: {base}", "INFO")
     return base
 
-def _http_json(method: str, url: str, headers: dict, data_obj=None):
+def _paypal_endpoint(url: str) -> str:
+    # Metrics label: path with order ids collapsed, e.g. /v2/checkout/orders/{id}/capture
+    path = urllib.parse.urlsplit(url).path
+    return re.sub(r"/orders/[^/]+", "/orders/{id}", path)
+
+def _http_json(method: str, url: str, headers: dict, data_obj=None, raw_json: bytes | None = None):
     log(f"_http_json called: method={method}, url={url}, headers={headers}, data_obj={data_obj}", "INFO")
     data_bytes = None
     if data_obj is not None:
         data_bytes = json.dumps(data_obj).encode("utf-8")
         headers = {**headers, "Content-Type": "application/json"}
         log(f"Serialized data_obj to JSON bytes, updated headers: {headers}", "INFO")
+    elif raw_json is not None:
+        data_bytes = raw_json  # already-serialized JSON, sent as is
+        headers = {**headers, "Content-Type": "application/json"}
 
     req = urllib.request.Request(url=url, data=data_bytes, headers=headers, method=method)
     log(f"Created urllib.request.Request: {req}", "INFO")
     context = ssl.create_default_context()
     log("Created SSL context for request", "INFO")
+    t0 = time.perf_counter()
+    status = "error"
     try:
         with urllib.request.urlopen(req, context=context, timeout=30) as resp:
+            status = str(resp.status)
             log(f"HTTP request sent, got response: status={resp.status}, reason={getattr(resp, 'reason', None)}", "SUCCESS")
             payload = resp.read()
             log(f"Read response payload: {payload[:200]}... (truncated)", "INFO")
@@ -340,6 +1275,7 @@ def _http_json(method: str, url: str, headers: dict, data_obj=None):
             log(f"Decoded JSON response: {result}", "SUCCESS")
             return result, resp.getcode()
     except urllib.error.HTTPError as e:
+        status = str(e.code)
         body = e.read().decode("utf-8", errors="ignore")
         log(f"HTTPError {e.code} for {url}: {body}", "ERROR")
         try:
@@ -352,14 +1288,18 @@ def _http_json(method: str, url: str, headers: dict, data_obj=None):
     except Exception as e:
         log(f"Request error for {url}: {e}", "ERROR")
         return {"error": str(e)}, 500
+    finally:
+        PAYPAL_LATENCY.observe(time.perf_counter() - t0, (_paypal_endpoint(url), status))
 
 def paypal_get_token() -> str:
     global _PAYPAL_TOKEN, _PAYPAL_TOKEN_EXP
     now = int(time.time())
     log(f"paypal_get_token called, now={now}, _PAYPAL_TOKEN_EXP={_PAYPAL_TOKEN_EXP}", "INFO")
     if _PAYPAL_TOKEN and now < (_PAYPAL_TOKEN_EXP - 60):
+        cache_lookup("paypal_token", True)
         log("Returning cached PayPal token", "SUCCESS")
         return _PAYPAL_TOKEN
+    cache_lookup("paypal_token", False)
 
     if not PAYPAL_CLIENT_ID or not PAYPAL_CLIENT_SECRET:
         log("PayPal credentials not configured", "ERROR")
@@ -381,8 +1321,11 @@ def paypal_get_token() -> str:
     log(f"Created PayPal token request: {req}", "INFO")
     context = ssl.create_default_context()
     log("Created SSL context for PayPal token request", "INFO")
+    t0 = time.perf_counter()
+    status = "error"
     try:
         with urllib.request.urlopen(req, context=context, timeout=30) as resp:
+            status = str(resp.status)
             log(f"PayPal token HTTP request sent, got response: status={resp.status}, reason={getattr(resp, 'reason', None)}", "SUCCESS")
             payload = resp.read()
             log(f"Read PayPal token response payload: {payload[:200]}... (truncated)", "INFO")
@@ -393,28 +1336,31 @@ def paypal_get_token() -> str:
             log(f"Stored PayPal token: {_PAYPAL_TOKEN}, expires at {_PAYPAL_TOKEN_EXP}", "SUCCESS")
             return _PAYPAL_TOKEN
     except Exception as e:
+        if isinstance(e, urllib.error.HTTPError):
+            status = str(e.code)
         log(f"Failed to obtain PayPal token: {e}", "ERROR")
         raise
+    finally:
+        PAYPAL_LATENCY.observe(time.perf_counter() - t0, (_paypal_endpoint(url), status))
 
 def _get_price_for_item(cur, kind: str, iid: int):
     log(f"_get_price_for_item called with kind={kind}, iid={iid}", "INFO")
     if kind == "product":
         log(f"Fetching product price for id={iid}", "INFO")
-        row = cur.execute("SELECT name, price, discount_price FROM products WHERE id=?", (iid,)).fetchone()
+        row = cur.execute("SELECT name, price, effective_price, primary_image FROM products WHERE id=?", (iid,)).fetchone()
     elif kind == "service":
         log(f"Fetching service price for id={iid}", "INFO")
-        row = cur.execute("SELECT name, price, discount_price FROM services WHERE id=?", (iid,)).fetchone()
+        row = cur.execute("SELECT name, price, effective_price, primary_image FROM services WHERE id=?", (iid,)).fetchone()
     else:
         log(f"Unknown kind '{kind}' for item id={iid}", "WARNING")
         row = None
     if not row:
         log(f"No row found for kind={kind}, id={iid}", "WARNING")
         return None
-    name, price, discount_price = row
-    log(f"Fetched row: name={name}, price={price}, discount_price={discount_price}", "INFO")
-    unit = discount_price if (discount_price is not None and discount_price < price) else price
-    log(f"Unit price determined: {unit}", "INFO")
-    return {"name": name, "unit_price": float(unit)}
+    # effective_price is a generated column (init_db.EFFECTIVE_PRICE_SQL): discount if set and lower
+    name, price, unit, image_url = row
+    log(f"Fetched row: name={name}, price={price}, effective_price={unit}", "INFO")
+    return {"name": name, "unit_price": float(unit), "image_url": image_url or None}
 
 def _apply_dev_discount(subtotal: float, code: str | None) -> float:
     log(f"_apply_dev_discount called with subtotal={subtotal}, code={code}", "INFO")
@@ -441,16 +1387,19 @@ def _apply_dev_discount(subtotal: float, code: str | None) -> float:
 def compute_amounts(items: list, discount_code: str | None):
     """
     items: [{id, kind, qty}]
-    returns dict with subtotal, discount, total (floats)
+    returns dict with subtotal, discount, total (floats) and lines: the priced
+    items as they'll be stored in order_items (name/price/image snapshot)
     """
     log(f"compute_amounts called with items={items}, discount_code={discount_code}", "INFO")
     if not isinstance(items, list) or not items:
         log("Cart is empty or items is not a list", "WARNING")
         return None, "Cart is empty"
 
-    with db() as conn:
+    # read-only: closing() hands the connection back to the pool afterwards
+    with closing(db()) as conn:
         cur = conn.cursor()
         subtotal = 0.0
+        lines = []
         for it in items:
             log(f"Processing item: {it}", "INFO")
             try:
@@ -469,6 +1418,7 @@ def compute_amounts(items: list, discount_code: str | None):
             item_total = got["unit_price"] * max(1, qty)
             log(f"Item unit_price={got['unit_price']}, qty={qty}, item_total={item_total}", "INFO")
             subtotal += item_total
+            lines.append({"kind": kind, "id": iid, "qty": max(1, qty), **got})
 
         subtotal = round(subtotal, 2)
         log(f"Subtotal calculated: {subtotal}", "INFO")
@@ -476,7 +1426,7 @@ def compute_amounts(items: list, discount_code: str | None):
         log(f"Discount calculated: {discount}", "INFO")
         total = max(0.0, round(subtotal - discount, 2))
         log(f"Total calculated: {total}", "INFO")
-        return {"subtotal": subtotal, "discount": discount, "total": total}, None
+        return {"subtotal": subtotal, "discount": discount, "total": total, "lines": lines}, None
 
 @app.route('/api/paypal/config', methods=['GET'])
 def paypal_config():
@@ -544,8 +1494,25 @@ def paypal_create_order():
 
     order_id = res.get("id")
     log(f"PayPal order created successfully: {order_id}", "SUCCESS")
+    lines = amounts.pop("lines")
+    try:
+        save_checkout(order_id, optional_user_id(), lines, amounts, discount_code)
+    except Exception as e:
+        # The payment can still go through; only the order history entry would be missing
+        log(f"Could not store checkout for PayPal order {order_id}: {e}", "ERROR")
     return jsonify({"id": order_id, "amounts": amounts})
 
+def paypal_capture(order_id: str, token: str):
+    url = f"{paypal_api_base()}/v2/checkout/orders/{order_id}/capture"
+    log(f"Sending capture request to PayPal: url={url}", "INFO")
+    headers = {"Authorization": f"Bearer {token}"}
+    res, code = _http_json("POST", url, headers, data_obj={})
+    log(f"PayPal capture response code: {code}, response: {res}", "INFO")
+    return res, code
+
+def paypal_already_captured(res: dict, code: int) -> bool:
+    return code == 422 and any(d.get("issue") == "ORDER_ALREADY_CAPTURED" for d in (res.get("details") or []))
+
 @app.route('/api/paypal/capture-order', methods=['POST'])
 def paypal_capture_order():
     """
@@ -568,11 +1535,11 @@ def paypal_capture_order():
         log(f"PayPal auth failed: {e}", "ERROR")
         return jsonify({"error": f"PayPal auth failed: {e}"}), 500
 
-    url = f"{paypal_api_base()}/v2/checkout/orders/{order_id}/capture"
-    log(f"Sending capture request to PayPal: url={url}", "INFO")
-    headers = {"Authorization": f"Bearer {token}"}
-    res, code = _http_json("POST", url, headers, data_obj={})
-    log(f"PayPal capture response code: {code}, response: {res}", "INFO")
+    res, code = paypal_capture(order_id, token)
+    if paypal_already_captured(res, code):
+        # The webhook worker (CHECKOUT.ORDER.APPROVED) got there first: the payment went through
+        log(f"PayPal order {order_id} was already captured", "INFO")
+        res, code = {"id": order_id, "status": "COMPLETED"}, 200
 
     if code not in (200, 201):
         log(f"Failed to capture PayPal order: {res}", "ERROR")
@@ -581,61 +1548,365 @@ def paypal_capture_order():
     status = res.get("status")
     ok = status in ("COMPLETED", "APPROVED")
     log(f"PayPal order capture status: {status}, ok: {ok}", "SUCCESS" if ok else "WARNING")
-    return jsonify({"ok": ok, "status": status, "details": res})
+    shop_order_id = None
+    if status == "COMPLETED":
+        try:
+            shop_order_id = complete_checkout(order_id)
+        except Exception as e:
+            log(f"Could not record order for captured PayPal order {order_id}: {e}", "ERROR")
+    return jsonify({"ok": ok, "status": status, "order_id": shop_order_id, "details": res})
+
+# ----------------------------
+# Checkouts -> orders
+# ----------------------------
+# create-order stores the priced cart in `checkouts` under the PayPal order
+# id; a COMPLETED capture marks it captured and turns it into an orders row
+# + order_items in one transaction, together with the sales summaries
+# (analytics.py). Items keep the name, unit price and image they had when they
+# were bought. Only for logged-in customers (orders.user_id is required);
+# guest checkouts stay in `checkouts`.
+
+def save_checkout(paypal_order_id: str, user_id, lines: list, amounts: dict, discount_code):
+    with closing(db()) as conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO checkouts (paypal_order_id, user_id, lines, currency, subtotal, discount, total, discount_code)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (paypal_order_id, user_id, json.dumps(lines), CURRENCY, amounts["subtotal"], amounts["discount"],
+              amounts["total"], discount_code))
+        analytics.record_checkout(conn, conn.execute("SELECT date('now')").fetchone()[0])
+        conn.commit()
+    log(f"Checkout stored for PayPal order {paypal_order_id} (user_id={user_id}, {len(lines)} lines)", "INFO")
+
+def complete_checkout(paypal_order_id: str):
+    """
+    Record a captured checkout: captured_at + sales summaries (analytics.py) for everyone, the order
+    for customers. Returns the order id (the same one on repeated calls), None for guests/unknown.
+    """
+    conn = db()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("""
+            SELECT user_id, lines, currency, subtotal, discount, total, discount_code, order_id,
+                   date(created_at), captured_at
+              FROM checkouts WHERE paypal_order_id=?
+        """, (paypal_order_id,)).fetchone()
+        if not row:
+            log(f"No checkout stored for PayPal order {paypal_order_id}", "WARNING")
+            return None
+        user_id, lines, currency, subtotal, discount, total, discount_code, order_id, created_day, captured_at = row
+        if captured_at is not None:
+            return order_id  # already recorded (browser capture + webhook, retries)
+        conn.execute("UPDATE checkouts SET captured_at = CURRENT_TIMESTAMP WHERE paypal_order_id=?", (paypal_order_id,))
+        lines = json.loads(lines)
+        day = conn.execute("SELECT date(captured_at) FROM checkouts WHERE paypal_order_id=?", (paypal_order_id,)).fetchone()[0]
+        analytics.record_capture(conn, created_day)
+        analytics.record_sale(conn, day, lines, subtotal, discount, total, discount_code)
+        if user_id is None:
+            conn.commit()
+            log(f"Guest checkout {paypal_order_id} captured", "SUCCESS")
+            return None
+        order_id = conn.execute("""
+            INSERT INTO orders (user_id, status, created_at, paypal_order_id, currency, subtotal, discount, total, discount_code)
+            VALUES (?, 'ordered', CURRENT_TIMESTAMP, ?, ?, ?, ?, ?, ?)
+        """, (user_id, paypal_order_id, currency, subtotal, discount, total, discount_code)).lastrowid
+        # The FK columns go NULL if the item was deleted in the meantime; the snapshot stays
+        conn.executemany("""
+            INSERT INTO order_items (order_id, kind, product_id, service_id, name, unit_price, qty, image_url)
+            VALUES (?, ?, (SELECT id FROM products WHERE id=? AND ?='product'),
+                          (SELECT id FROM services WHERE id=? AND ?='service'), ?, ?, ?, ?)
+        """, [(order_id, l["kind"], l["id"], l["kind"], l["id"], l["kind"], l["name"], l["unit_price"], l["qty"],
+               l.get("image_url")) for l in lines])
+        conn.execute("UPDATE checkouts SET order_id=? WHERE paypal_order_id=?", (order_id, paypal_order_id))
+        conn.commit()
+        log(f"Order {order_id} created for user {user_id} from PayPal order {paypal_order_id}", "SUCCESS")
+        return order_id
+    finally:
+        conn.close()
+
+# ----------------------------
+# PayPal webhooks
+# ----------------------------
+# /api/paypal/webhook only does cheap checks, stores the raw delivery in
+# webhook_events (eventqueue.py) and answers 200 at once; PayPal redelivers
+# anything else for up to 3 days. Nothing is verified yet at that point, so
+# a repeated delivery is stored once, an event id that already has a
+# verified delivery isn't stored again, and past WEBHOOK_MAX_UNVERIFIED
+# waiting deliveries the answer is 503. WEBHOOK_WORKERS background threads
+# then verify the signature with PayPal (verify-webhook-signature, off the
+# request thread) - the first genuine delivery of an event id is the one
+# applied, a forged one sent earlier with the same id is rejected:
+#   PAYMENT.CAPTURE.COMPLETED  -> complete_checkout(), so a payment is recorded even if the tab was closed
+#   CHECKOUT.ORDER.APPROVED    -> capture it ourselves if nobody did within PAYPAL_WEBHOOK_CAPTURE_DELAY
+# Both paths and the browser's capture-order are idempotent, whichever runs first wins.
+# Local testing: bench/paypal_stub.py signs and verifies like PayPal, bench/webhook_replay.py sends events.
+
+WEBHOOK_HEADERS = ("PAYPAL-AUTH-ALGO", "PAYPAL-CERT-URL", "PAYPAL-TRANSMISSION-ID",
+                   "PAYPAL-TRANSMISSION-SIG", "PAYPAL-TRANSMISSION-TIME")
+
+def webhook_paypal_order_id(event: dict):
+    """The PayPal order an event is about (checkouts.paypal_order_id), if any."""
+    resource = event.get("resource") or {}
+    if not isinstance(resource, dict):
+        return None
+    if event.get("event_type", "").startswith("CHECKOUT.ORDER."):
+        return resource.get("id")
+    related = (resource.get("supplementary_data") or {}).get("related_ids") or {}
+    return related.get("order_id")
+
+def paypal_verify_webhook(headers: dict, body: str) -> bool:
+    """Ask PayPal whether a delivery is genuine. Raises when PayPal can't be asked (the event is retried)."""
+    token = paypal_get_token()
+    fields = {
+        "auth_algo": headers.get("PAYPAL-AUTH-ALGO"),
+        "cert_url": headers.get("PAYPAL-CERT-URL"),
+        "transmission_id": headers.get("PAYPAL-TRANSMISSION-ID"),
+        "transmission_sig": headers.get("PAYPAL-TRANSMISSION-SIG"),
+        "transmission_time": headers.get("PAYPAL-TRANSMISSION-TIME"),
+        "webhook_id": PAYPAL_WEBHOOK_ID,
+    }
+    # The signature covers the body byte for byte, so the event is spliced in as received rather than re-serialized
+    payload = json.dumps(fields)[:-1] + ', "webhook_event": ' + body + "}"
+    url = f"{paypal_api_base()}/v1/notifications/verify-webhook-signature"
+    res, code = _http_json("POST", url, {"Authorization": f"Bearer {token}"}, raw_json=payload.encode("utf-8"))
+    if code != 200:
+        raise RuntimeError(f"verify-webhook-signature answered {code}: {res}")
+    return res.get("verification_status") == "SUCCESS"
+
+def _webhook_capture_completed(event: dict, paypal_order_id):
+    if not paypal_order_id:
+        raise eventqueue.Reject("capture without related order id")
+    return {"paypal_order_id": paypal_order_id, "order_id": complete_checkout(paypal_order_id)}
+
+def _webhook_order_approved(event: dict, paypal_order_id):
+    if not paypal_order_id:
+        raise eventqueue.Reject("order event without id")
+    with closing(db()) as conn:
+        row = conn.execute("SELECT captured_at, order_id FROM checkouts WHERE paypal_order_id=?", (paypal_order_id,)).fetchone()
+    if row is None:
+        return {"skipped": "no checkout stored for this order"}
+    if row[0] is not None:
+        return {"already_captured": True, "order_id": row[1]}
+    # Approved but still not captured after PAYPAL_WEBHOOK_CAPTURE_DELAY: the buyer left before onApprove ran
+    log(f"Capturing approved PayPal order {paypal_order_id} from its webhook", "INFO")
+    res, code = paypal_capture(paypal_order_id, paypal_get_token())
+    if paypal_already_captured(res, code) or (code in (200, 201) and res.get("status") == "COMPLETED"):
+        return {"captured": True, "order_id": complete_checkout(paypal_order_id)}
+    if code >= 500:
+        raise RuntimeError(f"capture answered {code}: {res}")
+    # e.g. INSTRUMENT_DECLINED: the buyer has to pay again, retrying won't help
+    log(f"Webhook capture of PayPal order {paypal_order_id} refused ({code}): {res}", "WARNING")
+    return {"captured": False, "code": code, "details": res.get("details") or res.get("name")}
+
+WEBHOOK_HANDLERS = {
+    "PAYMENT.CAPTURE.COMPLETED": _webhook_capture_completed,
+    "CHECKOUT.ORDER.APPROVED": _webhook_order_approved,
+}
+
+def _webhook_label(event_type) -> str:
+    # metric label: event types are sender-controlled, keep the label set bounded
+    return event_type if event_type in WEBHOOK_HANDLERS else "other"
+
+def verify_webhook_event(event: dict) -> bool:
+    """eventqueue verify callable (unless PAYPAL_WEBHOOK_VERIFY=0)."""
+    return paypal_verify_webhook(event["headers"], event["body"])
+
+def process_webhook_event(event: dict):
+    """eventqueue handler, for verified events: dispatch on event_type. Unhandled types are stored and marked done."""
+    handler = WEBHOOK_HANDLERS.get(event["event_type"])
+    if handler is None:
+        return {"ignored": event["event_type"]}
+    return handler(json.loads(event["body"]), event["resource_id"])
+
+def _webhook_processed(event: dict, status: str, seconds: float, error: str | None):
+    label = _webhook_label(event["event_type"])
+    WEBHOOK_PROCESSED.inc((label, status))
+    WEBHOOK_SECONDS.observe(seconds, (label,))
+    if status == "done":
+        log(f"Webhook {event['event_id']} ({event['event_type']}) processed in {seconds * 1000:.1f} ms", "SUCCESS")
+    elif status == "pending":
+        log(f"Webhook {event['event_id']} attempt {event['attempts']} failed, will retry: {error}", "WARNING")
+    else:
+        log(f"Webhook {event['event_id']} ({event['event_type']}) {status}: {error}", "ERROR")
+
+WEBHOOK_QUEUE = eventqueue.EventQueue(
+    db,
+    process_webhook_event,
+    workers=WEBHOOK_WORKERS,
+    max_attempts=WEBHOOK_MAX_ATTEMPTS,
+    retry_base=WEBHOOK_RETRY_SECONDS,
+    on_done=_webhook_processed,
+    verify=verify_webhook_event if PAYPAL_WEBHOOK_VERIFY else None,
+    max_unverified=WEBHOOK_MAX_UNVERIFIED,
+)
+
+@app.route('/api/paypal/webhook', methods=['POST'])
+def paypal_webhook():
+    log("Received PayPal webhook delivery", "INFO")
+    if PAYPAL_WEBHOOK_VERIFY and not PAYPAL_WEBHOOK_ID:
+        log("PAYPAL_WEBHOOK_ID not configured, refusing webhook", "ERROR")
+        return jsonify({"error": "Webhooks not configured"}), 503
+    request.max_content_length = WEBHOOK_MAX_KB * 1024
+    try:
+        body = request.get_data(cache=False).decode("utf-8")
+        event = json.loads(body)
+        event_id, event_type = event.get("id"), event.get("event_type")
+        if not isinstance(event_id, str) or not event_id or not isinstance(event_type, str) or not event_type:
+            raise ValueError("id and event_type required")
+    except (ValueError, AttributeError) as e:
+        WEBHOOK_RECEIVED.inc(("other", "invalid"))
+        log(f"Invalid webhook body: {e}", "WARNING")
+        return jsonify({"error": "invalid event"}), 400
+    headers = {h: request.headers.get(h) for h in WEBHOOK_HEADERS}
+    if PAYPAL_WEBHOOK_VERIFY and not all(headers.values()):
+        WEBHOOK_RECEIVED.inc((_webhook_label(event_type), "invalid"))
+        log(f"Webhook {event_id} without PayPal transmission headers", "WARNING")
+        return jsonify({"error": "missing PayPal transmission headers"}), 400
+
+    delay = PAYPAL_WEBHOOK_CAPTURE_DELAY if event_type == "CHECKOUT.ORDER.APPROVED" else 0.0
+    try:
+        new = WEBHOOK_QUEUE.enqueue(event_id, event_type, body, headers, webhook_paypal_order_id(event), delay=delay)
+    except eventqueue.QueueFull as e:
+        WEBHOOK_RECEIVED.inc((_webhook_label(event_type), "throttled"))
+        log(f"Webhook {event_id} refused: {e}", "WARNING")
+        return jsonify({"error": "too many unverified events, retry later"}), 503, {"Retry-After": "60"}
+    except Exception as e:
+        WEBHOOK_RECEIVED.inc((_webhook_label(event_type), "error"))
+        log(f"Could not store webhook {event_id}: {e}", "ERROR")
+        return jsonify({"error": "could not store event"}), 500  # PayPal delivers it again
+    WEBHOOK_RECEIVED.inc((_webhook_label(event_type), "queued" if new else "duplicate"))
+    log(f"Webhook {event_id} ({event_type}) {'queued' if new else 'already stored, ignored'}", "SUCCESS")
+    return jsonify({"ok": True, "duplicate": not new})
+
+@app.route('/api/admin/webhooks', methods=['GET'])
+@require_admin
+def admin_webhooks():
+    """Queue counts plus the latest events, optionally of one ?status= (e.g. failed)."""
+    status = request.args.get("status")
+    if status and status not in eventqueue.STATUSES:
+        return jsonify({"error": f"`status` must be one of {', '.join(eventqueue.STATUSES)}"}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 200)
+    except ValueError:
+        return jsonify({"error": "`limit` must be an integer"}), 400
+    log(f"Received request for webhook events (status={status}, limit={limit})", "INFO")
+    with closing(db()) as conn:
+        rows = conn.execute(f"""
+            SELECT id, event_id, event_type, resource_id, verified, status, attempts, last_error, result, received_at, processed_at
+              FROM webhook_events {'WHERE status = ?' if status else ''}
+             ORDER BY id DESC LIMIT ?
+        """, (status, limit) if status else (limit,)).fetchall()
+    keys = ("id", "event_id", "event_type", "resource_id", "verified", "status", "attempts", "last_error", "result",
+            "received_at", "processed_at")
+    events = [dict(zip(keys, r)) for r in rows]
+    for e in events:
+        e["verified"] = bool(e["verified"])
+        e["result"] = json.loads(e["result"]) if e["result"] else None
+    return jsonify({"queue": WEBHOOK_QUEUE.stats(), "events": events})
+
+@app.route('/api/admin/webhooks/retry', methods=['POST'])
+@require_admin
+def admin_webhooks_retry():
+    """
+    Expects: { status: "failed"|"rejected", event_ids: [...] (optional, default: all with that status) }
+    Returns: { requeued: n }
+    """
+    data = request.get_json(force=True, silent=True) or {}
+    status = data.get("status") or "failed"
+    event_ids = data.get("event_ids") or None
+    if status not in ("failed", "rejected"):
+        return jsonify({"error": "`status` must be failed or rejected"}), 400
+    if event_ids is not None and (not isinstance(event_ids, list) or not all(isinstance(i, str) for i in event_ids)):
+        return jsonify({"error": "`event_ids` must be a list of strings"}), 400
+    n = WEBHOOK_QUEUE.retry(event_ids, status)
+    log(f"Requeued {n} {status} webhook events", "SUCCESS")
+    return jsonify({"requeued": n, "queue": WEBHOOK_QUEUE.stats()})
 
 # ----------------------------
 # Existing business endpoints
 # ----------------------------
 
+UPPHRASES = [
+    "Privacy is a right, not a privilege",
+    "Your data, your rules",
+    "Control your digital footprint",
+    "Anonymity is freedom",
+    "Secure your digital life"
+]
+DOWNPHRASES = [
+    "Easy and affordable",
+    "Secure phones for everyone",
+    "Affordable privacy for all",
+    "Affordable security, maximum privacy",
+    "Cheaper and better than the rest"
+]
+
 @app.route('/api/catchphrase', methods=['GET'])
 def catchphrase():
     log("Received request for catchphrase", "INFO")
-    list_of_upphrases = [
-        "Privacy is a right, not a privilege",
-        "Your data, your rules",
-        "Control your digital footprint",
-        "Anonymity is freedom",
-        "Secure your digital life"
-    ]
-    list_of_downphrases = [
-        "Easy and affordable",
-        "Secure phones for everyone",
-        "Affordable privacy for all",
-        "Affordable security, maximum privacy",
-        "Cheaper and better than the rest"
-    ]
-    upph = random.choice(list_of_upphrases)
-    downph = random.choice(list_of_downphrases)
+    upph = random.choice(UPPHRASES)
+    downph = random.choice(DOWNPHRASES)
     log(f"Generated catchphrase: {upph} | {downph}", "SUCCESS")
     return jsonify({"upphrase": upph, "downphrase": downph})
 
+def _parse_ids_param(raw: str) -> list:
+    ids = []
+    for part in raw.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if not part.isdigit():
+            raise ValueError("`ids` must be a comma-separated list of integers")
+        if int(part) not in ids:
+            ids.append(int(part))
+    if not ids:
+        raise ValueError("`ids` is empty")
+    if len(ids) > CATALOG_IDS_MAX:
+        raise ValueError(f"too many ids (max {CATALOG_IDS_MAX})")
+    return ids
+
+def _catalog_details_response(kind: str):
+    """?ids=1,2,3 on the listing endpoints: full records incl. images, in the requested order, one statement."""
+    try:
+        ids = _parse_ids_param(request.args.get("ids", ""))
+    except ValueError as e:
+        log(f"Bad ids parameter for {kind} details: {e}", "WARNING")
+        return jsonify({"error": str(e)}), 400
+    rows = fetch_catalog_details(kind, ids)
+    if len(rows) < len(ids):
+        log(f"{kind} details: {len(ids) - len(rows)} of {len(ids)} requested ids not found", "WARNING")
+    log(f"Returning {len(rows)} {kind} details for ids={ids}", "SUCCESS")
+    return Response(CATALOG_DETAIL_JSON[kind].encode_rows(rows), mimetype="application/json")
+
 @app.route('/api/products', methods=['GET'])
 def products_get():
+    if "ids" in request.args:
+        return _catalog_details_response("product")
+    if CATALOG_QUERY_PARAMS.intersection(request.args):
+        return _catalog_query_response("product")
     log("Received request for products list", "INFO")
+    payload = catalog_snapshot("products", _load_products_json)
+    log(f"Returning products list ({len(payload)} bytes, catalog version {catalog_version()})", "SUCCESS")
+    return catalog_response(payload)
+
+def _load_products_json() -> bytes:
     conn = db()
     cur = conn.cursor()
     log("Executing SQL to fetch products with first image", "INFO")
-    # Pull first image via subquery (works with normalized schema)
+    # primary_image/image_count are kept up to date by triggers on product_images
     cur.execute("""
         SELECT
             p.id, p.name, p.bio, p.price, p.discount_price,
             p.limited_edition, p.sold_out,
-            (
-                SELECT pi.image_path
-                  FROM product_images pi
-                 WHERE pi.product_id = p.id
-                 ORDER BY pi.sort_order ASC, pi.id ASC
-                 LIMIT 1
-            ) AS image_url
+            p.primary_image AS image_url, p.image_count,
+            """ + LISTING_IMAGE_META_SQL + """
         FROM products p
+        LEFT JOIN image_meta m ON m.path = p.primary_image
     """)
     rows = cur.fetchall()
     log(f"Fetched {len(rows)} products from database", "SUCCESS")
     conn.close()
     log("Closed database connection for products_get", "INFO")
-    result = [row_to_product(r) for r in rows]
-    log(f"Returning products list: {result}", "SUCCESS")
-    return jsonify(result)
+    return PRODUCT_LIST_JSON.encode_rows(rows)
 
 # NEW: return a single product with its full images array
 @app.route('/api/products/<int:pid>', methods=['GET'])
@@ -650,7 +1921,16 @@ def products_get_one(pid):
 
 @app.route('/api/services', methods=['GET'])
 def services_get():
+    if "ids" in request.args:
+        return _catalog_details_response("service")
+    if CATALOG_QUERY_PARAMS.intersection(request.args):
+        return _catalog_query_response("service")
     log("Received request for services list", "INFO")
+    payload = catalog_snapshot("services", _load_services_json)
+    log(f"Returning services list ({len(payload)} bytes, catalog version {catalog_version()})", "SUCCESS")
+    return catalog_response(payload)
+
+def _load_services_json() -> bytes:
     conn = db()
     cur = conn.cursor()
     log("Executing SQL to fetch services with first image", "INFO")
@@ -658,23 +1938,233 @@ def services_get():
         SELECT
             s.id, s.name, s.bio, s.price, s.discount_price,
             s.active,
-            (
-                SELECT si.image_path
-                  FROM service_images si
-                 WHERE si.service_id = s.id
-                 ORDER BY si.sort_order ASC, si.id ASC
-                 LIMIT 1
-            ) AS image_url
+            s.primary_image AS image_url, s.image_count,
+            """ + LISTING_IMAGE_META_SQL + """
         FROM services s
+        LEFT JOIN image_meta m ON m.path = s.primary_image
         WHERE s.active=1
     """)
     rows = cur.fetchall()
     log(f"Fetched {len(rows)} services from database", "SUCCESS")
     conn.close()
     log("Closed database connection for services_get", "INFO")
-    result = [row_to_service(r) for r in rows]
-    log(f"Returning services list: {result}", "SUCCESS")
-    return jsonify(result)
+    return SERVICE_LIST_JSON.encode_rows(rows)
+
+# ----------------------------
+# Filtered / sorted listings
+# ----------------------------
+# ?sort=price|-price|id|-id|name|-name, ?min_price=, ?max_price= (on the
+# effective_price column, i.e. the discount when it's lower), flag filters
+# like ?sold_out=0&limited_edition=1, and ?offset=/?limit= paging. Answered
+# from a catalogstore.CompactCatalog built once per catalog version and kept
+# per worker (arrays + interned strings, not a dict per row). Only with
+# CATALOG_CACHE=0 do they run in SQL (the effective_price indexes). Same JSON
+# shape as the plain listing; the match count goes in X-Total-Count.
+
+CATALOG_QUERY_FLAGS = {"product": ("limited_edition", "sold_out"), "service": ("active",)}
+CATALOG_QUERY_PARAMS = frozenset(("sort", "min_price", "max_price", "offset", "limit",
+                                  *CATALOG_QUERY_FLAGS["product"], *CATALOG_QUERY_FLAGS["service"]))
+CATALOG_QUERY_SQL = {
+    "product": (
+        "SELECT p.id, p.name, p.bio, p.price, p.discount_price, p.effective_price, p.limited_edition, p.sold_out, "
+        + LISTING_IMAGE_META_SQL + " FROM products p LEFT JOIN image_meta m ON m.path = p.primary_image ORDER BY p.id",
+        "SELECT product_id, image_path FROM product_images ORDER BY product_id, sort_order, id",
+    ),
+    "service": (
+        "SELECT s.id, s.name, s.bio, s.price, s.discount_price, s.effective_price, s.active, "
+        + LISTING_IMAGE_META_SQL + " FROM services s LEFT JOIN image_meta m ON m.path = s.primary_image"
+        " WHERE s.active=1 ORDER BY s.id",
+        "SELECT service_id, image_path FROM service_images"
+        " WHERE service_id IN (SELECT id FROM services WHERE active=1) ORDER BY service_id, sort_order, id",
+    ),
+}
+CATALOG_LIST_JSON = {"product": PRODUCT_LIST_JSON, "service": SERVICE_LIST_JSON}
+
+def _load_compact_catalog(kind: str) -> catalogstore.CompactCatalog:
+    t0 = time.perf_counter()
+    items_sql, images_sql = CATALOG_QUERY_SQL[kind]
+    with closing(db()) as conn:
+        cat = catalogstore.CompactCatalog.build(conn.execute(items_sql), conn.execute(images_sql),
+                                                CATALOG_QUERY_FLAGS[kind], image_meta=True)
+    log(f"Built compact {kind} catalog: {len(cat)} items, {len(cat.image_paths)} images, "
+        f"~{cat.nbytes() / 1e6:.1f} MB in {(time.perf_counter() - t0) * 1000:.0f} ms", "INFO")
+    return cat
+
+CATALOG_SQL_ORDER = {
+    "id": "t.id", "-id": "t.id DESC",
+    "price": "t.effective_price, t.id", "-price": "t.effective_price DESC, t.id DESC",
+    "name": "t.name COLLATE NOCASE, t.id", "-name": "t.name COLLATE NOCASE DESC, t.id DESC",
+}
+
+def _query_catalog_sql(kind: str, sort: str, flags: dict, offset: int, limit: int,
+                       min_price=None, max_price=None) -> tuple[int, list]:
+    """Same result as CompactCatalog.select() + rows(), from SQL (CATALOG_CACHE=0). Price filters/sorts use the effective_price index."""
+    table = CATALOG_KINDS[kind]["table"]
+    where, params = ["t.active=1"] if kind == "service" else [], []
+    if min_price is not None:
+        where.append("t.effective_price >= ?")
+        params.append(min_price)
+    if max_price is not None:
+        where.append("t.effective_price <= ?")
+        params.append(max_price)
+    for name, on in flags.items():
+        where.append(f"(IFNULL(t.{name}, 0) != 0) = ?")
+        params.append(int(on))
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+    columns = ", ".join(f"t.{c}" for c in ("id", "name", "bio", "price", "discount_price", *CATALOG_QUERY_FLAGS[kind],
+                                            "primary_image", "image_count"))
+    with closing(db()) as conn:
+        total = conn.execute(f"SELECT COUNT(*) FROM {table} t {where_sql}", params).fetchone()[0]
+        rows = conn.execute(f"SELECT {columns}, {LISTING_IMAGE_META_SQL} FROM {table} t "
+                            f"LEFT JOIN image_meta m ON m.path = t.primary_image {where_sql} "
+                            f"ORDER BY {CATALOG_SQL_ORDER[sort]} LIMIT ? OFFSET ?", (*params, limit, offset)).fetchall()
+    return total, rows
+
+def _parse_catalog_query(kind: str) -> dict:
+    args = request.args
+    sort = args.get("sort", "id")
+    if sort not in CATALOG_SQL_ORDER:  # exact: "--price" is neither price nor -price
+        raise ValueError(f"`sort` must be one of {', '.join(catalogstore.SORT_KEYS)} (prefix - for descending)")
+    query = {"sort": sort, "flags": {}}
+    for name in ("min_price", "max_price"):
+        if args.get(name):
+            try:
+                query[name] = float(args[name])
+            except ValueError:
+                raise ValueError(f"`{name}` must be a number")
+    for name in CATALOG_QUERY_FLAGS[kind]:
+        if name in args:
+            if args[name] not in ("0", "1"):
+                raise ValueError(f"`{name}` must be 0 or 1")
+            query["flags"][name] = args[name] == "1"
+    try:
+        query["offset"] = max(0, int(args.get("offset", 0)))
+        query["limit"] = min(CATALOG_PAGE_MAX, max(1, int(args.get("limit", CATALOG_PAGE_MAX))))
+    except ValueError:
+        raise ValueError("`offset` and `limit` must be integers")
+    return query
+
+def _catalog_query_response(kind: str):
+    try:
+        query = _parse_catalog_query(kind)
+    except ValueError as e:
+        log(f"Bad {kind} listing query: {e}", "WARNING")
+        return jsonify({"error": str(e)}), 400
+    if CATALOG_CACHE_ENABLED:
+        cat = catalog_cached(f"compact:{kind}", lambda: _load_compact_catalog(kind))
+        total, page = cat.select(**query)
+        rows = cat.rows(page)
+    else:
+        total, rows = _query_catalog_sql(kind, **query)
+        page = rows
+    log(f"Returning {len(page)} of {total} {kind}s for query {query}", "SUCCESS")
+    response = Response(CATALOG_LIST_JSON[kind].encode_rows(rows), mimetype="application/json")
+    response.headers["X-Total-Count"] = str(total)
+    return response
+
+# ----------------------------
+# Storefront bootstrap
+# ----------------------------
+# Everything the storefront needs for its first paint in one response:
+# catchphrases, the first page of products and services, and the PayPal
+# client config. Each section has its own version; the ETag is derived from
+# them, so If-None-Match is answered with a 304 without touching the DB.
+# ?versions=products:7,catchphrases:3f2a... returns null for sections the
+# client already has at that version (listed under "unchanged").
+
+BOOTSTRAP_SECTIONS = ("catchphrases", "products", "services", "paypal")
+
+def _content_version(obj) -> str:
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+CATCHPHRASES_VERSION = _content_version([UPPHRASES, DOWNPHRASES])
+
+def _paypal_public_config():
+    if not PAYPAL_CLIENT_ID:
+        return None
+    return {"client_id": PAYPAL_CLIENT_ID, "currency": CURRENCY, "env": PAYPAL_ENV}
+
+def bootstrap_versions() -> dict:
+    return {
+        "catchphrases": CATCHPHRASES_VERSION,
+        "products": catalog_version(),
+        "services": catalog_version(),
+        "paypal": _content_version(_paypal_public_config()),
+    }
+
+def _first_page(kind: str, limit: int) -> dict:
+    if kind == "product":
+        sql = """
+            SELECT p.id, p.name, p.bio, p.price, p.discount_price,
+                   p.limited_edition, p.sold_out,
+                   p.primary_image AS image_url, p.image_count,
+                   """ + LISTING_IMAGE_META_SQL + """
+              FROM products p
+              LEFT JOIN image_meta m ON m.path = p.primary_image
+             ORDER BY p.id
+             LIMIT ?
+        """
+        count_sql, row_json = "SELECT COUNT(*) FROM products", PRODUCT_LIST_JSON
+    else:
+        sql = """
+            SELECT s.id, s.name, s.bio, s.price, s.discount_price,
+                   s.active,
+                   s.primary_image AS image_url, s.image_count,
+                   """ + LISTING_IMAGE_META_SQL + """
+              FROM services s
+              LEFT JOIN image_meta m ON m.path = s.primary_image
+             WHERE s.active=1
+             ORDER BY s.id
+             LIMIT ?
+        """
+        count_sql, row_json = "SELECT COUNT(*) FROM services WHERE active=1", SERVICE_LIST_JSON
+    with closing(db()) as conn:
+        rows = conn.execute(sql, (limit,)).fetchall()
+        total = conn.execute(count_sql).fetchone()[0]
+    return {"items": [row_json.to_dict(r) for r in rows], "total": total, "has_more": total > len(rows)}
+
+def _build_bootstrap(versions: dict, page_size: int, skip: set) -> bytes:
+    sections = {
+        "catchphrases": lambda: {"upphrases": UPPHRASES, "downphrases": DOWNPHRASES},
+        "products": lambda: _first_page("product", page_size),
+        "services": lambda: _first_page("service", page_size),
+        "paypal": _paypal_public_config,
+    }
+    body = {"versions": versions, "page_size": page_size, "unchanged": sorted(skip)}
+    for name in BOOTSTRAP_SECTIONS:
+        body[name] = None if name in skip else sections[name]()
+    return serializer.dumps(body)
+
+@app.route('/api/bootstrap', methods=['GET'])
+def bootstrap():
+    try:
+        page_size = min(max(int(request.args.get("page_size", BOOTSTRAP_PAGE_SIZE)), 1), CATALOG_IDS_MAX)
+    except ValueError:
+        return jsonify({"error": "`page_size` must be an integer"}), 400
+    versions = bootstrap_versions()
+    etag = "b-" + _content_version([versions, page_size])
+
+    skip = set()
+    for part in (request.args.get("versions") or "").split(","):
+        name, _, version = part.strip().partition(":")
+        if name in versions and version == str(versions[name]):
+            skip.add(name)
+
+    if not skip and request.if_none_match.contains_weak(etag):
+        log(f"Bootstrap not modified (etag {etag})", "INFO")
+        response = Response(status=304)
+    elif skip:
+        log(f"Building partial bootstrap, client already has: {', '.join(sorted(skip))}", "INFO")
+        response = catalog_response(compression.Payload(_build_bootstrap(versions, page_size, skip), _DYNAMIC_LEVELS))
+    else:
+        payload = catalog_snapshot(f"bootstrap:{page_size}:{versions['paypal']}",
+                                   lambda: _build_bootstrap(versions, page_size, set()))
+        log(f"Returning bootstrap ({len(payload)} bytes, versions {versions})", "SUCCESS")
+        response = catalog_response(payload)
+    if not skip:
+        response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "no-cache"  # keep it, but revalidate (cheap: 304 from the ETag)
+    return response
 
 @app.route('/api/auth/signup', methods=['POST'])
 def auth_signup():
@@ -705,7 +2195,7 @@ def auth_signup():
     except sqlite3.IntegrityError:
         log(f"Signup failed: email {email} already registered", "WARNING")
         return jsonify({"error": "email already registered"}), 409
-    token = sign_token({"role": "user", "user_id": user_id}, exp_seconds=60 * 60 * 24 * 7)
+    token = issue_user_token(user_id)
     log(f"Generated signup token for user_id={user_id}", "SUCCESS")
     return jsonify({"token": token, "user_id": user_id}), 201
 
@@ -722,7 +2212,7 @@ def auth_login():
     conn = db()
     cur = conn.cursor()
     log(f"Querying user by email: {email}", "INFO")
-    cur.execute("SELECT id, password_hash, salt FROM users WHERE email=?", (email,))
+    cur.execute("SELECT id, password_hash, salt, token_generation FROM users WHERE email=?", (email,))
     row = cur.fetchone()
     conn.close()
     log("Closed database connection after login query", "INFO")
@@ -734,10 +2224,33 @@ def auth_login():
         return jsonify({"error": "invalid credentials"}), 401
     user_id = row[0]
     log(f"Login successful for user_id={user_id}", "SUCCESS")
-    token = sign_token({"role": "user", "user_id": user_id}, exp_seconds=60 * 60 * 24 * 7)
+    token = issue_user_token(user_id, row[3])
     log(f"Generated login token for user_id={user_id}", "SUCCESS")
     return jsonify({"token": token, "user_id": user_id})
 
+@app.route('/api/auth/logout', methods=['POST'])
+@require_user
+def auth_logout():
+    """Revoke the token used for this request; {"all": true} revokes every token of the user."""
+    data = request.get_json(silent=True) or {}
+    everywhere = bool(data.get("all")) or request.args.get("all") == "1"
+    claims = request.token_claims
+    log(f"Received logout request for user_id={request.user_id} (all={everywhere})", "INFO")
+    with closing(db()) as conn:
+        if everywhere:
+            generation = TOKEN_REVOCATIONS.revoke_user(conn, request.user_id, TOKEN_TTL_SECONDS)
+            TOKENS_REVOKED.inc(("logout_all",))
+            log(f"Revoked all tokens of user_id={request.user_id}, token generation now {generation}", "SUCCESS")
+            return jsonify({"ok": True, "revoked": "all"})
+        if not claims.get("jti"):
+            # Issued before tokens had an id: can only be revoked together with all others
+            log(f"Logout with a legacy token (no jti) for user_id={request.user_id}", "WARNING")
+            return jsonify({"ok": True, "revoked": None, "hint": "legacy token, use {\"all\": true}"})
+        TOKEN_REVOCATIONS.revoke_token(conn, claims["jti"], request.user_id, claims["exp"])
+    TOKENS_REVOKED.inc(("logout",))
+    log(f"Revoked token jti={claims['jti']} of user_id={request.user_id}", "SUCCESS")
+    return jsonify({"ok": True, "revoked": "token"})
+
 @app.route('/api/auth/me', methods=['GET'])
 @require_user
 def auth_me():
@@ -822,13 +2335,273 @@ def user_profile_put():
             return jsonify({"error": "current password incorrect"}), 403
         new_hash, new_salt = hash_password(new_password)
         cur.execute("UPDATE users SET password_hash=?, salt=? WHERE id=?", (new_hash, new_salt, request.user_id))
-        conn.commit()
-        log(f"Password updated for user_id={request.user_id}", "SUCCESS")
+        # Every session with the old password ends here, this one gets a fresh token.
+        # Commits the new password together with the revocation.
+        generation = TOKEN_REVOCATIONS.revoke_user(conn, request.user_id, TOKEN_TTL_SECONDS)
+        TOKENS_REVOKED.inc(("password_change",))
+        log(f"Password updated for user_id={request.user_id}, older tokens revoked (generation {generation})", "SUCCESS")
+        conn.close()
+        return jsonify({"ok": True, "token": issue_user_token(request.user_id, generation)})
 
     conn.close()
     log(f"User profile update completed for user_id={request.user_id}", "SUCCESS")
     return jsonify({"ok": True})
 
+# ----------------------------
+# Order history
+# ----------------------------
+# Newest first, keyset-paginated: ?before=<id of the last order on the
+# previous page> (next_before in the response) instead of OFFSET, so page
+# 100 costs the same as page 1 - it's a range scan on orders(user_id, id).
+# The page's line items come from the same statement (one join), however
+# many orders and items there are.
+
+USER_ORDERS_SQL = """
+    WITH page AS (
+        SELECT id, status, shipping_date, created_at, currency, subtotal, discount, total
+          FROM orders
+         WHERE user_id = ? AND id < ?
+         ORDER BY id DESC
+         LIMIT ?
+    )
+    SELECT page.id, page.status, page.shipping_date, page.created_at, page.currency,
+           page.subtotal, page.discount, page.total,
+           i.kind, COALESCE(i.product_id, i.service_id), i.name, i.unit_price, i.qty, i.image_url
+      FROM page
+      LEFT JOIN order_items i ON i.order_id = page.id
+     ORDER BY page.id DESC, i.id
+"""
+ORDER_KEYS = ("id", "status", "shipping_date", "created_at", "currency", "subtotal", "discount", "total")
+ORDER_ITEM_KEYS = ("kind", "item_id", "name", "unit_price", "qty", "image_url")
+
+def group_order_rows(rows, order_keys=ORDER_KEYS) -> list:
+    """Join rows (order_keys + ORDER_ITEM_KEYS, sorted by order) -> [{...order, items: [...]}]."""
+    orders = []
+    n = len(order_keys)
+    for row in rows:
+        if not orders or orders[-1]["id"] != row[0]:
+            orders.append({**dict(zip(order_keys, row[:n])), "items": []})
+        if row[n] is not None:  # LEFT JOIN: order without items
+            orders[-1]["items"].append(dict(zip(ORDER_ITEM_KEYS, row[n:])))
+    return orders
+
+@app.route('/api/user/orders', methods=['GET'])
+@require_user
+def user_orders():
+    log(f"Received order history request for user_id={request.user_id}", "INFO")
+    try:
+        limit = min(ORDERS_PAGE_MAX, max(1, int(request.args.get("limit", ORDERS_PAGE_SIZE))))
+        before = int(request.args.get("before") or 2**63 - 1)
+    except ValueError:
+        log("Bad order history paging parameters", "WARNING")
+        return jsonify({"error": "`limit` and `before` must be integers"}), 400
+    with closing(db()) as conn:
+        # one extra order tells whether there's a next page
+        orders = group_order_rows(conn.execute(USER_ORDERS_SQL, (request.user_id, before, limit + 1)))
+    has_more = len(orders) > limit
+    orders = orders[:limit]
+    log(f"Returning {len(orders)} orders for user_id={request.user_id} (before={before}, more={has_more})", "SUCCESS")
+    return jsonify({"orders": orders, "next_before": orders[-1]["id"] if has_more else None})
+
+# ----------------------------
+# Fulfillment queue (admin)
+# ----------------------------
+# GET /api/admin/orders?status=ordered lists one status oldest first, paged
+# with ?after=<last id> on orders(status, id), with the customer's contact
+# details and the line items (same single join as the order history).
+# POST /api/admin/orders/status moves a batch forward (ordered -> confirmed
+# -> shipped -> delivered, steps may be skipped) in one transaction. Orders
+# that can't make the move are reported back and left alone; they don't
+# fail the rest of the batch.
+
+ADMIN_ORDERS_SQL = """
+    WITH page AS (
+        SELECT id, status, shipping_date, created_at, currency, subtotal, discount, total, user_id
+          FROM orders
+         WHERE status = ? AND id > ?
+         ORDER BY id
+         LIMIT ?
+    )
+    SELECT page.id, page.status, page.shipping_date, page.created_at, page.currency,
+           page.subtotal, page.discount, page.total, page.user_id, u.email, u.username, u.phone, u.address,
+           i.kind, COALESCE(i.product_id, i.service_id), i.name, i.unit_price, i.qty, i.image_url
+      FROM page
+      LEFT JOIN users u ON u.id = page.user_id
+      LEFT JOIN order_items i ON i.order_id = page.id
+     ORDER BY page.id, i.id
+"""
+ADMIN_ORDER_KEYS = ORDER_KEYS + ("user_id", "email", "username", "phone", "address")
+ORDER_STATUSES = init_db.ORDER_STATUSES
+
+@app.route('/api/admin/orders', methods=['GET'])
+@require_admin
+def admin_orders():
+    status = request.args.get("status", ORDER_STATUSES[0])
+    log(f"Received fulfillment queue request: status={status}", "INFO")
+    if status not in ORDER_STATUSES:
+        log(f"Unknown order status requested: {status}", "WARNING")
+        return jsonify({"error": f"`status` must be one of {', '.join(ORDER_STATUSES)}"}), 400
+    try:
+        limit = min(ORDERS_PAGE_MAX, max(1, int(request.args.get("limit", ORDERS_PAGE_MAX))))
+        after = int(request.args.get("after") or 0)
+    except ValueError:
+        log("Bad fulfillment queue paging parameters", "WARNING")
+        return jsonify({"error": "`limit` and `after` must be integers"}), 400
+    with closing(db()) as conn:
+        orders = group_order_rows(conn.execute(ADMIN_ORDERS_SQL, (status, after, limit + 1)), ADMIN_ORDER_KEYS)
+        # covered by idx_orders_status_id, no table access
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM orders GROUP BY status"))
+    has_more = len(orders) > limit
+    orders = orders[:limit]
+    log(f"Returning {len(orders)} '{status}' orders (after={after}, more={has_more})", "SUCCESS")
+    return jsonify({"orders": orders, "next_after": orders[-1]["id"] if has_more else None,
+                    "counts": {s: counts.get(s, 0) for s in ORDER_STATUSES}})
+
+def change_order_status(conn, ids: list, status: str, shipping_date=None) -> dict:
+    """
+    Move orders `ids` forward to `status` (caller has checked it's in ORDER_STATUSES). One UPDATE; the
+    step is checked in its WHERE so nothing can hit the CHECK constraint. Setting "shipped" stamps
+    shipping_date (given or today) unless one is set already. Returns {"updated", "unchanged",
+    "invalid": {id: current status}, "not_found"}. Caller commits.
+    """
+    earlier = ORDER_STATUSES[:ORDER_STATUSES.index(status)]
+    if status == "shipped":
+        date_sql, params = "COALESCE(shipping_date, COALESCE(?, date('now')))", [shipping_date]
+    else:
+        date_sql, params = "COALESCE(?, shipping_date)", [shipping_date]
+    marks = ",".join("?" * len(earlier))
+    updated = [r[0] for r in conn.execute(f"""
+        UPDATE orders SET status = ?, shipping_date = {date_sql}
+         WHERE id IN (SELECT value FROM json_each(?)) AND status IN ({marks or 'NULL'})
+        RETURNING id
+    """, (status, *params, json.dumps(ids), *earlier))]
+    done = set(updated)
+    current = dict(conn.execute("SELECT id, status FROM orders WHERE id IN (SELECT value FROM json_each(?))",
+                                (json.dumps([i for i in ids if i not in done]),)))
+    return {
+        "updated": sorted(done),
+        "unchanged": sorted(i for i, s in current.items() if s == status),
+        "invalid": {i: s for i, s in sorted(current.items()) if s != status},
+        "not_found": sorted(set(ids) - done - set(current)),
+    }
+
+@app.route('/api/admin/orders/status', methods=['POST'])
+@require_admin
+def admin_orders_status():
+    """Expects: { ids: [1, 2, ...], status: "shipped", shipping_date: "YYYY-MM-DD" (optional) }"""
+    data = request.get_json(force=True, silent=True) or {}
+    log(f"Received bulk order status change: {data}", "INFO")
+    status = data.get("status")
+    shipping_date = data.get("shipping_date")
+    ids = data.get("ids")
+    if status not in ORDER_STATUSES:
+        return jsonify({"error": f"`status` must be one of {', '.join(ORDER_STATUSES)}"}), 400
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        return jsonify({"error": "`ids` must be a non-empty list of order ids"}), 400
+    if len(ids) > ORDERS_BULK_MAX:
+        return jsonify({"error": f"too many ids (max {ORDERS_BULK_MAX})"}), 400
+    if shipping_date is not None:
+        try:
+            shipping_date = datetime.strptime(shipping_date, "%Y-%m-%d").date().isoformat()
+        except (TypeError, ValueError):
+            return jsonify({"error": "`shipping_date` must be YYYY-MM-DD"}), 400
+    ids = list(dict.fromkeys(ids))
+
+    conn = db()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        result = change_order_status(conn, ids, status, shipping_date)
+        conn.commit()
+    except Exception as e:
+        log(f"Bulk order status change failed: {e}", "ERROR")
+        return jsonify({"error": "failed to update orders"}), 500
+    finally:
+        conn.close()
+    ORDER_STATUS_CHANGES.inc((status, "updated"), len(result["updated"]))
+    ORDER_STATUS_CHANGES.inc((status, "invalid"), len(result["invalid"]))
+    level = "SUCCESS" if not result["invalid"] and not result["not_found"] else "WARNING"
+    log(f"Orders -> {status}: {len(result['updated'])} updated, {len(result['unchanged'])} unchanged, "
+        f"{len(result['invalid'])} invalid step, {len(result['not_found'])} not found", level)
+    return jsonify(result)
+
+# ----------------------------
+# Sales analytics (admin)
+# ----------------------------
+# Answered from the summary tables in analytics.py (one row per day / item /
+# discount code), kept current by complete_checkout() and save_checkout().
+# ?from=YYYY-MM-DD&to=YYYY-MM-DD (UTC days, inclusive; default: the last
+# ANALYTICS_DEFAULT_DAYS days). Cost depends on the range, not on history.
+
+def _analytics_range() -> tuple[str, str]:
+    try:
+        end = datetime.strptime(request.args["to"], "%Y-%m-%d").date() if request.args.get("to") \
+            else datetime.now(timezone.utc).date()
+        start = datetime.strptime(request.args["from"], "%Y-%m-%d").date() if request.args.get("from") \
+            else end - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    except ValueError:
+        raise ValueError("`from` and `to` must be YYYY-MM-DD")
+    if start > end:
+        raise ValueError("`from` is after `to`")
+    return start.isoformat(), end.isoformat()
+
+def _analytics_response(name: str, build):
+    try:
+        start, end = _analytics_range()
+    except ValueError as e:
+        log(f"Bad analytics range for {name}: {e}", "WARNING")
+        return jsonify({"error": str(e)}), 400
+    t0 = time.perf_counter()
+    with closing(db()) as conn:
+        body = build(conn, start, end)
+    log(f"Analytics {name} {start}..{end} answered in {(time.perf_counter() - t0) * 1000:.1f} ms", "SUCCESS")
+    return jsonify({"from": start, "to": end, **body})
+
+@app.route('/api/admin/analytics/summary', methods=['GET'])
+@require_admin
+def admin_analytics_summary():
+    """Totals for the range plus one row per day (sales, checkouts, conversion)."""
+    return _analytics_response("summary", lambda conn, start, end: {
+        "totals": analytics.totals(conn, start, end), "daily": analytics.daily(conn, start, end)})
+
+@app.route('/api/admin/analytics/items', methods=['GET'])
+@require_admin
+def admin_analytics_items():
+    """Best sellers over the range; ?by=day for revenue per item per day. ?kind=product|service, ?limit="""
+    kind = request.args.get("kind") or None
+    if kind not in (None, "product", "service"):
+        return jsonify({"error": "`kind` must be product or service"}), 400
+    try:
+        limit = min(1000, max(1, int(request.args.get("limit", 50))))
+    except ValueError:
+        return jsonify({"error": "`limit` must be an integer"}), 400
+    by_day = request.args.get("by") == "day"
+    return _analytics_response("items", lambda conn, start, end: {
+        "items": analytics.items(conn, start, end, kind=kind, limit=limit, by_day=by_day)})
+
+@app.route('/api/admin/analytics/discounts', methods=['GET'])
+@require_admin
+def admin_analytics_discounts():
+    return _analytics_response("discounts", lambda conn, start, end: {
+        "codes": analytics.discounts(conn, start, end)})
+
+@app.route('/api/admin/analytics/rebuild', methods=['POST'])
+@require_admin
+def admin_analytics_rebuild():
+    """Recompute the summary tables from checkouts (same as `py analytics.py rebuild`)."""
+    log("Received request to rebuild sales summaries", "INFO")
+    conn = db()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        info = analytics.rebuild(conn)
+        conn.commit()
+    except Exception as e:
+        log(f"Sales summary rebuild failed: {e}", "ERROR")
+        return jsonify({"error": "rebuild failed"}), 500
+    finally:
+        conn.close()
+    log(f"Sales summaries rebuilt: {info}", "SUCCESS")
+    return jsonify(info)
+
 @app.route('/api/upload/image', methods=['POST'])
 @require_admin
 def upload_image():
@@ -846,13 +2619,8 @@ def upload_image():
     if ext not in ALLOWED_EXT:
         log(f"Unsupported file type: {ext}", "WARNING")
         return jsonify({"error": "unsupported file type"}), 415
-    f.seek(0, os.SEEK_END)
-    size = f.tell()
-    f.seek(0)
-    log(f"Uploaded file size: {size} bytes", "INFO")
-    if size > MAX_UPLOAD_MB * 1024 * 1024:
-        log(f"File too large: {size} bytes (limit: {MAX_UPLOAD_MB}MB)", "WARNING")
-        return jsonify({"error": f"file too large (>{MAX_UPLOAD_MB}MB)"}), 413
+    # Size is already capped by MAX_CONTENT_LENGTH while the body streams in (413 from _request_too_large)
+    log(f"Upload request size: {request.content_length} bytes", "INFO")
 
     ts = int(time.time())
     out_name = f"{ts}_{name}"
@@ -860,78 +2628,48 @@ def upload_image():
     log(f"Saving image to: {out_path}", "INFO")
     try:
         if PIL_AVAILABLE:
-            img = Image.open(f.stream)
-            log(f"Opened image with Pillow: mode={img.mode}, size={img.size}", "INFO")
-            # Normalize mode and drop EXIF by re-saving
-            if img.mode not in ("RGB", "RGBA"):
+            # Normalize mode, resize down if wider than 1600px and drop EXIF by re-saving
+            img = decode_upload_image(f.stream, 1600, modes=("RGB", "RGBA"))
+            if ext in (".jpg", ".jpeg") and img.mode == "RGBA":
                 img = img.convert("RGB")
-                log("Converted image mode to RGB", "INFO")
-            # Resize down if very large
-            max_w = 1600
-            if img.width > max_w:
-                ratio = max_w / float(img.width)
-                new_size = (max_w, int(img.height * ratio))
-                img = img.resize(new_size)
-                log(f"Resized image to {new_size}", "INFO")
             # Format inferred from extension; EXIF not passed => stripped
             img.save(out_path, optimize=True, quality=85)
             log(f"Image uploaded and processed: {out_name}", "SUCCESS")
+            meta = record_image_meta(f"/static/uploads/{out_name}", img, out_path)
         else:
             # Fallback: raw save (metadata may remain)
             f.save(out_path)
+            meta = None
             log(f"Image uploaded without processing of metadata, data might persist (Pillow not installed): {out_name}", "WARNING")
+    except ImageTooLarge as e:
+        log(f"Upload refused: {e}", "WARNING")
+        return jsonify({"error": "image dimensions too large"}), 413
     except Exception as e:
         log(f"Upload processing failed: {e}", "ERROR")
         return jsonify({"error": "failed to process image"}), 500
 
     rel_url = f"/static/uploads/{out_name}"
     log(f"Image successfully saved: {rel_url}", "SUCCESS")
-    return jsonify({"image_url": rel_url}), 201
+    return jsonify({"image_url": rel_url, "meta": meta}), 201
 
 @app.route('/api/products', methods=['POST'])
 @require_admin
 def products_create():
     log("Received request to create new product", "INFO")
     data = request.get_json(force=True)
-    name = data.get('name')
-    price = data.get('price')
-    bio = data.get('bio')
-    discount_price = data.get('discount_price')
-    limited = int(bool(data.get('limited_edition', 0)))
-    sold_out = int(bool(data.get('sold_out', 0)))
-    images = data.get('images') or []
-    if not images and data.get('image_url'):
-        images = [data['image_url']]
-
-    log(f"Product data: name={name}, price={price}, bio={bio}, discount_price={discount_price}, limited_edition={limited}, sold_out={sold_out}, images={images}", "INFO")
-
-    if not name or price is None:
-        log("Missing required fields for product creation", "WARNING")
-        return jsonify({"error": "`name` and `price` are required"}), 400
+    log(f"Product data: {data}", "INFO")
 
     conn = db()
     try:
-        conn.execute("PRAGMA foreign_keys = ON")  # enable FK (SQLite quirk)
         cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO products (name, bio, price, discount_price, limited_edition, sold_out)
-            VALUES (?,?,?,?,?,?)
-        """, (name, bio, price, discount_price, limited, sold_out))
-        new_id = cur.lastrowid
-        log(f"Inserted new product with id {new_id}", "SUCCESS")
-
-        if images:
-            cur.executemany(
-                "INSERT INTO product_images (product_id, image_path, alt_text, sort_order) VALUES (?,?,?,?)",
-                [(new_id, p, None, i) for i, p in enumerate(images)]
-            )
-            log(f"Inserted images for product {new_id}: {images}", "SUCCESS")
-        else:
-            log(f"No images provided for product {new_id}", "INFO")
-
+        new_id = catalog_insert(cur, "product", data)
         conn.commit()
+        invalidate_catalog(f"product {new_id} created")
         log(f"Product {new_id} created successfully", "SUCCESS")
         return jsonify({"id": new_id}), 201
+    except ValueError as e:
+        log(f"Invalid product creation request: {e}", "WARNING")
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         log(f"Error creating product: {e}", "ERROR")
         return jsonify({"error": "failed to create product"}), 500
@@ -944,64 +2682,22 @@ def products_create():
 def products_update(pid):
     log(f"Received request to update product {pid}", "INFO")
     data = request.get_json(force=True)
-    field_map = {
-        "name": "name",
-        "bio": "bio",
-        "price": "price",
-        "discount_price": "discount_price",
-        "limited_edition": "limited_edition",
-        "sold_out": "sold_out",
-    }
-
-    fields, values = [], []
-    for key, col in field_map.items():
-        if key in data:
-            if key in ("limited_edition", "sold_out"):
-                fields.append(f"{col}=?")
-                values.append(int(bool(data[key])))
-                log(f"Field '{col}' set to {int(bool(data[key]))}", "INFO")
-            else:
-                fields.append(f"{col}=?")
-                values.append(data[key])
-                log(f"Field '{col}' set to {data[key]}", "INFO")
-
-    replace_images = None
-    if "images" in data:
-        replace_images = data.get("images") or []
-        log(f"Images to replace: {replace_images}", "INFO")
-    elif "image_url" in data:
-        replace_images = [data["image_url"]] if data["image_url"] else []
-        log(f"Image_url to replace: {replace_images}", "INFO")
-
-    if not fields and replace_images is None:
-        log(f"No fields or images to update for product {pid}", "WARNING")
-        return jsonify({"error": "no fields to update"}), 400
+    log(f"Product {pid} update data: {data}", "INFO")
 
     conn = db()
     try:
-        conn.execute("PRAGMA foreign_keys = ON")
         cur = conn.cursor()
-
-        if fields:
-            values.append(pid)
-            cur.execute(f"UPDATE products SET {', '.join(fields)} WHERE id=?", values)
-            log(f"Updated fields for product {pid}: {fields}", "SUCCESS")
-
-        if replace_images is not None:
-            cur.execute("DELETE FROM product_images WHERE product_id=?", (pid,))
-            log(f"Deleted old images for product {pid}", "INFO")
-            if replace_images:
-                cur.executemany(
-                    "INSERT INTO product_images (product_id, image_path, alt_text, sort_order) VALUES (?,?,?,?)",
-                    [(pid, p, None, i) for i, p in enumerate(replace_images)]
-                )
-                log(f"Inserted new images for product {pid}: {replace_images}", "SUCCESS")
-            else:
-                log(f"No new images provided for product {pid}", "INFO")
-
+        found = catalog_update(cur, "product", pid, data)
         conn.commit()
+        if not found:
+            log(f"Product {pid} not found, nothing updated", "WARNING")
+            return jsonify({"ok": True})
+        invalidate_catalog(f"product {pid} updated")
         log(f"Product {pid} updated successfully", "SUCCESS")
         return jsonify({"ok": True})
+    except ValueError as e:
+        log(f"No fields or images to update for product {pid}", "WARNING")
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         log(f"Error updating product {pid}: {e}", "ERROR")
         return jsonify({"error": "failed to update product"}), 500
@@ -1015,10 +2711,10 @@ def products_delete(pid):
     log(f"Received request to delete product {pid}", "INFO")
     conn = db()
     try:
-        conn.execute("PRAGMA foreign_keys = ON")
         cur = conn.cursor()
-        cur.execute("DELETE FROM products WHERE id=?", (pid,))
-        conn.commit()
+        if catalog_delete(cur, "product", pid):
+            conn.commit()
+            invalidate_catalog(f"product {pid} deleted")
         log(f"Product {pid} deleted successfully", "SUCCESS")
         return jsonify({"ok": True})
     except Exception as e:
@@ -1028,50 +2724,375 @@ def products_delete(pid):
         conn.close()
         log(f"Database connection closed for product delete {pid}", "INFO")
 
+# ----------------------------
+# Bulk catalog import/export
+# ----------------------------
+# Import streams the upload (CSV with a header row, or NDJSON with one object
+# per line) and writes it in IMPORT_CHUNK_ROWS-sized transactions using
+# executemany. If a chunk hits a DB error it is replayed row by row under
+# SAVEPOINTs, so one bad row only costs itself. Export streams straight off
+# a cursor, EXPORT_FETCH_ROWS at a time.
+
+PRODUCT_IMPORT_COLUMNS = ("name", "bio", "price", "discount_price", "limited_edition", "sold_out", "almost_sold_out")
+PRODUCT_EXPORT_FIELDS = ("id",) + PRODUCT_IMPORT_COLUMNS + ("images",)
+_IMPORT_FLAGS = ("limited_edition", "sold_out", "almost_sold_out")
+
+def _parse_flag(value) -> int:
+    if value is None or value == "":
+        return 0
+    if isinstance(value, bool):
+        return int(value)
+    text = str(value).strip().lower()
+    if text in ("1", "true", "yes", "y"):
+        return 1
+    if text in ("0", "false", "no", "n"):
+        return 0
+    raise ValueError(f"invalid flag {value!r}")
+
+def _parse_price(value, field: str, required: bool):
+    if value is None or value == "":
+        if required:
+            raise ValueError(f"`{field}` is required")
+        return None
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"`{field}` must be a number, got {value!r}")
+    if price < 0 or price != price:
+        raise ValueError(f"`{field}` must be >= 0")
+    return price
+
+def _parse_import_row(raw: dict, from_csv: bool) -> dict:
+    """
+    Validate one import row. Returns {"id": int|None, "fields": {col: value}, "images": list|None}.
+    Only columns present in the row are written, so a feed with just id,sold_out is a partial update.
+    images=None leaves existing images alone; a present-but-empty value clears them.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("row must be an object")
+    unknown = set(raw) - set(PRODUCT_EXPORT_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+
+    pid = raw.get("id")
+    if pid in (None, ""):
+        pid = None
+    else:
+        try:
+            pid = int(pid)
+        except (TypeError, ValueError):
+            raise ValueError(f"`id` must be an integer, got {pid!r}")
+        if pid <= 0:
+            raise ValueError("`id` must be positive")
+
+    fields = {}
+    if "name" in raw or pid is None:
+        name = raw.get("name")
+        if not isinstance(name, str) or not name.strip():
+            raise ValueError("`name` is required")
+        fields["name"] = name.strip()
+    if "bio" in raw:
+        fields["bio"] = raw["bio"] if raw["bio"] != "" else None
+    if "price" in raw or pid is None:
+        fields["price"] = _parse_price(raw.get("price"), "price", required=True)
+    if "discount_price" in raw:
+        fields["discount_price"] = _parse_price(raw["discount_price"], "discount_price", required=False)
+    for flag in _IMPORT_FLAGS:
+        if flag in raw:
+            fields[flag] = _parse_flag(raw[flag])
+
+    images = None
+    if "images" in raw:
+        images = raw["images"]
+        if from_csv:
+            images = [p.strip() for p in (images or "").split("|") if p.strip()]
+        elif images is None:
+            images = []
+        elif not isinstance(images, list) or not all(isinstance(p, str) and p for p in images):
+            raise ValueError("`images` must be a list of paths")
+
+    if pid is not None and not fields and images is None:
+        raise ValueError("nothing to update")
+    return {"id": pid, "fields": fields, "images": images}
+
+def _iter_import_rows(stream, fmt: str):
+    """Yield (line_no, raw_row_or_None, parse_error_or_None) from a binary stream without reading it all."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="" if fmt == "csv" else None)
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for raw in reader:
+            if None in raw:
+                yield reader.line_num, None, "more values than header columns"
+                continue
+            yield reader.line_num, {k.strip(): v for k, v in raw.items() if k}, None
+        return
+    for line_no, line in enumerate(text, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_no, json.loads(line), None
+        except ValueError as e:
+            yield line_no, None, f"invalid JSON: {e}"
+
+def _apply_import_rows(cur, rows: list, existing: set) -> tuple[int, int]:
+    """Write (line, row) pairs with one executemany per column set. Returns (inserted, updated)."""
+    inserted = updated = 0
+    updates, inserts_with_id = collections.defaultdict(list), collections.defaultdict(list)
+    image_owners = []
+
+    # The same id twice in a chunk: merge into one write, later lines win (counted as an update)
+    by_id, merged = {}, []
+    for _, row in rows:
+        if row["id"] is None:
+            merged.append(row)
+            continue
+        first = by_id.get(row["id"])
+        if first is None:
+            first = by_id[row["id"]] = {**row, "fields": dict(row["fields"])}
+            merged.append(first)
+            continue
+        first["fields"].update(row["fields"])
+        if row["images"] is not None:
+            first["images"] = row["images"]
+        updated += 1
+
+    for row in merged:
+        cols = tuple(row["fields"])
+        values = tuple(row["fields"].values())
+        if row["id"] is not None and row["id"] in existing:
+            if cols:
+                updates[cols].append(values + (row["id"],))
+            updated += 1
+        elif row["id"] is not None:
+            inserts_with_id[cols].append((row["id"],) + values)
+            existing.add(row["id"])
+            inserted += 1
+        else:
+            # No id: need lastrowid for the images, so these go one by one (still one transaction)
+            cur.execute(f"INSERT INTO products ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})", values)
+            row["id"] = cur.lastrowid
+            inserted += 1
+        if row["images"] is not None:
+            image_owners.append(row)
+
+    for cols, params in updates.items():
+        cur.executemany(f"UPDATE products SET {', '.join(f'{c}=?' for c in cols)} WHERE id=?", params)
+    for cols, params in inserts_with_id.items():
+        cur.executemany(f"INSERT INTO products (id, {', '.join(cols)}) VALUES (?, {', '.join('?' * len(cols))})", params)
+
+    if image_owners:
+        cur.executemany("DELETE FROM product_images WHERE product_id=?", [(row["id"],) for row in image_owners])
+        cur.executemany(
+            "INSERT INTO product_images (product_id, image_path, alt_text, sort_order) VALUES (?,?,?,?)",
+            [(row["id"], path, None, i) for row in image_owners for i, path in enumerate(row["images"])]
+        )
+    return inserted, updated
+
+
+def _import_chunk(conn, chunk: list) -> tuple[int, int, list]:
+    """One transaction per chunk. Returns (inserted, updated, errors)."""
+    cur = conn.cursor()
+    ids = [row["id"] for _, row in chunk if row["id"] is not None]
+    cur.execute("BEGIN IMMEDIATE")
+    existing = set()
+    if ids:
+        found = cur.execute(f"SELECT id FROM products WHERE id IN ({', '.join('?' * len(ids))})", ids).fetchall()
+        existing = {r[0] for r in found}
+    try:
+        inserted, updated = _apply_import_rows(cur, [(line, dict(row)) for line, row in chunk], set(existing))
+        conn.commit()
+        return inserted, updated, []
+    except sqlite3.Error as e:
+        conn.rollback()
+        log(f"Import chunk (lines {chunk[0][0]}-{chunk[-1][0]}) failed ({e}), retrying row by row", "WARNING")
+
+    inserted = updated = 0
+    errors = []
+    cur.execute("BEGIN IMMEDIATE")
+    for line, row in chunk:
+        known = row["id"] in existing
+        cur.execute("SAVEPOINT import_row")
+        try:
+            ins, upd = _apply_import_rows(cur, [(line, dict(row))], existing)
+            cur.execute("RELEASE import_row")
+            inserted += ins
+            updated += upd
+        except sqlite3.Error as e:
+            cur.execute("ROLLBACK TO import_row")
+            cur.execute("RELEASE import_row")
+            if not known:
+                existing.discard(row["id"])
+            errors.append({"line": line, "id": row["id"], "error": str(e)})
+    conn.commit()
+    return inserted, updated, errors
+
+@app.route('/api/admin/products/import', methods=['POST'])
+@require_admin
+def admin_products_import():
+    """
+    Bulk upsert products from CSV or NDJSON. Body is either the raw file or a
+    multipart upload in field "file". ?format=csv|ndjson (default from the
+    content type / filename), ?dry_run=1 validates without writing.
+    Rows with an id update that product (or create it with that id), rows
+    without one are inserted. CSV images are "|"-separated paths.
+    """
+    # Catalog files are bigger than images: own limit, set before the body is touched
+    request.max_content_length = IMPORT_MAX_MB * 1024 * 1024
+    upload = request.files.get("file") if request.mimetype == "multipart/form-data" else None
+    stream = upload.stream if upload else request.stream
+    fmt = (request.args.get("format") or "").lower()
+    if not fmt:
+        hint = f"{request.mimetype} {upload.filename if upload else ''}".lower()
+        fmt = "ndjson" if ("ndjson" in hint or "jsonl" in hint or "json" in hint) else "csv"
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    dry_run = request.args.get("dry_run") in ("1", "true", "yes")
+    log(f"Received bulk product import (format={fmt}, dry_run={dry_run}, chunk={IMPORT_CHUNK_ROWS})", "INFO")
+
+    t0 = time.perf_counter()
+    report = {"rows": 0, "inserted": 0, "updated": 0, "failed": 0, "chunks": 0, "dry_run": dry_run}
+    errors = []
+
+    def fail(line, pid, message):
+        report["failed"] += 1
+        if len(errors) < IMPORT_MAX_ERRORS:
+            errors.append({"line": line, "id": pid, "error": message})
+
+    conn = None if dry_run else db()
+    try:
+        chunk = []
+
+        def flush():
+            ins, upd, chunk_errors = _import_chunk(conn, chunk)
+            report["inserted"] += ins
+            report["updated"] += upd
+            report["chunks"] += 1
+            for err in chunk_errors:
+                fail(err["line"], err["id"], err["error"])
+            log(f"Import chunk {report['chunks']}: {ins} inserted, {upd} updated, {len(chunk_errors)} failed", "INFO")
+            chunk.clear()
+
+        for line, raw, parse_error in _iter_import_rows(stream, fmt):
+            report["rows"] += 1
+            if parse_error:
+                fail(line, None, parse_error)
+                continue
+            try:
+                row = _parse_import_row(raw, from_csv=(fmt == "csv"))
+            except ValueError as e:
+                fail(line, (raw.get("id") or None) if isinstance(raw, dict) else None, str(e))
+                continue
+            if dry_run:
+                continue
+            chunk.append((line, row))
+            if len(chunk) >= IMPORT_CHUNK_ROWS:
+                flush()
+        if chunk:
+            flush()
+    except UnicodeDecodeError as e:
+        log(f"Bulk import aborted: upload is not UTF-8 ({e})", "ERROR")
+        return jsonify({"error": "upload must be UTF-8", **report, "errors": errors}), 400
+    except csv.Error as e:
+        log(f"Bulk import aborted: malformed CSV ({e})", "ERROR")
+        return jsonify({"error": f"malformed CSV: {e}", **report, "errors": errors}), 400
+    except Exception as e:
+        log(f"Bulk import failed after {report['rows']} rows: {e}", "ERROR")
+        return jsonify({"error": "import failed", **report, "errors": errors}), 500
+    finally:
+        if conn is not None:
+            conn.close()
+        # Committed chunks stay committed even if a later one blew up
+        if report["inserted"] or report["updated"]:
+            invalidate_catalog(f"bulk import of {report['inserted'] + report['updated']} products")
+
+    report["seconds"] = round(time.perf_counter() - t0, 3)
+    report["errors"] = errors
+    report["errors_truncated"] = report["failed"] > len(errors)
+    log(f"Bulk import done: {report['rows']} rows, {report['inserted']} inserted, {report['updated']} updated, "
+        f"{report['failed']} failed in {report['seconds']}s", "SUCCESS" if not report["failed"] else "WARNING")
+    return jsonify({"ok": report["failed"] == 0, **report})
+
+_PRODUCT_EXPORT_SQL = """
+    SELECT
+        p.id, p.name, p.bio, p.price, p.discount_price,
+        p.limited_edition, p.sold_out, p.almost_sold_out,
+        (
+            SELECT json_group_array(image_path) FROM (
+                SELECT pi.image_path FROM product_images pi
+                 WHERE pi.product_id = p.id
+                 ORDER BY pi.sort_order ASC, pi.id ASC
+            )
+        ) AS images
+    FROM products p
+    ORDER BY p.id
+"""
+
+@app.route('/api/admin/products/export', methods=['GET'])
+@require_admin
+def admin_products_export():
+    """Stream the whole product catalog as CSV or NDJSON (same shape the import accepts)."""
+    fmt = (request.args.get("format") or "csv").lower()
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    log(f"Received product export request (format={fmt})", "INFO")
+
+    def generate():
+        conn = db()
+        exported = 0
+        try:
+            cur = conn.cursor()
+            cur.execute(_PRODUCT_EXPORT_SQL)
+            buf = io.StringIO()
+            writer = csv.writer(buf, lineterminator="\n")
+            if fmt == "csv":
+                writer.writerow(PRODUCT_EXPORT_FIELDS)
+            while True:
+                rows = cur.fetchmany(EXPORT_FETCH_ROWS)
+                if not rows:
+                    break
+                for r in rows:
+                    images = json.loads(r[8]) if r[8] else []
+                    if fmt == "csv":
+                        writer.writerow(list(r[:8]) + ["|".join(images)])
+                    else:
+                        buf.write(json.dumps(dict(zip(PRODUCT_EXPORT_FIELDS, list(r[:8]) + [images])),
+                                             separators=(",", ":"), ensure_ascii=False))
+                        buf.write("\n")
+                exported += len(rows)
+                yield buf.getvalue().encode("utf-8")
+                buf.seek(0)
+                buf.truncate()
+            log(f"Product export finished: {exported} rows streamed", "SUCCESS")
+        except Exception as e:
+            log(f"Product export failed after {exported} rows: {e}", "ERROR")
+            raise
+        finally:
+            conn.close()
+
+    ext, mimetype = ("csv", "text/csv") if fmt == "csv" else ("ndjson", "application/x-ndjson")
+    filename = f"products-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{ext}"
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
 @app.route('/api/services', methods=['POST'])
 @require_admin
 def services_create():
     log("Received request to create new service", "INFO")
     data = request.get_json(force=True)
-    name = data.get('name')
-    price = data.get('price')
-    bio = data.get('bio')
-    discount_price = data.get('discount_price')
-    active = int(bool(data.get('active', 1)))
-
-    images = data.get('images') or []
-    if not images and data.get('image_url'):
-        images = [data['image_url']]
-
-    log(f"Service data: name={name}, price={price}, bio={bio}, discount_price={discount_price}, active={active}, images={images}", "INFO")
-
-    if not name or price is None:
-        log("Missing required fields for service creation", "WARNING")
-        return jsonify({"error": "`name` and `price` are required"}), 400
+    log(f"Service data: {data}", "INFO")
 
     conn = db()
     try:
-        conn.execute("PRAGMA foreign_keys = ON")
         cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO services (name, bio, price, discount_price, active)
-            VALUES (?,?,?,?,?)
-        """, (name, bio, price, discount_price, active))
-        new_id = cur.lastrowid
-        log(f"Inserted new service with id {new_id}", "SUCCESS")
-
-        if images:
-            cur.executemany(
-                "INSERT INTO service_images (service_id, image_path, alt_text, sort_order) VALUES (?,?,?,?)",
-                [(new_id, p, None, i) for i, p in enumerate(images)]
-            )
-            log(f"Inserted images for service {new_id}: {images}", "SUCCESS")
-        else:
-            log(f"No images provided for service {new_id}", "INFO")
-
+        new_id = catalog_insert(cur, "service", data)
         conn.commit()
+        invalidate_catalog(f"service {new_id} created")
         log(f"Service {new_id} created successfully", "SUCCESS")
         return jsonify({"id": new_id}), 201
+    except ValueError as e:
+        log(f"Invalid service creation request: {e}", "WARNING")
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         log(f"Error creating service: {e}", "ERROR")
         return jsonify({"error": "failed to create service"}), 500
@@ -1084,58 +3105,21 @@ def services_create():
 def services_update(sid):
     log(f"Received request to update service {sid}", "INFO")
     data = request.get_json(force=True)
-    field_map = {
-        "name": "name",
-        "bio": "bio",
-        "price": "price",
-        "discount_price": "discount_price",
-        "active": "active",
-    }
-
-    fields, values = [], []
-    for key, col in field_map.items():
-        if key in data:
-            if key == "active":
-                fields.append(f"{col}=?")
-                values.append(int(bool(data[key])))
-            else:
-                fields.append(f"{col}=?")
-                values.append(data[key])
-
-    replace_images = None
-    if "images" in data:
-        replace_images = data.get("images") or []
-    elif "image_url" in data:
-        replace_images = [data["image_url"]] if data["image_url"] else []
-
-    if not fields and replace_images is None:
-        log(f"No fields to update for service {sid}", "WARNING")
-        return jsonify({"error": "no fields to update"}), 400
 
     conn = db()
     try:
-        conn.execute("PRAGMA foreign_keys = ON")
         cur = conn.cursor()
-
-        if fields:
-            values.append(sid)
-            cur.execute(f"UPDATE services SET {', '.join(fields)} WHERE id=?", values)
-            log(f"Updated fields for service {sid}: {fields}", "SUCCESS")
-
-        if replace_images is not None:
-            cur.execute("DELETE FROM service_images WHERE service_id=?", (sid,))
-            if replace_images:
-                cur.executemany(
-                    "INSERT INTO service_images (service_id, image_path, alt_text, sort_order) VALUES (?,?,?,?)",
-                    [(sid, p, None, i) for i, p in enumerate(replace_images)]
-                )
-                log(f"Replaced images for service {sid}: {replace_images}", "SUCCESS")
-            else:
-                log(f"Removed all images for service {sid}", "INFO")
-
+        found = catalog_update(cur, "service", sid, data)
         conn.commit()
+        if not found:
+            log(f"Service {sid} not found, nothing updated", "WARNING")
+            return jsonify({"ok": True})
+        invalidate_catalog(f"service {sid} updated")
         log(f"Service {sid} updated successfully", "SUCCESS")
         return jsonify({"ok": True})
+    except ValueError as e:
+        log(f"No fields to update for service {sid}", "WARNING")
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         log(f"Error updating service {sid}: {e}", "ERROR")
         return jsonify({"error": "failed to update service"}), 500
@@ -1148,10 +3132,10 @@ def services_delete(sid):
     log(f"Received request to delete service {sid}", "INFO")
     conn = db()
     try:
-        conn.execute("PRAGMA foreign_keys = ON")
         cur = conn.cursor()
-        cur.execute("DELETE FROM services WHERE id=?", (sid,))
-        conn.commit()
+        if catalog_delete(cur, "service", sid):
+            conn.commit()
+            invalidate_catalog(f"service {sid} deleted")
         log(f"Service {sid} deleted successfully", "SUCCESS")
         return jsonify({"ok": True})
     except Exception as e:
@@ -1160,11 +3144,187 @@ def services_delete(sid):
     finally:
         conn.close()
 
+# ----------------------------
+# Batch admin mutations
+# ----------------------------
+
+def _apply_batch_op(cur, op) -> dict:
+    """Run one {"op", "kind", "id", "data"} operation. Raises ValueError/LookupError on bad input."""
+    if not isinstance(op, dict):
+        raise ValueError("operation must be an object")
+    action, kind = op.get("op"), op.get("kind")
+    if kind not in CATALOG_KINDS:
+        raise ValueError("`kind` must be product or service")
+    data = op.get("data") or {}
+    if not isinstance(data, dict):
+        raise ValueError("`data` must be an object")
+
+    if action == "create":
+        return {"id": catalog_insert(cur, kind, data)}
+    if action not in ("update", "delete"):
+        raise ValueError("`op` must be create, update or delete")
+    iid = op.get("id")
+    if not isinstance(iid, int) or isinstance(iid, bool):
+        raise ValueError("`id` must be an integer")
+    found = catalog_update(cur, kind, iid, data) if action == "update" else catalog_delete(cur, kind, iid)
+    if not found:
+        raise LookupError(f"{kind} {iid} not found")
+    return {"id": iid}
+
+@app.route('/api/admin/batch', methods=['POST'])
+@require_admin
+def admin_batch():
+    """
+    Apply many product/service create/update/delete operations in ONE transaction:
+    {"mode": "atomic" | "per_op", "ops": [{"op": "update", "kind": "product", "id": 3, "data": {"sold_out": 1}}, ...]}
+    atomic: the first failing op rolls everything back. per_op: each op runs under
+    its own SAVEPOINT, failures are reported and the rest is committed.
+    """
+    data = request.get_json(force=True, silent=True) or {}
+    ops = data.get("ops")
+    mode = data.get("mode") or "atomic"
+    if mode not in ("atomic", "per_op"):
+        return jsonify({"error": "`mode` must be atomic or per_op"}), 400
+    if not isinstance(ops, list) or not ops:
+        return jsonify({"error": "`ops` must be a non-empty list"}), 400
+    if len(ops) > BATCH_MAX_OPS:
+        return jsonify({"error": f"too many operations (max {BATCH_MAX_OPS})"}), 400
+    log(f"Received admin batch: {len(ops)} operations, mode={mode}", "INFO")
+
+    t0 = time.perf_counter()
+    results = []
+    conn = db()
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        for i, op in enumerate(ops):
+            if mode == "per_op":
+                cur.execute("SAVEPOINT batch_op")
+            try:
+                results.append({"index": i, "ok": True, **_apply_batch_op(cur, op)})
+                if mode == "per_op":
+                    cur.execute("RELEASE batch_op")
+            except (ValueError, LookupError, sqlite3.Error) as e:
+                failure = {"index": i, "ok": False, "error": str(e)}
+                if mode == "atomic":
+                    conn.rollback()
+                    log(f"Admin batch rolled back: operation {i} failed: {e}", "WARNING")
+                    return jsonify({"ok": False, "mode": mode, "applied": 0, "failed_index": i,
+                                    "error": str(e), "results": [failure]}), 400
+                cur.execute("ROLLBACK TO batch_op")
+                cur.execute("RELEASE batch_op")
+                log(f"Admin batch operation {i} failed and was skipped: {e}", "WARNING")
+                results.append(failure)
+        conn.commit()
+    except Exception as e:
+        log(f"Admin batch failed: {e}", "ERROR")
+        return jsonify({"error": "batch failed"}), 500
+    finally:
+        conn.close()
+
+    applied = sum(1 for r in results if r["ok"])
+    if applied:
+        invalidate_catalog(f"admin batch of {applied} operations")
+    failed = len(results) - applied
+    log(f"Admin batch committed: {applied} applied, {failed} failed in {(time.perf_counter() - t0) * 1000:.1f} ms",
+        "SUCCESS" if not failed else "WARNING")
+    return jsonify({"ok": failed == 0, "mode": mode, "applied": applied, "failed": failed,
+                    "catalog_version": catalog_version(), "results": results})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if METRICS_TOKEN:
+        auth = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(auth, f"Bearer {METRICS_TOKEN}"):
+            log("Rejected /metrics scrape: bad or missing token", "WARNING")
+            return jsonify({"error": "Invalid token"}), 403
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/api/admin/profiles', methods=['GET'])
+@require_admin
+def admin_profiles_list():
+    log("Received request for captured request profiles", "INFO")
+    return jsonify({
+        "slow_ms": PROFILE_SLOW_MS,
+        "stack_sampling": PROFILE_STACK_SAMPLING,
+        "sample_rate": PROFILE_SAMPLE_RATE,
+        "profiles": PROFILE_STORE.summaries(),
+    })
+
+@app.route('/api/admin/profiles/<int:profile_id>', methods=['GET'])
+@require_admin
+def admin_profiles_get(profile_id):
+    fmt = (request.args.get("format") or "json").lower()
+    log(f"Received request for profile #{profile_id} (format={fmt})", "INFO")
+    entry = PROFILE_STORE.get(profile_id)
+    if not entry:
+        log(f"Profile #{profile_id} not found (expired from ring buffer?)", "WARNING")
+        return jsonify({"error": "not found"}), 404
+
+    if fmt == "collapsed":
+        body = "".join(f"{stack} {count}\n" for stack, count in entry["stacks"].items())
+        return Response(body, mimetype="text/plain",
+                        headers={"Content-Disposition": f"attachment; filename=profile-{profile_id}.folded"})
+    if fmt in ("pstats", "prof"):
+        if not entry.get("prof"):
+            log(f"Profile #{profile_id} has no cProfile data", "WARNING")
+            return jsonify({"error": "no cProfile data for this capture"}), 404
+        if fmt == "pstats":
+            return Response(entry["pstats"], mimetype="text/plain")
+        return Response(entry["prof"], mimetype="application/octet-stream",
+                        headers={"Content-Disposition": f"attachment; filename=profile-{profile_id}.prof"})
+    if fmt != "json":
+        return jsonify({"error": "format must be json, collapsed, pstats or prof"}), 400
+    return jsonify({k: v for k, v in entry.items() if k != "prof"})
+
+@app.route('/api/admin/slow-queries', methods=['GET'])
+@require_admin
+def admin_slow_queries():
+    log("Received request for slow query log", "INFO")
+    return jsonify({"threshold_ms": SLOW_QUERY_MS, "queries": list(reversed(SLOW_QUERY_LOG))})
+
 @app.route('/static/uploads/<path:filename>')
 def uploaded_file(filename):
     log(f"Serving uploaded file: {filename}", "INFO")
     return send_from_directory(UPLOAD_DIR, filename)
 
+# ----------------------------
+# Contact messages (write-behind)
+# ----------------------------
+# contact_submit only queues the message (plus one append to the spool file
+# when CONTACT_SPOOL is set); a background thread writes queued messages in
+# batches of CONTACT_BATCH_SIZE with one executemany + commit. A spam wave
+# therefore costs a few commits instead of one per message and doesn't fight
+# checkout for SQLite's writer lock. When the queue is full, new messages get
+# a 503 with Retry-After.
+
+def _flush_contact_messages(batch: list):
+    with closing(db()) as conn:
+        # ref is UNIQUE: messages replayed from the spool after a crash are skipped if already stored
+        conn.executemany(
+            "INSERT OR IGNORE INTO contact_messages (ref, name, email, message, created_at) VALUES (?,?,?,?,?)",
+            [(m["ref"], m["name"], m["email"], m["message"], m["created_at"]) for m in batch]
+        )
+        conn.commit()
+
+def _contact_flushed(count: int, seconds: float, error: str | None):
+    CONTACT_QUEUE_DEPTH.set(CONTACT_QUEUE.pending())
+    if error:
+        log(f"Contact message flush failed (will retry, {CONTACT_QUEUE.pending()} pending): {error}", "ERROR")
+        return
+    CONTACT_MESSAGES.inc(("flushed",), count)
+    log(f"Flushed {count} contact messages in {seconds * 1000:.1f} ms ({CONTACT_QUEUE.pending()} pending)", "SUCCESS")
+
+CONTACT_QUEUE = writebehind.WriteBehindQueue(
+    _flush_contact_messages,
+    max_size=CONTACT_QUEUE_MAX,
+    batch_size=CONTACT_BATCH_SIZE,
+    interval=CONTACT_FLUSH_MS / 1000.0,
+    spool_path=CONTACT_SPOOL or None,
+    spool_fsync=CONTACT_SPOOL_FSYNC,
+    on_flush=_contact_flushed,
+)
+
 @app.route('/api/contact', methods=['POST'])
 def contact_submit():
     data = request.get_json(force=True, silent=True) or {}
@@ -1175,6 +3335,29 @@ def contact_submit():
     if not name or not email or not message:
         return jsonify({"error": "All fields are required"}), 400
 
+    if CONTACT_WRITE_BEHIND:
+        record = {
+            "ref": uuid.uuid4().hex,
+            "name": name,
+            "email": email,
+            "message": message,
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),  # same format as datetime('now')
+        }
+        try:
+            CONTACT_QUEUE.put(record)
+        except writebehind.QueueFull:
+            CONTACT_MESSAGES.inc(("rejected",))
+            log(f"Contact queue full ({CONTACT_QUEUE_MAX} pending), rejecting message from {email}", "WARNING")
+            response = jsonify({"error": "We're receiving a lot of messages right now, please try again shortly"})
+            response.headers["Retry-After"] = str(CONTACT_RETRY_AFTER)
+            return response, 503
+        except Exception as e:
+            log(f"Failed to queue contact message: {e}", "ERROR")
+            return jsonify({"error": "Failed to save message"}), 500
+        CONTACT_MESSAGES.inc(("accepted",))
+        CONTACT_QUEUE_DEPTH.set(CONTACT_QUEUE.pending())
+        return jsonify({"ok": True, "queued": True, "msg": "Message received"}), 202
+
     try:
         conn = db()
         cur = conn.cursor()
@@ -1187,7 +3370,203 @@ def contact_submit():
         return jsonify({"ok": True, "msg": f"Message stored: {name, email, message}"}), 201
     except Exception as e:
         return jsonify({"error": f"Failed to save message: {e}"}), 500
-    
+
+@app.route('/api/admin/contact-messages', methods=['GET'])
+@require_admin
+def admin_contact_messages():
+    """
+    Admin inbox, newest first. Keyset pagination on the primary key:
+    pass next_before_id from the previous page as ?before_id= (no OFFSET scans).
+    """
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 200)
+        before_id = request.args.get("before_id")
+        before_id = int(before_id) if before_id else None
+    except ValueError:
+        return jsonify({"error": "`limit` and `before_id` must be integers"}), 400
+    log(f"Received request for contact messages (limit={limit}, before_id={before_id})", "INFO")
+
+    with closing(db()) as conn:
+        if before_id is None:
+            rows = conn.execute("""
+                SELECT id, name, email, message, created_at FROM contact_messages
+                 ORDER BY id DESC LIMIT ?
+            """, (limit + 1,)).fetchall()
+        else:
+            rows = conn.execute("""
+                SELECT id, name, email, message, created_at FROM contact_messages
+                 WHERE id < ?
+                 ORDER BY id DESC LIMIT ?
+            """, (before_id, limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    items = [{"id": r[0], "name": r[1], "email": r[2], "message": r[3], "created_at": r[4]} for r in rows]
+    return jsonify({
+        "items": items,
+        "next_before_id": rows[-1][0] if has_more else None,
+        "queue": CONTACT_QUEUE.stats(),
+    })
+
+# ----------------------------
+# Background DB maintenance
+# ----------------------------
+
+def server_is_quiet() -> bool:
+    return HTTP_IN_PROGRESS.value() <= 0 and (time.monotonic() - _LAST_REQUEST_AT) >= MAINT_QUIET_SECONDS
+
+def _maint_optimize():
+    conn = db()
+    try:
+        conn.execute("PRAGMA optimize").fetchall()
+    finally:
+        conn.close()
+
+def _maint_analyze():
+    conn = db()
+    try:
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+
+def _maint_wal_checkpoint():
+    conn = db()
+    try:
+        # TRUNCATE resets the -wal file but waits on readers, so only when nobody's around
+        mode = "TRUNCATE" if server_is_quiet() else "PASSIVE"
+        busy, wal_pages, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        return {"mode": mode, "busy": busy, "wal_pages": wal_pages, "checkpointed": checkpointed}
+    finally:
+        conn.close()
+
+def _maint_incremental_vacuum():
+    conn = db()
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return {"skipped": "auto_vacuum is not INCREMENTAL (only set on new databases)"}
+        free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if free_before:
+            conn.execute(f"PRAGMA incremental_vacuum({int(MAINT_VACUUM_PAGES)})").fetchall()
+        free_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return {"freelist_before": free_before, "freelist_after": free_after}
+    finally:
+        conn.close()
+
+def _maintenance_ran(task: str, seconds: float, error: str | None):
+    MAINT_SECONDS.observe(seconds, (task,))
+    MAINT_RUNS.inc((task, "error" if error else "ok"))
+    if error:
+        log(f"Maintenance task {task} failed after {seconds * 1000:.1f} ms: {error}", "ERROR")
+    else:
+        log(f"Maintenance task {task} finished in {seconds * 1000:.1f} ms", "SUCCESS")
+
+# Each worker process runs a scheduler. single=True: once per database, only
+# in the worker holding MAINT_LOCK (N workers must not mean N backups).
+# PRAGMA optimize and the revocation prune act on this process' connections/memory.
+MAINTENANCE = maintenance.Scheduler(is_quiet=server_is_quiet, on_run=_maintenance_ran, lock_path=MAINT_LOCK or None)
+MAINTENANCE.add("optimize", _maint_optimize, MAINT_OPTIMIZE_MIN * 60, run_at_start=True)
+MAINTENANCE.add("analyze", _maint_analyze, MAINT_ANALYZE_HOURS * 3600, quiet_only=True, single=True)
+MAINTENANCE.add("wal_checkpoint", _maint_wal_checkpoint, MAINT_CHECKPOINT_MIN * 60, single=True)
+MAINTENANCE.add("incremental_vacuum", _maint_incremental_vacuum, MAINT_VACUUM_MIN * 60, quiet_only=True, single=True)
+
+def _maint_backup():
+    info = backup_db.backup(DATABASE, BACKUP_DIR, pages=BACKUP_PAGES, pause=BACKUP_PAUSE_MS / 1000.0,
+                            compress=BACKUP_COMPRESS, keep=BACKUP_KEEP)
+    log(f"Backup written: {info['path']} ({info['bytes']} bytes, integrity {info['integrity']})", "SUCCESS")
+    return info
+
+if BACKUP_INTERVAL_MIN > 0:
+    MAINTENANCE.add("backup", _maint_backup, BACKUP_INTERVAL_MIN * 60, single=True)
+
+def _maint_token_revocations_prune():
+    with closing(db()) as conn:
+        info = TOKEN_REVOCATIONS.prune(conn)
+        conn.commit()
+        return info
+
+MAINTENANCE.add("token_revocations_prune", _maint_token_revocations_prune, 3600, quiet_only=True)
+
+def _maint_webhook_prune():
+    return WEBHOOK_QUEUE.prune(WEBHOOK_KEEP_DAYS)
+
+MAINTENANCE.add("webhook_prune", _maint_webhook_prune, 3600, quiet_only=True, single=True)
+
+def _maint_image_meta_backfill():
+    if not PIL_AVAILABLE:
+        return {"skipped": "Pillow not installed"}
+    info = backfill_image_meta(IMAGE_META_BACKFILL_BATCH)
+    if info["computed"] or info["failed"]:
+        log(f"Image metadata backfill: {info}", "SUCCESS")
+    return info
+
+if IMAGE_META_BACKFILL_MIN > 0:
+    # Quiet periods only: each image is a file read + decode. POST /api/admin/maintenance/image_meta_backfill to run it now
+    MAINTENANCE.add("image_meta_backfill", _maint_image_meta_backfill, IMAGE_META_BACKFILL_MIN * 60,
+                    quiet_only=True, run_at_start=True, single=True)
+
+@app.route('/api/admin/maintenance', methods=['GET'])
+@require_admin
+def admin_maintenance_status():
+    log("Received request for maintenance task status", "INFO")
+    return jsonify({"enabled": MAINT_ENABLED, "quiet": server_is_quiet(), "leader": MAINTENANCE.leader(),
+                    "tasks": MAINTENANCE.status()})
+
+@app.route('/api/admin/maintenance/<task>', methods=['POST'])
+@require_admin
+def admin_maintenance_run(task):
+    log(f"Received request to run maintenance task {task} now", "INFO")
+    if task not in MAINTENANCE.tasks():
+        log(f"Unknown maintenance task: {task}", "WARNING")
+        return jsonify({"error": "unknown task", "tasks": MAINTENANCE.tasks()}), 404
+    return jsonify(MAINTENANCE.run_now(task))
+
+# ----------------------------
+# Per-process startup
+# ----------------------------
+# Revocation list, write-behind/webhook workers and the maintenance scheduler
+# belong to one process. `py server.py` starts them before app.run(); under a
+# WSGI server (gunicorn, waitress, ...) nothing runs __main__, so the first
+# request each worker process gets starts them, before it's handled - no
+# request is ever checked against an empty revocation list. Importing starts
+# nothing, so a preloading master (gunicorn --preload) can fork workers
+# safely; don't call start_background_tasks() in a process that forks later.
+
+_BACKGROUND_LOCK = threading.Lock()
+_BACKGROUND_STARTED = False
+
+@app.before_request
+def _ensure_background_tasks():
+    if not _BACKGROUND_STARTED:
+        start_background_tasks()
+
+def start_background_tasks():
+    """Start this process's background tasks. Only the first call does anything."""
+    global _BACKGROUND_STARTED
+    with _BACKGROUND_LOCK:
+        if _BACKGROUND_STARTED:
+            return
+        # If this raises, the request fails and the next one tries again; nothing else was started yet
+        with closing(db()) as conn:
+            info = TOKEN_REVOCATIONS.load(conn)
+        _BACKGROUND_STARTED = True
+    log(f"Token revocations loaded (pid {os.getpid()}): {info}", "INFO")
+    if CONTACT_WRITE_BEHIND:
+        CONTACT_QUEUE.start()
+        atexit.register(CONTACT_QUEUE.stop)
+        log(f"Contact write-behind started (spool={CONTACT_QUEUE.spool_path or 'off'}, {CONTACT_QUEUE.recovered} messages recovered)", "INFO")
+        if CONTACT_SPOOL and not CONTACT_QUEUE.spool_path:
+            log(f"Contact spool disabled: {CONTACT_QUEUE.last_error}", "WARNING")
+    if WEBHOOK_WORKERS > 0:
+        WEBHOOK_QUEUE.start()
+        atexit.register(WEBHOOK_QUEUE.stop)
+        log(f"Webhook workers started: {WEBHOOK_WORKERS} (queue: {WEBHOOK_QUEUE.stats()['counts']})", "INFO")
+    else:
+        log("Webhook workers disabled (WEBHOOK_WORKERS=0): queued PayPal events wait for a process that has them", "WARNING")
+    if MAINT_ENABLED:
+        MAINTENANCE.start()
+        log(f"Maintenance scheduler started: {', '.join(MAINTENANCE.tasks())}", "INFO")
+    else:
+        log("Maintenance scheduler disabled (MAINT_ENABLED=0)", "WARNING")
 
 if __name__ == '__main__':
     while True:
@@ -1202,6 +3581,8 @@ if __name__ == '__main__':
                 log("Database schema is up to date.", "SUCCESS")
             
             log("server.py has been launched!", "INFO")
+            log(f"JSON backend: {serializer.BACKEND}", "INFO")
+            start_background_tasks()
             try:
                 log("Starting Flask server...", "INFO")
                 app.run(host="127.0.0.1", port=5000)
@@ -0,0 +1,270 @@
+"""
+Shared catalog snapshots, so several worker processes serve one copy of
+the encoded catalog instead of each rebuilding it from shop.db.
+
+Every store has the same four methods:
+    version()                 current catalog version (shared between workers)
+    bump(at_least=0)          new version after a catalog write, never below at_least
+    get(name, version)        stored bytes (or a zero-copy memoryview) or None
+    put(name, version, data)  store bytes for that version
+
+Backends:
+    LocalStore   nothing shared but the version (read from shop.db), the default
+    MmapStore    files in a shared directory, read through mmap
+    RedisStore   any Redis-compatible server through a redis-py style client
+                 (get/set/incr); InProcessRedis is a local stand-in for dev/tests
+"""
+import contextlib
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+
+def _safe_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+    """Exclusive lock across processes (fcntl on POSIX, msvcrt on Windows)."""
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class LocalStore:
+    """
+    Nothing stored, only the version. With read_version (server.py: the
+    catalog_meta row in shop.db, moved by triggers on every catalog write)
+    it's re-read at most every poll_interval seconds, so a write made by
+    another worker is seen within that window and bump() just re-reads.
+    Without it the version is a counter in this process.
+    """
+    shared = False
+
+    def __init__(self, read_version=None, poll_interval: float = 0.5):
+        self.read_version = read_version
+        self.poll_interval = poll_interval
+        self._version = time.time_ns() // 1000  # per boot: a restart never repeats a version
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def version(self) -> int:
+        if self.read_version is not None:
+            now = time.monotonic()
+            if self._checked is None or now - self._checked >= self.poll_interval:
+                self._version = int(self.read_version())
+                self._checked = now
+        return self._version
+
+    def bump(self, at_least: int = 0) -> int:
+        with self._lock:
+            if self.read_version is not None:
+                self._checked = None
+                return self.version()
+            self._version = max(self._version + 1, at_least)
+            return self._version
+
+    def get(self, name: str, version: int):
+        return None
+
+    def put(self, name: str, version: int, data):
+        pass
+
+    def describe(self) -> str:
+        return "local (per process, version from shop.db)" if self.read_version else "local (per process)"
+
+
+class MmapStore:
+    """
+    version lives in an 8-byte mmap'd file, so reading it is a memory read,
+    not a syscall. Snapshots are files named <name>.<version>.snap, written
+    to a temp file and renamed into place, then mmap'd read-only; get()
+    returns a memoryview over the mapping (no copy into the process heap).
+    """
+    shared = True
+
+    def __init__(self, directory: str, keep_versions: int = 2):
+        self.directory = directory
+        self.keep_versions = keep_versions
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, "catalog.lock")
+        version_path = os.path.join(directory, "catalog.version")
+        with _file_lock(self._lock_path):
+            if not os.path.exists(version_path) or os.path.getsize(version_path) < 8:
+                with open(version_path, "wb") as f:
+                    f.write(struct.pack("<Q", 1))
+        self._version_file = open(version_path, "r+b")
+        self._version_map = mmap.mmap(self._version_file.fileno(), 8)
+        self._maps = {}
+        self._maps_lock = threading.Lock()
+
+    def version(self) -> int:
+        return struct.unpack_from("<Q", self._version_map, 0)[0]
+
+    def bump(self, at_least: int = 0) -> int:
+        with _file_lock(self._lock_path):
+            version = max(self.version() + 1, at_least)
+            struct.pack_into("<Q", self._version_map, 0, version)
+            self._version_map.flush()
+        return version
+
+    def _path(self, name: str, version: int) -> str:
+        return os.path.join(self.directory, f"{_safe_name(name)}.{version}.snap")
+
+    def get(self, name: str, version: int):
+        path = self._path(name, version)
+        with self._maps_lock:
+            view = self._maps.get(path)
+            if view is not None:
+                return view
+            try:
+                with open(path, "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) if size else b""
+            except FileNotFoundError:
+                return None
+            # Old versions' mappings are dropped here and unmapped once no response uses them any more.
+            # Exact <name>.<version>.snap only: "products" must not evict "products.gzip"
+            pattern = self._pattern(name)
+            for old in [p for p in self._maps if pattern.match(os.path.basename(p))]:
+                del self._maps[old]
+            self._maps[path] = view
+            return view
+
+    def put(self, name: str, version: int, data):
+        path = self._path(name, version)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._cleanup(name, version)
+
+    @staticmethod
+    def _pattern(name: str):
+        return re.compile(re.escape(_safe_name(name)) + r"\.(\d+)\.snap$")
+
+    def _cleanup(self, name: str, version: int):
+        pattern = self._pattern(name)
+        for entry in os.listdir(self.directory):
+            m = pattern.match(entry)
+            if m and int(m.group(1)) <= version - self.keep_versions:
+                try:
+                    os.remove(os.path.join(self.directory, entry))
+                except OSError:
+                    pass  # still mapped by someone (Windows) - next cleanup gets it
+
+    def describe(self) -> str:
+        return f"mmap ({self.directory})"
+
+
+class RedisStore:
+    """
+    Snapshots and the version counter in a Redis-compatible server. version()
+    is re-read at most every poll_interval seconds, so other workers see a
+    bump within that window; the worker that bumped sees it immediately.
+    """
+    shared = True
+
+    def __init__(self, client, prefix: str = "shop:catalog:", ttl: int = 86400, poll_interval: float = 0.5):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self._version = None
+        self._checked = 0.0
+
+    def version(self) -> int:
+        now = time.monotonic()
+        if self._version is None or now - self._checked >= self.poll_interval:
+            raw = self.client.get(self.prefix + "version")
+            self._version = int(raw) if raw is not None else 0
+            self._checked = now
+        return self._version
+
+    def bump(self, at_least: int = 0) -> int:
+        key = self.prefix + "version"
+        version = int(self.client.incr(key))
+        if version < at_least:
+            # two workers doing this at once overshoot, which is fine: versions only have to be new
+            version = int(self.client.incr(key, at_least - version))
+        self._version = version
+        self._checked = time.monotonic()
+        return self._version
+
+    def get(self, name: str, version: int):
+        return self.client.get(f"{self.prefix}{name}:{version}")
+
+    def put(self, name: str, version: int, data):
+        self.client.set(f"{self.prefix}{name}:{version}", bytes(data), ex=self.ttl)
+
+    def describe(self) -> str:
+        return f"redis ({type(self.client).__name__})"
+
+
+class InProcessRedis:
+    """The get/set/incr subset of redis-py, in memory. Stand-in for a real server in dev and tests."""
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, key) -> bool:
+        exp = self._expires.get(key)
+        if exp is not None and exp <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._data
+
+    def get(self, key):
+        with self._lock:
+            return self._data[key] if self._alive(key) else None
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = value if isinstance(value, bytes) else str(value).encode("utf-8")
+            if ex:
+                self._expires[key] = time.monotonic() + ex
+            else:
+                self._expires.pop(key, None)
+            return True
+
+    def incr(self, key, amount: int = 1) -> int:
+        with self._lock:
+            value = int(self._data[key]) + amount if self._alive(key) else amount
+            self._data[key] = str(value).encode("utf-8")
+            return value
+
+
+def open_store(backend: str, directory: str = "catalog_snapshots", redis_url: str = "",
+               read_version=None, poll_interval: float = 0.5):
+    """read_version/poll_interval: where the local backend reads the version from (see LocalStore)."""
+    backend = (backend or "local").lower()
+    if backend == "local":
+        return LocalStore(read_version, poll_interval)
+    if backend == "mmap":
+        return MmapStore(directory)
+    if backend == "redis":
+        if redis_url == "inprocess://":
+            return RedisStore(InProcessRedis())
+        import redis  # optional dependency: pip install redis
+        return RedisStore(redis.Redis.from_url(redis_url))
+    raise ValueError(f"unknown snapshot backend {backend!r} (local, mmap or redis)")
@@ -0,0 +1,95 @@
+"""
+The sales summary tables (analytics.py) kept up incrementally by
+create-order/capture-order must hold exactly what analytics.rebuild()
+computes from `checkouts`, and so must init_db migration 12's chunked build.
+PayPal is bench/paypal_stub.py.
+"""
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+import analytics
+import init_db
+from bench import common, seed
+from bench.paypal_stub import WEBHOOK_ID, start_stub
+
+
+@pytest.fixture
+def shop():
+    stub, stub_url = start_stub()
+    with common.workdir():
+        seed.seed_catalog("shop.db", products=5, services=0, images=0)
+        server = common.load_server(
+            PAYPAL_API_BASE=stub_url, PAYPAL_CLIENT_ID="test", PAYPAL_CLIENT_SECRET="test",
+            PAYPAL_WEBHOOK_ID=WEBHOOK_ID, WEBHOOK_WORKERS=0)
+        try:
+            yield server
+        finally:
+            stub.shutdown()
+            server.DB_POOL.clear()
+
+
+def checkout(client, items, discount_code=None, headers=None) -> str:
+    response = client.post("/api/paypal/create-order", json={"items": items, "discount_code": discount_code},
+                           headers=headers)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()["id"]
+
+
+def capture(client, order_id: str):
+    response = client.post("/api/paypal/capture-order", json={"order_id": order_id})
+    assert response.status_code == 200, response.get_json()
+
+
+def summaries(conn) -> dict:
+    # sums of floats added in another order: compare them rounded
+    rows = lambda t: sorted(tuple(round(v, 6) if isinstance(v, float) else v for v in r)
+                            for r in conn.execute(f"SELECT * FROM {t}"))
+    return {t: rows(t) for t in analytics.TABLES}
+
+
+def test_incremental_summaries_match_rebuild(shop):
+    client = shop.app.test_client()
+    login = client.post("/api/auth/login", json={"email": seed.USER_EMAIL, "password": seed.PASSWORD}).get_json()
+    customer = {"Authorization": f"Bearer {login['token']}"}
+
+    guest = checkout(client, [{"id": 1, "kind": "product", "qty": 2}], "DEV10")
+    mixed = checkout(client, [{"id": 2, "kind": "product", "qty": 1}, {"id": 3, "kind": "product", "qty": 3},
+                              {"id": 2, "kind": "product", "qty": 1}], " student15 ", customer)
+    plain = checkout(client, [{"id": 3, "kind": "product", "qty": 1}], headers=customer)
+    unknown_code = checkout(client, [{"id": 4, "kind": "product", "qty": 1}], "NOPE")
+    checkout(client, [{"id": 5, "kind": "product", "qty": 1}], "SAVE5")  # never captured
+
+    for order_id in (guest, mixed, plain, unknown_code):
+        capture(client, order_id)
+    # the browser retries, the webhook worker gets there too: counted once
+    capture(client, mixed)
+    capture(client, guest)
+    shop.complete_checkout(plain)
+
+    with closing(shop.db()) as conn:
+        incremental = summaries(conn)
+        assert sum(orders for _, orders, *_ in incremental["sales_daily_totals"]) == 4
+        assert sorted(code for _, code, *_ in incremental["discount_daily"]) == ["DEV10", "STUDENT15"]
+        analytics.rebuild(conn)
+        assert summaries(conn) == incremental
+        conn.rollback()
+
+
+def test_migration_12_chunked_build_matches_rebuild(shop):
+    client = shop.app.test_client()
+    for i in range(7):
+        order_id = checkout(client, [{"id": i % 5 + 1, "kind": "product", "qty": i + 1}], ("DEV10", None, "SAVE5")[i % 3])
+        if i % 4:
+            capture(client, order_id)
+
+    with closing(sqlite3.connect("shop.db")) as conn:
+        analytics.rebuild(conn)
+        expected = summaries(conn)
+        cursor = conn.cursor()
+        init_db._m012_sales_summaries(cursor, 2)  # schema + progress row, tables emptied
+        assert all(not rows for rows in summaries(conn).values())
+        while init_db._m012_sales_summaries(cursor, 2):
+            pass
+        assert summaries(conn) == expected
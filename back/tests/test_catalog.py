@@ -0,0 +1,83 @@
+"""
+Catalog version and listing caches with the default local snapshot store:
+the version is the catalog_meta row in shop.db (init_db migration 15), so
+a write made by another worker process - played here by a plain sqlite3
+connection - reaches this worker's cached listings.
+"""
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+from bench import common, seed
+
+
+@pytest.fixture
+def shop():
+    with common.workdir():
+        seed.seed_catalog("shop.db", products=5, services=0, images=0)
+        server = common.load_server(SNAPSHOT_BACKEND="local", CATALOG_CACHE=1, CATALOG_VERSION_POLL_SECONDS=0)
+        try:
+            yield server
+        finally:
+            server.DB_POOL.clear()
+
+
+def other_worker(sql: str, *params):
+    with closing(sqlite3.connect("shop.db")) as conn:
+        conn.execute(sql, params)
+        conn.commit()
+
+
+def product_names(client) -> dict:
+    response = client.get("/api/products")
+    assert response.status_code == 200
+    return {p["id"]: p["name"] for p in response.get_json()}
+
+
+def test_write_in_another_worker_reaches_cached_listing(shop):
+    client = shop.app.test_client()
+    before = shop.catalog_version()
+    assert product_names(client)[1] != "Renamed elsewhere"
+    product_names(client)  # served from this worker's cache now
+
+    other_worker("UPDATE products SET name = ? WHERE id = 1", "Renamed elsewhere")
+    assert shop.catalog_version() > before
+    assert product_names(client)[1] == "Renamed elsewhere"
+
+
+def test_version_moves_on_image_writes(shop):
+    before = shop.catalog_version()
+    other_worker("INSERT INTO product_images (product_id, image_path, sort_order) VALUES (1, '/static/uploads/x.webp', 0)")
+    after = shop.catalog_version()
+    assert after > before
+    other_worker("DELETE FROM product_images WHERE product_id = 1")
+    assert shop.catalog_version() > after
+
+
+@pytest.mark.parametrize("backend", ["local", "redis"])
+def test_restart_does_not_reuse_bootstrap_versions(backend):
+    # redis here is the inprocess:// stand-in, whose counter starts over with every process
+    env = {"SNAPSHOT_BACKEND": backend, "REDIS_URL": "inprocess://", "CATALOG_VERSION_POLL_SECONDS": 0}
+    with common.workdir():
+        seed.seed_catalog("shop.db", products=5, services=0, images=0)
+        server = common.load_server(**env)
+        first = server.app.test_client().get("/api/bootstrap")
+        assert first.status_code == 200
+        etag, versions = first.headers["ETag"].strip('"'), first.get_json()["versions"]
+        server.DB_POOL.clear()
+
+        # edited while no worker was running, then the server comes back
+        other_worker("UPDATE products SET name = ? WHERE id = 1", "Renamed offline")
+        server = common.load_server(**env)
+        client = server.app.test_client()
+        try:
+            again = client.get("/api/bootstrap", headers={"If-None-Match": f'"{etag}"'})
+            assert again.status_code == 200
+            assert again.get_json()["products"]["items"][0]["name"] == "Renamed offline"
+
+            partial = client.get(f"/api/bootstrap?versions=products:{versions['products']}")
+            assert "products" not in partial.get_json()["unchanged"]
+            assert partial.get_json()["products"]["items"][0]["name"] == "Renamed offline"
+        finally:
+            server.DB_POOL.clear()
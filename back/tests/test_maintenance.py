@@ -0,0 +1,34 @@
+import time
+
+import maintenance
+
+
+def test_single_tasks_run_in_one_process_only(tmp_path):
+    # two worker processes' schedulers sharing one lock file
+    ran = []
+    lock = str(tmp_path / "maintenance.lock")
+    workers = [maintenance.Scheduler(lock_path=lock, tick=0.01) for _ in range(2)]
+    for i, sched in enumerate(workers):
+        sched.add("backup", lambda i=i: ran.append(("backup", i)), 3600, run_at_start=True, single=True)
+        sched.add("optimize", lambda i=i: ran.append(("optimize", i)), 3600, run_at_start=True)
+        sched.start()
+    try:
+        deadline = time.monotonic() + 2
+        while len(ran) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+    finally:
+        for sched in workers:
+            sched.stop()
+    assert sorted(name for name, _ in ran) == ["backup", "optimize", "optimize"]
+    assert [s.leader() for s in workers].count(True) == 1
+
+
+def test_lock_taken_over_when_leader_goes_away(tmp_path):
+    lock = str(tmp_path / "maintenance.lock")
+    first, second = maintenance.try_lock(lock), maintenance.try_lock(lock)
+    assert first is not None and second is None
+    first.close()  # the process holding it exits
+    third = maintenance.try_lock(lock)
+    assert third is not None
+    third.close()
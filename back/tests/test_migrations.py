@@ -0,0 +1,55 @@
+"""
+init_db migrations replayed from scratch and from an older schema version:
+each one creates what it created when it shipped, and the end result has
+the shape the runtime modules expect.
+"""
+import sqlite3
+from contextlib import closing
+
+import eventqueue
+import init_db
+
+
+def migrate_to(path, version=None, monkeypatch=None):
+    if version is not None:
+        monkeypatch.setattr(init_db, "MIGRATIONS", [m for m in init_db.MIGRATIONS if m[0] <= version])
+    with closing(sqlite3.connect(path, isolation_level=None)) as conn:
+        init_db.migrate(conn)
+    if version is not None:
+        monkeypatch.undo()
+
+
+def shape(conn, table: str) -> tuple:
+    indexes = sorted(conn.execute(f"PRAGMA index_list({table})").fetchall(), key=lambda r: r[1])
+    return (conn.execute(f"PRAGMA table_xinfo({table})").fetchall(),
+            [(name, unique, partial, conn.execute(f"PRAGMA index_xinfo({name})").fetchall())
+             for _, name, unique, _, partial in indexes])
+
+
+def test_fresh_database_matches_runtime_schema(tmp_path):
+    migrate_to(tmp_path / "shop.db")
+    runtime = sqlite3.connect(":memory:")
+    eventqueue.create_table(runtime)
+    with closing(sqlite3.connect(tmp_path / "shop.db")) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == init_db.latest_version()
+        assert shape(conn, "webhook_events") == shape(runtime, "webhook_events")
+
+
+def test_webhook_events_upgraded_from_version_13(tmp_path, monkeypatch):
+    path = tmp_path / "shop.db"
+    migrate_to(path, 13, monkeypatch)
+    with closing(sqlite3.connect(path)) as conn:
+        assert "verified" not in [c[1] for c in conn.execute("PRAGMA table_info(webhook_events)")]
+        conn.executemany("""
+            INSERT INTO webhook_events (event_id, source, event_type, body, status, next_attempt_at)
+            VALUES (?, 'paypal', 'PAYMENT.CAPTURE.COMPLETED', '{}', ?, 0)
+        """, [("WH-1", "done"), ("WH-2", "pending")])
+        conn.commit()
+
+    migrate_to(path)
+    with closing(sqlite3.connect(path)) as conn:
+        rows = conn.execute("SELECT event_id, delivery, verified, status FROM webhook_events ORDER BY id").fetchall()
+        assert rows == [("WH-1", "WH-1", 1, "done"), ("WH-2", "WH-2", 0, "pending")]
+        runtime = sqlite3.connect(":memory:")
+        eventqueue.create_table(runtime)
+        assert shape(conn, "webhook_events") == shape(runtime, "webhook_events")
@@ -0,0 +1,49 @@
+import sqlite3
+import time
+from contextlib import closing
+
+import pytest
+
+import init_db
+import revocation
+
+
+@pytest.fixture
+def connect(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_db.create_or_update_db_table()
+    with closing(sqlite3.connect("shop.db")) as conn:
+        conn.execute("INSERT INTO users (id, email, username, password_hash, salt) VALUES (1, 'a@b.c', 'a', 'x', 'y')")
+        conn.commit()
+    return lambda: sqlite3.connect("shop.db")
+
+
+def test_other_worker_sees_revocation_on_next_due_check(connect):
+    # two worker processes, each with its own list
+    here, there = revocation.RevocationList(), revocation.RevocationList()
+    for rl in (here, there):
+        with closing(connect()) as conn:
+            rl.load(conn)
+    token = {"user_id": 1, "jti": "t1", "gen": 0}
+
+    with closing(connect()) as conn:
+        here.revoke_token(conn, "t1", 1, int(time.time()) + 3600)
+    assert here.is_revoked(token)
+
+    assert there.sync_if_due(connect, interval=60) is None  # not due yet: no query
+    assert not there.is_revoked(token)
+    there.synced_at -= 60
+    assert there.sync_if_due(connect, interval=60) == 1
+    assert there.is_revoked(token)
+
+
+def test_password_change_reaches_other_worker(connect):
+    here, there = revocation.RevocationList(), revocation.RevocationList()
+    for rl in (here, there):
+        with closing(connect()) as conn:
+            rl.load(conn)
+    with closing(connect()) as conn:
+        generation = here.revoke_user(conn, 1, 3600)
+    assert there.sync_if_due(connect, interval=0) == 1
+    assert there.is_revoked({"user_id": 1, "gen": generation - 1})
+    assert not there.is_revoked({"user_id": 1, "gen": generation})
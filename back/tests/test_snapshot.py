@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+import snapshot
+
+
+def test_mmap_eviction_keeps_encoded_variants(tmp_path):
+    store = snapshot.MmapStore(str(tmp_path))
+    store.put("products", 1, b"plain-1")
+    store.put("products.gzip", 1, b"gzip-1")
+    gz = store.get("products.gzip", 1)
+    assert bytes(store.get("products", 1)) == b"plain-1"
+    # reading "products" must not have evicted the gzip mapping
+    assert store.get("products.gzip", 1) is gz
+
+    store.put("products", 2, b"plain-2")
+    assert bytes(store.get("products", 2)) == b"plain-2"
+    assert store.get("products.gzip", 1) is gz
+
+
+def test_mmap_eviction_drops_old_version(tmp_path):
+    store = snapshot.MmapStore(str(tmp_path))
+    store.put("products", 1, b"v1")
+    store.get("products", 1)
+    store.put("products", 2, b"v2")
+    store.get("products", 2)
+    assert [p for p in store._maps if "products.1.snap" in p] == []
+
+
+def test_mmap_shared_between_instances(tmp_path):
+    a, b = snapshot.MmapStore(str(tmp_path)), snapshot.MmapStore(str(tmp_path))
+    a.put("products", a.version(), b"listing")
+    assert bytes(b.get("products", b.version())) == b"listing"
+    version = a.bump()
+    assert b.version() == version
+    assert b.get("products", version) is None
+
+
+@pytest.fixture
+def redis_pair():
+    client = snapshot.InProcessRedis()
+    return (snapshot.RedisStore(client, poll_interval=0.05), snapshot.RedisStore(client, poll_interval=0.05))
+
+
+def test_redis_publish_and_read_from_other_store(redis_pair):
+    a, b = redis_pair
+    version = a.bump()
+    a.put("products", version, b"listing")
+    a.put("products.gzip", version, b"gzipped")
+    assert b.get("products", b.version()) == b"listing"
+    assert b.get("products.gzip", b.version()) == b"gzipped"
+
+
+def test_redis_version_bump_reaches_other_store(redis_pair):
+    a, b = redis_pair
+    before = b.version()
+    after = a.bump()
+    assert a.version() == after  # the bumping store sees it right away
+    time.sleep(0.06)  # the other one within poll_interval
+    assert b.version() == after != before
+    assert b.get("products", after) is None
+    a.put("products", after, b"new")
+    assert b.get("products", b.version()) == b"new"
+
+
+def test_inprocess_redis_expiry():
+    client = snapshot.InProcessRedis()
+    client.set("k", b"v", ex=0.01)
+    assert client.get("k") == b"v"
+    time.sleep(0.02)
+    assert client.get("k") is None
+    assert client.incr("n") == 1 and client.incr("n", 2) == 3
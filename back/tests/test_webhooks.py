@@ -0,0 +1,180 @@
+"""
+PayPal webhooks end to end: the server on a real socket, PayPal played by
+bench/paypal_stub.py, deliveries sent with bench/webhook_replay.py. No
+webhook worker threads (WEBHOOK_WORKERS=0): each test drains the queue
+itself, so every step is deterministic.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import closing
+from types import SimpleNamespace
+
+import pytest
+
+from bench import common, seed, webhook_replay
+from bench.api import http_json
+from bench.paypal_stub import WEBHOOK_ID, capture_completed_event, deliver, sign_webhook, start_stub
+
+
+@pytest.fixture(scope="module")
+def shop():
+    from werkzeug.serving import make_server
+    stub, stub_url = start_stub()
+    with common.workdir():
+        seed.seed_catalog("shop.db", products=20, services=0, images=0)
+        server = common.load_server(
+            PAYPAL_API_BASE=stub_url, PAYPAL_CLIENT_ID="test", PAYPAL_CLIENT_SECRET="test",
+            PAYPAL_WEBHOOK_ID=WEBHOOK_ID, PAYPAL_WEBHOOK_CAPTURE_DELAY=0, WEBHOOK_WORKERS=0,
+            WEBHOOK_RETRY_SECONDS=0)
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{httpd.server_port}"
+        try:
+            yield SimpleNamespace(server=server, queue=server.WEBHOOK_QUEUE, stub=stub, stub_url=stub_url,
+                                  base=base, hook=f"{base}/api/paypal/webhook")
+        finally:
+            httpd.shutdown()
+            stub.shutdown()
+            server.DB_POOL.clear()
+
+
+def checkout(shop, customer: bool = False):
+    """A stored checkout (PayPal order id, total), already paid at the stub."""
+    headers = None
+    if customer:
+        status, login = http_json("POST", f"{shop.base}/api/auth/login", {"email": seed.USER_EMAIL, "password": seed.PASSWORD})
+        assert status == 200, login
+        headers = {"Authorization": f"Bearer {login['token']}"}
+    status, data = http_json("POST", f"{shop.base}/api/paypal/create-order",
+                             {"items": [{"id": 1, "kind": "product", "qty": 1}]}, headers)
+    assert status == 200, data
+    # PayPal took the money, our capture-order response never reached the browser
+    http_json("POST", f"{shop.stub_url}/v2/checkout/orders/{data['id']}/capture", {})
+    return data["id"], f"{data['amounts']['total']:.2f}"
+
+
+def rows(shop, event_id: str) -> list:
+    with closing(shop.server.db()) as conn:
+        return conn.execute("SELECT status, verified, attempts FROM webhook_events WHERE event_id=? ORDER BY id",
+                            (event_id,)).fetchall()
+
+
+def captured(shop, paypal_order_id: str) -> bool:
+    with closing(shop.server.db()) as conn:
+        row = conn.execute("SELECT captured_at FROM checkouts WHERE paypal_order_id=?", (paypal_order_id,)).fetchone()
+    return row is not None and row[0] is not None
+
+
+def test_duplicate_delivery_stored_once(shop):
+    order_id, value = checkout(shop)
+    event = capture_completed_event(order_id, value)
+    headers = sign_webhook(json.dumps(event).encode("utf-8"))
+    first, again = deliver(shop.hook, event, headers=headers), deliver(shop.hook, event, headers=headers)
+    assert first[0] == again[0] == 200
+    assert json.loads(first[1])["duplicate"] is False and json.loads(again[1])["duplicate"] is True
+    assert rows(shop, event["id"]) == [("pending", 0, 0)]
+
+    assert shop.queue.drain() == 1
+    # once the event has a verified delivery, redeliveries (signed afresh) aren't stored at all
+    [(_, status, body)] = webhook_replay.send_events(shop.hook, [event], repeat=1)
+    assert status == 200 and json.loads(body)["duplicate"] is True
+    assert rows(shop, event["id"]) == [("done", 1, 1)]
+
+
+def test_bad_signature_rejected(shop):
+    order_id, value = checkout(shop)
+    event = capture_completed_event(order_id, value)
+    [(_, status, _)] = webhook_replay.send_events(shop.hook, [event], webhook_id="SOMEONE-ELSE")
+    assert status == 200  # acknowledged, checked by the worker
+    [(_, status, _)] = webhook_replay.send_events(shop.hook, [event], unsigned=True)
+    assert status == 400  # no PAYPAL-* headers: not even stored
+
+    shop.queue.drain()
+    assert rows(shop, event["id"]) == [("rejected", 0, 1)]
+    assert not captured(shop, order_id)
+
+    # the forged delivery didn't reserve the event id: the genuine one still goes through
+    webhook_replay.send_events(shop.hook, [event])
+    shop.queue.drain()
+    assert rows(shop, event["id"]) == [("rejected", 0, 1), ("done", 1, 1)]
+    assert captured(shop, order_id)
+
+
+def test_failing_handler_retried_then_failed(shop, monkeypatch):
+    calls = []
+
+    def broken(event, paypal_order_id):
+        calls.append(event["id"])
+        raise RuntimeError("database on fire")
+
+    monkeypatch.setitem(shop.server.WEBHOOK_HANDLERS, "PAYMENT.CAPTURE.COMPLETED", broken)
+    monkeypatch.setattr(shop.queue, "max_attempts", 3)
+    order_id, value = checkout(shop)
+    event = capture_completed_event(order_id, value)
+    verified_before = shop.stub.verifications.get(True, 0)
+    webhook_replay.send_events(shop.hook, [event])
+
+    assert shop.queue.drain() == 3  # retry delay is 0 here: attempt, retry, retry
+    assert calls == [event["id"]] * 3
+    assert rows(shop, event["id"]) == [("failed", 1, 3)]
+    assert shop.stub.verifications.get(True, 0) == verified_before + 1  # verified once, not per attempt
+    with closing(shop.server.db()) as conn:
+        error = conn.execute("SELECT last_error FROM webhook_events WHERE event_id=?", (event["id"],)).fetchone()[0]
+    assert "database on fire" in error
+
+    monkeypatch.undo()
+    assert shop.queue.retry([event["id"]], "failed") == 1
+    shop.queue.drain()
+    assert rows(shop, event["id"]) == [("done", 1, 1)]
+    assert captured(shop, order_id)
+
+
+def test_expired_lease_lets_another_worker_claim(shop, monkeypatch):
+    order_id, value = checkout(shop)
+    event = capture_completed_event(order_id, value)
+    webhook_replay.send_events(shop.hook, [event])
+
+    monkeypatch.setattr(shop.queue, "lease", 0.2)
+    dead = shop.queue.claim()  # a worker that dies before finishing
+    assert dead["event_id"] == event["id"]
+    assert shop.queue.claim() is None  # leased, nobody else gets it
+    time.sleep(0.3)
+    monkeypatch.setattr(shop.queue, "lease", 120.0)
+
+    assert shop.queue.drain() == 1
+    assert rows(shop, event["id"]) == [("done", 1, 2)]
+    assert captured(shop, order_id)
+
+
+def test_capture_completed_completes_checkout(shop):
+    def sales():
+        with closing(shop.server.db()) as conn:
+            return conn.execute("SELECT COALESCE(SUM(orders), 0) FROM sales_daily_totals").fetchone()[0]
+
+    order_id, value = checkout(shop, customer=True)
+    assert not captured(shop, order_id)
+    sales_before = sales()
+    event = capture_completed_event(order_id, value)
+    webhook_replay.send_events(shop.hook, [event], repeat=2)  # PayPal redelivers, a new signature each time
+
+    shop.queue.drain()
+    assert captured(shop, order_id)
+    assert [verified for _, verified, _ in rows(shop, event["id"])].count(1) == 1
+    with closing(shop.server.db()) as conn:
+        orders = conn.execute("SELECT COUNT(*) FROM orders WHERE paypal_order_id=?", (order_id,)).fetchone()[0]
+    assert orders == 1
+    assert sales() == sales_before + 1
+
+
+def test_unverified_events_capped(shop, monkeypatch):
+    monkeypatch.setattr(shop.queue, "max_unverified", 1)
+    events = [capture_completed_event(checkout(shop)[0], "1.00") for _ in range(2)]
+    (_, first, _), (_, second, _) = webhook_replay.send_events(shop.hook, events)
+    assert (first, second) == (200, 503)  # PayPal retries the second one later
+    shop.queue.drain()
+    [(_, status, _)] = webhook_replay.send_events(shop.hook, events[1:])
+    assert status == 200
+    shop.queue.drain()
@@ -0,0 +1,222 @@
+import collections
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class QueueFull(Exception):
+    pass
+
+
+class WriteBehindQueue:
+    """
+    Bounded in-memory queue drained in batches by one background thread.
+
+    flush(records) must write the whole batch (one transaction) or raise; a
+    failed batch stays queued and is retried after retry_delay seconds.
+    With spool_path set, every accepted record is first appended to that file
+    as a JSON line, and records still in it at start() are queued again. So
+    flush() has to be idempotent: the spool can hold records that already
+    reached the database when the process died.
+
+    Each process needs a spool file of its own (compaction rewrites the whole
+    file). start() takes the first free slot: spool_path, then name.1.ext,
+    name.2.ext ... up to spool_slots, held with an exclusive lock on a
+    ".lock" file next to it for as long as the queue runs. Records a dead
+    process left behind are recovered by whichever process takes its slot.
+    With every slot taken, spooling is off for this process (memory only).
+    """
+
+    def __init__(self, flush, max_size: int = 5000, batch_size: int = 200, interval: float = 0.5,
+                 spool_path: str | None = None, spool_fsync: bool = False, retry_delay: float = 2.0,
+                 on_flush=None, spool_compact_bytes: int = 1024 * 1024, spool_slots: int = 16):
+        self.flush = flush
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self.spool_path = spool_path
+        self.spool_fsync = spool_fsync
+        self.retry_delay = retry_delay
+        self.on_flush = on_flush  # on_flush(count, seconds, error)
+        self.spool_compact_bytes = spool_compact_bytes
+        self.spool_slots = spool_slots
+        self.spool_requested = spool_path
+        self._spool_lock = None
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._flushing = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._spool = None
+        self.accepted = self.rejected = self.flushed = self.failures = self.recovered = 0
+        self.last_error = None
+
+    # --- producer side ---
+
+    def put(self, record: dict):
+        """Queue a record (JSON-serializable). Raises QueueFull when max_size records are waiting."""
+        if self._thread is None:
+            self.start()
+        with self._cond:
+            if len(self._queue) >= self.max_size:
+                self.rejected += 1
+                raise QueueFull()
+            if self._spool is not None:
+                self._spool.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._spool.flush()
+                if self.spool_fsync:
+                    os.fsync(self._spool.fileno())
+            self._queue.append(record)
+            self.accepted += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def pending(self) -> int:
+        return len(self._queue)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._queue),
+            "max_size": self.max_size,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "flushed": self.flushed,
+            "recovered": self.recovered,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "spool": self.spool_path,
+            "spool_requested": self.spool_requested,
+        }
+
+    # --- lifecycle ---
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            if self.spool_requested:
+                self._claim_spool_slot()
+            if self.spool_path:
+                self._recover_spool()
+                self._spool = open(self.spool_path, "a", encoding="utf-8")
+            self._thread = threading.Thread(target=self._loop, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Flush what's left and stop the writer thread."""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.drain()
+        if self._spool_lock is not None:
+            self._spool_lock.close()  # releases the slot
+            self._spool_lock = None
+
+    def drain(self) -> int:
+        """Flush everything queued right now, in the calling thread. Returns records written."""
+        return self._flush_available(retry=False)
+
+    # --- writer side ---
+
+    @staticmethod
+    def _try_lock(path: str):
+        f = open(path, "a+")
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            f.close()
+            return None
+        return f
+
+    def _claim_spool_slot(self):
+        base, ext = os.path.splitext(self.spool_requested)
+        for slot in range(self.spool_slots):
+            path = self.spool_requested if slot == 0 else f"{base}.{slot}{ext}"
+            lock = self._try_lock(path + ".lock")
+            if lock is not None:
+                self._spool_lock = lock
+                self.spool_path = path
+                return
+        self.spool_path = None
+        self.last_error = f"all {self.spool_slots} spool slots of {self.spool_requested} are in use, spooling disabled"
+
+    def _recover_spool(self):
+        if not os.path.exists(self.spool_path):
+            return
+        with open(self.spool_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    self._queue.append(json.loads(line))
+                    self.recovered += 1
+                except ValueError:
+                    continue  # torn last line from a crash mid-write
+
+    def _loop(self):
+        while not self._stop.is_set():
+            with self._cond:
+                if len(self._queue) < self.batch_size:
+                    self._cond.wait(self.interval)
+            self._flush_available(retry=True)
+
+    def _flush_available(self, retry: bool) -> int:
+        written = 0
+        with self._flushing:
+            while True:
+                with self._lock:
+                    batch = [self._queue[i] for i in range(min(self.batch_size, len(self._queue)))]
+                if not batch:
+                    return written
+                t0 = time.perf_counter()
+                try:
+                    self.flush(batch)
+                except Exception as e:
+                    self.failures += 1
+                    self.last_error = f"{type(e).__name__}: {e}"
+                    if self.on_flush:
+                        self.on_flush(0, time.perf_counter() - t0, self.last_error)
+                    if retry:
+                        self._stop.wait(self.retry_delay)
+                    return written
+                with self._lock:
+                    # Only this thread pops, so the batch is still at the front
+                    for _ in batch:
+                        self._queue.popleft()
+                    self.flushed += len(batch)
+                    self.last_error = None
+                    self._compact_spool()
+                written += len(batch)
+                if self.on_flush:
+                    self.on_flush(len(batch), time.perf_counter() - t0, None)
+
+    def _compact_spool(self):
+        """Drop flushed records from the spool file. Caller holds the lock."""
+        if self._spool is None:
+            return
+        if not self._queue:
+            self._spool.truncate(0)
+            return
+        if os.fstat(self._spool.fileno()).st_size < self.spool_compact_bytes:
+            return
+        tmp = self.spool_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for record in self._queue:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._spool.close()
+        os.replace(tmp, self.spool_path)
+        self._spool = open(self.spool_path, "a", encoding="utf-8")
@@ -2,6 +2,8 @@ import { useEffect, useState } from 'react';
 import { useNavigate } from 'react-router-dom';
 
 const API_BASE = 'http://127.0.0.1:5000';
+const isUrl = (s) => typeof s === 'string' && /^https?:\/\//i.test(s);
+const withBase = (u) => (!u ? null : isUrl(u) ? u : `${API_BASE}${u.startsWith('/') ? '' : '/'}${u}`);
 
 export default function Account() {
   const nav = useNavigate();
@@ -10,6 +12,21 @@ export default function Account() {
   const [me, setMe] = useState({ email: '', username: '', address: '' });
   const [pwd, setPwd] = useState({ current_password: '', new_password: '', confirm: '' });
   const [msg, setMsg] = useState('');
+  const [orders, setOrders] = useState([]);
+  const [nextBefore, setNextBefore] = useState(null);
+
+  const loadOrders = async (before = null) => {
+    try {
+      const q = before ? `?before=${before}` : '';
+      const r = await fetch(`${API_BASE}/api/user/orders${q}`, { headers: { Authorization: `Bearer ${token}` }});
+      if (!r.ok) throw new Error(await r.text());
+      const data = await r.json();
+      setOrders(prev => before ? [...prev, ...data.orders] : data.orders);
+      setNextBefore(data.next_before);
+    } catch (e) {
+      setMsg('Failed to load orders');
+    }
+  };
 
   useEffect(() => {
     const run = async () => {
@@ -24,6 +41,7 @@ export default function Account() {
       }
     };
     run();
+    if (token) loadOrders();
   }, [token]);
 
   const saveProfile = async () => {
@@ -51,12 +69,21 @@ export default function Account() {
       });
       const data = await r.json();
       if (!r.ok) throw new Error(data?.error || 'Password change failed');
+      // Old tokens are revoked on password change; keep this session with the new one
+      if (data.token) localStorage.setItem('userToken', data.token);
       setMsg('Password changed');
       setPwd({ current_password: '', new_password: '', confirm: '' });
     } catch (e) { setMsg(e.message); }
   };
 
-  const logout = () => { localStorage.removeItem('userToken'); nav('/'); };
+  const logout = async () => {
+    // Revoke the token server-side first: a copy of it must not outlive the logout
+    try {
+      await fetch(`${API_BASE}/api/auth/logout`, { method: 'POST', headers: auth });
+    } catch { /* offline: still log out locally */ }
+    localStorage.removeItem('userToken');
+    nav('/');
+  };
 
   return (
     <div className="min-h-screen bg-neutral-950 text-white pt-16">
@@ -92,6 +119,30 @@ export default function Account() {
             <button className="rounded bg-neutral-800 hover:bg-neutral-700 px-4 py-2" onClick={logout}>Logout</button>
           </div>
         </div>
+
+        <div className="mt-6 rounded-xl border border-white/10 bg-neutral-900/60 p-4">
+          <h2 className="text-lg font-semibold">Orders</h2>
+          {orders.length === 0 && <p className="mt-2 text-sm text-neutral-400">No orders yet.</p>}
+          {orders.map(o => (
+            <div key={o.id} className="mt-4 border-t border-white/10 pt-4">
+              <div className="flex justify-between text-sm">
+                <span className="font-semibold">Order #{o.id}</span>
+                <span className="text-neutral-300">{o.created_at} · {o.status}{o.shipping_date ? ` · shipped ${o.shipping_date}` : ''}</span>
+              </div>
+              {o.items.map((it, i) => (
+                <div key={i} className="mt-2 flex items-center gap-3 text-sm">
+                  {it.image_url && <img src={withBase(it.image_url)} alt="" className="h-10 w-10 rounded object-cover" />}
+                  <span className="flex-1">{it.name} × {it.qty}</span>
+                  <span>{(it.unit_price * it.qty).toFixed(2)} {o.currency}</span>
+                </div>
+              ))}
+              <div className="mt-2 text-right text-sm font-semibold">Total {o.total?.toFixed(2)} {o.currency}</div>
+            </div>
+          ))}
+          {nextBefore && (
+            <button className="mt-4 rounded bg-neutral-800 hover:bg-neutral-700 px-4 py-2" onClick={() => loadOrders(nextBefore)}>Load more</button>
+          )}
+        </div>
       </div>
     </div>
   );
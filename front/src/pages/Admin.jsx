@@ -282,7 +282,12 @@ export default function Admin() {
     );
   }
 
-  function handleLogout(){ localStorage.removeItem('userToken'); window.location.reload(); }
+  async function handleLogout(){
+    // Revoke the token server-side first: a copy of it must not outlive the logout
+    try { await api.post('/api/auth/logout', {}, { headers }); } catch { /* offline: still log out locally */ }
+    localStorage.removeItem('userToken');
+    window.location.reload();
+  }
 
   return (
     <div className="min-h-screen bg-neutral-950 text-white">
@@ -178,9 +178,10 @@ export default function Checkout() {
             items: items.map(it => ({ id: it.id, kind: it.kind, qty: it.qty || 1 })),
             discount_code: promo?.code || null
           };
+          // Logged in: the order shows up in the account's order history once captured
           const res = await fetch(`${API_BASE}/api/paypal/create-order`, {
             method: "POST",
-            headers: { "Content-Type": "application/json" },
+            headers: token ? auth : { "Content-Type": "application/json" },
             body: JSON.stringify(payload),
           });
           const data = await res.json();
@@ -202,7 +203,6 @@ export default function Checkout() {
           }
           // success
           setToast("Payment completed");
-          // (optional: you can POST an /api/orders here to persist)
           clear();
           setTimeout(() => nav("/account"), 800);
         },